@@ -7,20 +7,33 @@ class JobsConfig(AppConfig):
 
     def ready(self):
         # Must import models here to avoid AppRegistryNotReady exception
-        from .tasks import process_job
+        from .tasks import resume_job
         from .models import Job
         from ..utils.core import is_main_thread
         from ...celery import app
-        from ...settings import INQUEUE_STATUS, COMPLETED_STATUS, FAILED_STATUS
+        from ...settings import COMPLETED_STATUS, FAILED_STATUS, CANCELLED_STATUS
+        from django.db.models.signals import post_save, post_delete
+        from .models import JobEvent
+        from .events import publish_job_status, publish_job_log
+        from .status import mirror_job_status, forget_job_status, record_job_removal
+
+        # Publish changes to jobs on the event bus (see events.py)
+        post_save.connect(publish_job_status, sender=Job)
+        post_save.connect(publish_job_log, sender=JobEvent)
+
+        # Keep the status mirror up to date (see status.py)
+        post_save.connect(mirror_job_status, sender=Job)
+        post_delete.connect(forget_job_status, sender=Job)
+
+        # Record removed jobs, for job tables to sync (see JSONJobs)
+        post_delete.connect(record_job_removal, sender=Job)
 
         if is_main_thread():  # pragma: no cover
             num_purged = app.control.purge()
             print('Purged', num_purged, 'tasks.')
             unfinished_jobs = Job.objects.exclude(
-                status__in=[COMPLETED_STATUS, FAILED_STATUS])
+                status__in=[COMPLETED_STATUS, FAILED_STATUS, CANCELLED_STATUS])
             for job in unfinished_jobs:
-                print(' * Restarting unfinished job',
+                print(' * Resuming unfinished job',
                       job.job_id, 'with status', job.status)
-                job.status = INQUEUE_STATUS
-                job.save()
-                process_job.delay(job.job_id)
+                resume_job(job)
@@ -0,0 +1,265 @@
+import os
+import re
+import zlib
+import lzma
+import tarfile
+import zipfile
+import tempfile
+from .uploads import InvalidSubmission
+from ...settings import (
+    SUPPORTED_ARCHIVES,
+    MAX_EXTRACTED_SIZE,
+    MAX_EXTRACTED_FILES,
+    MAX_ARCHIVE_DEPTH
+)
+
+# Archive ingestion - the archive of a class (of a folder or archive per
+# student) is read a file at a time, and the source files of each student
+# are written, one after another, to a single submission (see NewFromArchive)
+READ_CHUNK_SIZE = 256 * 1024  # Bytes, extracted at a time
+SPOOL_SIZE = 16 * 1024 * 1024  # Bytes, of a nested archive kept in memory (rather than a temporary file)
+
+# Folders and files which are not part of a submission
+IGNORED_NAMES = ('__MACOSX',)
+
+# Files renamed by Vula (e.g., "code.tar+1.gz" for "code+1.tar.gz")
+VULA_RENAMING_REGEX = r'(.*)(\..*)(\+\d+)(\..*)$'
+
+# Errors reading an archive (zipfile raises RuntimeError for encrypted members,
+# and NotImplementedError for unsupported compression methods)
+ARCHIVE_ERRORS = (zipfile.BadZipFile, tarfile.TarError, zlib.error, lzma.LZMAError, EOFError, OSError,
+                  RuntimeError, NotImplementedError)
+
+
+class ArchiveError(InvalidSubmission):
+    """Raised when an archive cannot be read, or exceeds a limit"""
+
+
+class ExtractionWriteError(Exception):
+    """Raised when an extracted file cannot be written (e.g., the disk is full), so
+    that it is not mistaken for an error reading the archive"""
+
+
+def writing(write):
+    """Wrap a function which writes extracted data, raising ExtractionWriteError if it fails"""
+    def wrapped(data):
+        try:
+            write(data)
+        except OSError as e:
+            raise ExtractionWriteError(f'Unable to write extracted file ({e})') from e
+    return wrapped
+
+
+def split_path(path):
+    """Split the path of a file in an archive into its (relative) components"""
+    return [part for part in path.replace('\\', '/').split('/') if part not in ('', '.')]
+
+
+def normalise_name(name):
+    """Undo the renaming of files by Vula"""
+    return re.sub(VULA_RENAMING_REGEX, r'\1\3\2\4', name)
+
+
+def get_archive_extension(name):
+    """Get the (supported) archive extension of a file's name, or None if it is not an archive"""
+    name = normalise_name(name).lower()
+    for extension in sorted(SUPPORTED_ARCHIVES, key=len, reverse=True):
+        if name.endswith(f'.{extension}'):
+            return extension
+    return None
+
+
+def list_zip(fileobj):
+    # From the central directory (contents are read up to their listed size)
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            yield None if info.is_dir() else info.filename, info.file_size
+
+
+def iter_zip(fileobj):
+    with zipfile.ZipFile(fileobj) as archive:
+        for info in archive.infolist():
+            if not info.is_dir():
+                with archive.open(info) as member:
+                    yield info.filename, member
+
+
+def list_tar(fileobj):
+    # From the headers (each member's contents are only decompressed, to
+    # skip them, once the next header is read)
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for info in archive:
+            yield info.name if info.isfile() else None, info.size
+
+
+def iter_tar(fileobj):
+    # Read as a stream (members in order, without seeking)
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for info in archive:
+            if info.isfile():
+                yield info.name, archive.extractfile(info)
+
+
+# Readers of each type of archive: which list the path (None if not a file)
+# and size of each member, and which yield the path and contents of each file
+ARCHIVE_READERS = {
+    'zip': (list_zip, iter_zip),
+    'tar': (list_tar, iter_tar)
+}
+
+
+def get_reader(extension):
+    return ARCHIVE_READERS.get(extension.split('.')[0], (None, None))
+
+
+class ArchiveIngestor:
+    """Extracts the source files of a class's archive into one submission per student.
+
+    Students are the folders (or archives, or files) at the archive's root: the
+    deepest folder containing all files. Archives within a student's folder
+    (e.g., their attachments) are extracted too, up to MAX_ARCHIVE_DEPTH.
+    Archives which cannot be read (e.g., encrypted) within a student's folder
+    are skipped, but errors writing their files are not.
+    Each source file (by the job language's extensions) is written as
+    ">>> path <<<" followed by its contents, as when extracted by the browser.
+
+    The listed size and number of every member of each archive (including those
+    which are not extracted) are limited, and checked before it is extracted.
+    """
+
+    def __init__(self, extensions, create_writer, max_size=MAX_EXTRACTED_SIZE,
+                 max_files=MAX_EXTRACTED_FILES, max_depth=MAX_ARCHIVE_DEPTH):
+        self.extensions = tuple(f'.{extension.lower()}' for extension in extensions)
+        self.create_writer = create_writer  # Creates the writer of a student's submission, given their name
+        self.max_size = max_size
+        self.max_files = max_files
+        self.max_depth = max_depth
+
+        self.writers = {}  # By student
+        self.skipped = []  # Archives which could not be read
+        self.size = 0
+        self.num_files = 0
+        self._current = None
+
+    def is_relevant(self, path):
+        parts = split_path(path)
+        if not parts or any(part.startswith('.') or part in IGNORED_NAMES for part in parts):
+            return False
+        return parts[-1].lower().endswith(self.extensions) or get_archive_extension(parts[-1]) is not None
+
+    def ingest(self, fileobj, name):
+        """Extract a class's archive (a seekable file, as it is read twice)
+
+        :return: The writers of each student's submission (by name)
+        :rtype: dict
+        """
+
+        extension = get_archive_extension(name)
+        lister, reader = get_reader(extension) if extension else (None, None)
+        if reader is None:
+            raise ArchiveError(f'Unsupported archive ({name})')
+
+        try:
+            # The archive's root is found from the paths of all of its files
+            # (before any are extracted), read from the zip's central
+            # directory, or from a first pass through the tar's headers
+            root = get_root(self._list(lister, fileobj))
+
+            fileobj.seek(0)
+            for path, member in reader(fileobj):
+                if self.is_relevant(path):
+                    self._extract(get_student(path, root), split_path(path)[root:], member, 1)
+        except ARCHIVE_ERRORS as e:
+            raise ArchiveError(f'Unable to read archive ({name})') from e
+        finally:
+            if self._current is not None:
+                self._current.pause()
+
+        return self.writers
+
+    def _list(self, lister, fileobj):
+        """List the relevant paths of an archive, counting the size of every member
+        (relevant or not) towards the limits, before any are extracted"""
+
+        paths = []
+        for path, size in lister(fileobj):
+            self.num_files += 1
+            if self.num_files > self.max_files:
+                raise ArchiveError(f'Archive contains too many files (more than {self.max_files})')
+
+            self.size += size
+            if self.size > self.max_size:
+                raise ArchiveError(f'Archive is too large when extracted (more than {self.max_size} bytes)')
+
+            if path is not None and self.is_relevant(path):
+                paths.append(path)
+        return paths
+
+    def _extract(self, student, parts, member, depth):
+        name = parts[-1]
+        extension = get_archive_extension(name)
+        if extension is None:
+            write = writing(self._get_writer(student).write)
+            write(f'>>> {"/".join(parts)} <<<\n'.encode())
+            self._copy(member, write)
+            write(b'\n\n')
+            return
+
+        if depth >= self.max_depth:
+            raise ArchiveError(f'Archives are nested too deeply (more than {self.max_depth} levels)')
+
+        lister, reader = get_reader(extension)
+        if reader is None:
+            self.skipped.append('/'.join(parts))
+            return
+
+        # Nested archives are spooled, as zips must be read from their end
+        # (only errors reading it are skipped, not errors writing its files)
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE) as spool:
+            self._copy(member, writing(spool.write))
+            spool.seek(0)
+            try:
+                self._list(lister, spool)
+                spool.seek(0)
+                for path, nested in reader(spool):
+                    if self.is_relevant(path):
+                        self._extract(student, split_path(path), nested, depth + 1)
+            except ARCHIVE_ERRORS:
+                self.skipped.append('/'.join(parts))
+
+    def _get_writer(self, student):
+        writer = self.writers.get(student)
+        if writer is None:
+            writer = self.writers[student] = self.create_writer(student)
+
+        # Only the current student's file is kept open
+        if self._current is not writer:
+            if self._current is not None:
+                self._current.pause()
+            self._current = writer
+        return writer
+
+    def _copy(self, member, write):
+        # Members are read up to their listed size (already counted)
+        while chunk := member.read(READ_CHUNK_SIZE):
+            write(chunk)
+
+
+def get_root(paths):
+    """Get the depth of an archive's root (the deepest folder containing all of the given paths)"""
+    return len(os.path.commonprefix([split_path(path)[:-1] for path in paths]))
+
+
+def get_student(path, root):
+    """Get the name of the student a file belongs to: its folder at the archive's root
+    (or, for files at the root, its name without extension)"""
+
+    parts = split_path(path)
+    if len(parts) > root + 1:
+        return parts[root]
+
+    name = normalise_name(parts[-1])
+    extension = get_archive_extension(name)
+    if extension is not None:
+        return name[:-len(extension) - 1]
+    return name.rsplit('.', 1)[0]
@@ -0,0 +1,248 @@
+import asyncio
+import weakref
+import threading
+import redis
+import redis.asyncio
+from ...redis import REDIS_INSTANCE, REDIS_HOST, REDIS_PORT
+from ...settings import CANCEL_POLL_INTERVAL
+
+# Cancellation - flags checked by the worker processing a job, which stops
+# cooperatively. Cancellations are also published, so that workers waiting on
+# MOSS are interrupted without polling (flags are only checked every
+# CANCEL_POLL_INTERVAL, in case a cancellation was missed)
+CANCEL_KEY_TEMPLATE = 'JOB_CANCELLED:{job_id}'
+CANCEL_CHANNEL_TEMPLATE = 'JOB_CANCELLATIONS:{job_id}'
+ALL_CANCELLATIONS_PATTERN = CANCEL_CHANNEL_TEMPLATE.format(job_id='*')
+CANCEL_FLAG_TIME = 7 * 24 * 60 * 60  # Seconds, after which the flag is no longer needed
+CANCEL_WAIT_TIME = 0.5  # Seconds, waited for a cancellation at a time (between checks for being stopped)
+
+
+class JobCancelled(Exception):
+    """Raised (by the worker processing a job) when the job has been cancelled"""
+
+
+def _get_key(job_id):
+    return CANCEL_KEY_TEMPLATE.format(job_id=job_id)
+
+
+def _get_channel(job_id):
+    return CANCEL_CHANNEL_TEMPLATE.format(job_id=job_id)
+
+
+def cancel_job(job_id):
+    """Flag a job as cancelled (and notify the worker waiting on it, if any)"""
+    pipeline = REDIS_INSTANCE.pipeline()
+    pipeline.set(_get_key(job_id), 1, ex=CANCEL_FLAG_TIME)
+    pipeline.publish(_get_channel(job_id), 1)
+    pipeline.execute()
+
+
+def clear_cancelled(job_id):
+    """Remove a job's cancellation flag (e.g., when it is retried)"""
+    REDIS_INSTANCE.delete(_get_key(job_id))
+
+
+def is_cancelled(job_id):
+    """Whether a job has been flagged as cancelled"""
+    return bool(REDIS_INSTANCE.exists(_get_key(job_id)))
+
+
+def check_cancelled(job_id):
+    """Raise JobCancelled if a job has been flagged as cancelled"""
+    if is_cancelled(job_id):
+        raise JobCancelled(f'Job {job_id} was cancelled')
+
+
+def _call_hooks(hooks):
+    for f in hooks:
+        try:
+            f()
+        except Exception:
+            pass  # e.g., connection already closed
+
+
+class CancellationWatcher:
+    """Watches for a job to be cancelled while the worker is blocked (e.g., waiting for MOSS).
+
+    While used as a context manager, the job's cancellations are listened for
+    in the background (and its flag is checked every poll_interval). Once it is
+    cancelled, `cancelled` is set and every hook (e.g., one which aborts a
+    connection) is called, from the watcher's thread.
+    """
+
+    def __init__(self, job_id, poll_interval=CANCEL_POLL_INTERVAL):
+        self.job_id = job_id
+        self.poll_interval = poll_interval
+
+        self.cancelled = False
+        self._hooks = []
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._watcher = None
+
+    def add_hook(self, f):
+        """Call f once the job is cancelled (immediately, if it already has been)"""
+        with self._lock:
+            if not self.cancelled:
+                self._hooks.append(f)
+                return
+        f()
+
+    def _wait(self, pubsub):
+        """Wait for the job to be cancelled, until stopped"""
+        pubsub.subscribe(_get_channel(self.job_id))
+        while not self._stopped.is_set():
+            # Flag is checked once subscribed, so earlier cancellations are not missed
+            if is_cancelled(self.job_id):
+                return True
+
+            waited = 0
+            while waited < self.poll_interval and not self._stopped.is_set():
+                if pubsub.get_message(timeout=CANCEL_WAIT_TIME) is not None:
+                    return True
+                waited += CANCEL_WAIT_TIME
+        return False
+
+    def _watch(self):
+        while not self._stopped.is_set():
+            pubsub = REDIS_INSTANCE.pubsub(ignore_subscribe_messages=True)
+            try:
+                cancelled = self._wait(pubsub)
+            except redis.RedisError:
+                self._stopped.wait(self.poll_interval)  # Reconnect on the next poll
+                continue
+            finally:
+                pubsub.close()
+
+            if cancelled:
+                with self._lock:
+                    self.cancelled = True
+                    hooks, self._hooks = self._hooks, []
+                _call_hooks(hooks)
+            break
+
+    def __enter__(self):
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+        self._watcher.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stopped.set()
+        self._watcher.join()
+
+
+class CancellationListener:
+    """Listens for the cancellation of the jobs being watched on an event loop (see
+    AsyncCancellationWatcher), using a single task and subscription for all of them.
+
+    The flags of all watched jobs are checked at once (every poll_interval, and
+    when a job starts being watched). The listener stops once no jobs are watched.
+    """
+
+    def __init__(self, poll_interval=CANCEL_POLL_INTERVAL):
+        self.poll_interval = poll_interval
+        self.callbacks = {}  # By job ID
+        self._task = None
+        self._check_flags = True
+
+    def watch(self, job_id, f):
+        """Call f (on the event loop) once the job is cancelled"""
+        self.callbacks.setdefault(str(job_id), []).append(f)
+        self._check_flags = True
+        if self._task is None:
+            self._task = asyncio.create_task(self._listen())
+
+    def unwatch(self, job_id, f):
+        callbacks = self.callbacks.get(str(job_id), [])
+        if f in callbacks:
+            callbacks.remove(f)
+        if not callbacks:
+            self.callbacks.pop(str(job_id), None)
+
+    def _cancel(self, job_id):
+        _call_hooks(self.callbacks.pop(job_id, []))
+
+    async def _listen(self):
+        loop = asyncio.get_running_loop()
+        client = redis.asyncio.Redis(host=REDIS_HOST, port=REDIS_PORT)
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        try:
+            while self.callbacks:
+                try:
+                    await self._poll(loop, client, pubsub)
+                except redis.RedisError:
+                    self._check_flags = True
+                    await asyncio.sleep(self.poll_interval)  # Reconnect on the next poll
+        finally:
+            self._task = None
+            await pubsub.aclose()
+            await client.aclose()
+
+    async def _poll(self, loop, client, pubsub):
+        if not pubsub.subscribed:
+            await pubsub.psubscribe(ALL_CANCELLATIONS_PATTERN)
+
+        next_check = loop.time()
+        while self.callbacks:
+            # Flags are checked once subscribed, so earlier cancellations are not missed
+            if self._check_flags or loop.time() >= next_check:
+                self._check_flags = False
+                next_check = loop.time() + self.poll_interval
+                job_ids = list(self.callbacks)
+                flags = await client.mget([_get_key(job_id) for job_id in job_ids])
+                for job_id, flag in zip(job_ids, flags):
+                    if flag is not None:
+                        self._cancel(job_id)
+
+            message = await pubsub.get_message(timeout=min(
+                max(next_check - loop.time(), 0), CANCEL_WAIT_TIME))
+            if message is not None:
+                self._cancel(message['channel'].decode().split(':', 1)[1])
+
+
+# One listener per event loop (i.e., per worker process)
+_LISTENERS = weakref.WeakKeyDictionary()
+
+
+def get_cancellation_listener():
+    loop = asyncio.get_running_loop()
+    listener = _LISTENERS.get(loop)
+    if listener is None:
+        listener = _LISTENERS[loop] = CancellationListener()
+    return listener
+
+
+class AsyncCancellationWatcher:
+    """Asynchronous version of CancellationWatcher (used as an async context manager).
+
+    Jobs on the same event loop share a listener (see CancellationListener), so
+    no thread is started per job. Hooks are called on the event loop.
+    """
+
+    def __init__(self, job_id, listener=None):
+        self.job_id = job_id
+        self.listener = listener
+
+        self.cancelled = False
+        self._hooks = []
+
+    def add_hook(self, f):
+        """Call f once the job is cancelled (immediately, if it already has been)"""
+        if self.cancelled:
+            f()
+        else:
+            self._hooks.append(f)
+
+    def _cancel(self):
+        self.cancelled = True
+        hooks, self._hooks = self._hooks, []
+        _call_hooks(hooks)
+
+    async def __aenter__(self):
+        if self.listener is None:
+            self.listener = get_cancellation_listener()
+        self.listener.watch(self.job_id, self._cancel)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.listener.unwatch(self.job_id, self._cancel)
@@ -0,0 +1,137 @@
+import json
+import time
+import asyncio
+import redis
+import redis.asyncio
+from ...redis import REDIS_INSTANCE, REDIS_HOST, REDIS_PORT
+
+# Event bus - structured job events, published (to Redis) as they occur, so
+# that consumers can react to changes without querying the database
+JOB_EVENTS_CHANNEL_TEMPLATE = 'JOB_EVENTS:{user}'  # Per user (primary key)
+ALL_JOB_EVENTS_PATTERN = JOB_EVENTS_CHANNEL_TEMPLATE.format(user='*')
+
+# Kinds of events
+STATUS_EVENT = 'status'  # Status (or stage) of a job changed
+LOG_EVENT = 'log'  # Job event (JobEvent) logged
+PROGRESS_EVENT = 'progress'  # Matches of a job's report stored
+ERROR_EVENT = 'error'  # Attempt at processing a job failed
+
+
+def publish_job_event(job, kind, **data):
+    """Publish an event of a job (to its user's channel).
+
+    Events are not stored, so are only read by current consumers (the
+    database remains the record of a job). Failing to publish is ignored.
+    """
+    message = {'job_id': str(job.job_id), 'kind': kind, **data}
+    try:
+        REDIS_INSTANCE.publish(JOB_EVENTS_CHANNEL_TEMPLATE.format(
+            user=job.user_id), json.dumps(message, default=str))
+    except redis.RedisError:
+        pass
+
+
+def publish_job_status(sender, instance, **kwargs):
+    """Publish the status of a job, once saved (post_save receiver)"""
+    publish_job_event(instance, STATUS_EVENT, status=instance.status,
+                      stage=instance.stage, attempts=instance.attempts)
+
+
+def publish_job_log(sender, instance, created, **kwargs):
+    """Publish a job event, once logged (post_save receiver)"""
+    if created:
+        publish_job_event(instance.job, LOG_EVENT, event_id=instance.pk,
+                          type=instance.type, message=instance.message, str=str(instance))
+
+
+def _parse_message(message):
+    if message is None or message['type'] not in ('message', 'pmessage'):
+        return None
+    return json.loads(message['data'])
+
+
+class JobEventReader:
+    """Reads the events of a user's jobs (or of all users' jobs, if no user is given).
+
+    Only events published after the reader is created are read.
+    """
+
+    def __init__(self, user=None):
+        self.pubsub = REDIS_INSTANCE.pubsub(ignore_subscribe_messages=True)
+        if user is None:
+            self.pubsub.psubscribe(ALL_JOB_EVENTS_PATTERN)
+        else:
+            self.pubsub.subscribe(JOB_EVENTS_CHANNEL_TEMPLATE.format(user=user.pk))
+
+    def get(self, timeout=0):
+        """Get the next event, waiting up to timeout seconds (None if there is none)"""
+        deadline = time.monotonic() + timeout
+        while True:
+            event = _parse_message(self.pubsub.get_message(
+                timeout=max(deadline - time.monotonic(), 0)))
+            if event is not None or time.monotonic() >= deadline:
+                return event
+
+    def wait(self, condition, timeout):
+        """Wait up to timeout seconds for an event which satisfies condition, returning it (or None)"""
+        deadline = time.monotonic() + timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            event = self.get(remaining)
+            if event is not None and condition(event):
+                return event
+        return None
+
+    def close(self):
+        self.pubsub.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class AsyncJobEventReader:
+    """Asynchronous version of JobEventReader (e.g., for streams)"""
+
+    def __init__(self, user=None):
+        self.user = user
+        self.client = redis.asyncio.Redis(host=REDIS_HOST, port=REDIS_PORT)
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+
+    async def subscribe(self):
+        if self.user is None:
+            await self.pubsub.psubscribe(ALL_JOB_EVENTS_PATTERN)
+        else:
+            await self.pubsub.subscribe(JOB_EVENTS_CHANNEL_TEMPLATE.format(user=self.user.pk))
+
+    async def get(self, timeout=0):
+        """Get the next event, waiting up to timeout seconds (None if there is none)"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            event = _parse_message(await self.pubsub.get_message(
+                timeout=max(deadline - loop.time(), 0)))
+            if event is not None or loop.time() >= deadline:
+                return event
+
+    async def wait(self, condition, timeout):
+        """Wait up to timeout seconds for an event which satisfies condition, returning it (or None)"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while (remaining := deadline - loop.time()) > 0:
+            event = await self.get(remaining)
+            if event is not None and condition(event):
+                return event
+        return None
+
+    async def close(self):
+        await self.pubsub.aclose()
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        await self.subscribe()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
@@ -0,0 +1,82 @@
+import uuid
+import threading
+from ...redis import REDIS_INSTANCE
+
+# Leases - ensure a job is only processed by one worker at a time
+LEASE_KEY_TEMPLATE = 'JOB_LEASE:{job_id}'
+LEASE_TIME = 60  # Seconds, before the lease of a lost worker expires
+HEARTBEAT_INTERVAL = LEASE_TIME / 3  # Seconds, between renewals
+
+# Only modify the lease if it is still held by this owner (token)
+RENEW_SCRIPT = REDIS_INSTANCE.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+""")
+RELEASE_SCRIPT = REDIS_INSTANCE.register_script("""
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+""")
+
+
+class JobLease:
+    """Exclusive ownership of a job, which expires unless it is renewed.
+
+    While used as a context manager, the lease is renewed in the background
+    (heartbeat), and released on exit. If a renewal fails (e.g., the lease
+    expired and was taken by another worker), `lost` is set.
+    """
+
+    def __init__(self, job_id, lease_time=LEASE_TIME, heartbeat_interval=HEARTBEAT_INTERVAL):
+        self.key = LEASE_KEY_TEMPLATE.format(job_id=job_id)
+        self.token = uuid.uuid4().hex
+        self.lease_time = lease_time
+        self.heartbeat_interval = heartbeat_interval
+
+        self.lost = False
+        self._stopped = threading.Event()
+        self._heartbeat = None
+
+    @property
+    def _lease_time_ms(self):
+        return int(self.lease_time * 1000)
+
+    def acquire(self):
+        """Acquire the lease, returning whether it was acquired (i.e., not held by another owner)"""
+        return bool(REDIS_INSTANCE.set(self.key, self.token, nx=True, px=self._lease_time_ms))
+
+    def renew(self):
+        """Extend the lease, returning whether it is still held"""
+        return bool(RENEW_SCRIPT(keys=[self.key], args=[self.token, self._lease_time_ms]))
+
+    def release(self):
+        """Release the lease (if still held)"""
+        RELEASE_SCRIPT(keys=[self.key], args=[self.token])
+
+    def remaining(self):
+        """Seconds until the lease (held by any owner) expires"""
+        return max(REDIS_INSTANCE.pttl(self.key), 0) / 1000
+
+    def _beat(self):
+        while not self._stopped.wait(self.heartbeat_interval):
+            try:
+                held = self.renew()
+            except Exception:
+                held = False
+
+            if not held:
+                self.lost = True
+                break
+
+    def __enter__(self):
+        self._heartbeat = threading.Thread(target=self._beat, daemon=True)
+        self._heartbeat.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._stopped.set()
+        self._heartbeat.join()
+        self.release()
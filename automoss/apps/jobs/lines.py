@@ -0,0 +1,118 @@
+import os
+import mmap
+from array import array
+from ...settings import SUBMISSION_UPLOAD_TEMPLATE, SUBMISSION_LINES_TEMPLATE
+
+# Line index - the byte offset of each line of a submission's file (built as it
+# is uploaded), so that ranges of lines can be read without reading the whole file
+LINE_INDEX_TYPECODE = 'Q'  # Unsigned 64-bit offsets
+READ_CHUNK_SIZE = 64 * 1024  # Bytes, read at a time when indexing an existing file
+
+
+class LineIndexer:
+    """Builds the line index of a file from its contents (given in chunks)"""
+
+    def __init__(self):
+        self.bounds = array(LINE_INDEX_TYPECODE, [0])
+        self.size = 0
+
+    def update(self, chunk):
+        start = 0
+        while (end := chunk.find(b'\n', start)) != -1:
+            start = end + 1
+            self.bounds.append(self.size + start)
+        self.size += len(chunk)
+
+    def finish(self):
+        """Get the index of the contents given so far"""
+        bounds = array(LINE_INDEX_TYPECODE, self.bounds)
+        if bounds[-1] != self.size:
+            bounds.append(self.size)  # Last line has no newline
+        return LineIndex(bounds)
+
+
+class LineIndex:
+    """Offsets of the start of each line of a file, followed by the end of the file"""
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+
+    @property
+    def num_lines(self):
+        return len(self.bounds) - 1
+
+    def get_span(self, first, last=None):
+        """Get the byte offsets (start and end) of lines first to last (inclusive,
+        numbered from 1), or to the end of the file if last is None"""
+        first = min(max(first, 1), self.num_lines + 1)
+        last = self.num_lines if last is None else min(max(last, first - 1), self.num_lines)
+        return self.bounds[first - 1], self.bounds[last]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fp:
+            self.bounds.tofile(fp)
+
+    @classmethod
+    def load(cls, path):
+        bounds = array(LINE_INDEX_TYPECODE)
+        with open(path, 'rb') as fp:
+            bounds.frombytes(fp.read())
+        return cls(bounds)
+
+    @classmethod
+    def build(cls, file_path):
+        """Index an existing file"""
+        indexer = LineIndexer()
+        with open(file_path, 'rb') as fp:
+            while chunk := fp.read(READ_CHUNK_SIZE):
+                indexer.update(chunk)
+        return indexer.finish()
+
+
+class SubmissionFile:
+    """A submission's (uploaded) file, from which ranges of lines are read (using its line index)"""
+
+    def __init__(self, user_id, job_id, file_type, file_id):
+        path_args = dict(user_id=user_id, job_id=job_id, file_type=file_type, file_id=file_id)
+        self.path = SUBMISSION_UPLOAD_TEMPLATE.format(**path_args)
+        self.index_path = SUBMISSION_LINES_TEMPLATE.format(**path_args)
+        self.index = None
+        self._fp = None
+        self._map = None
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def get_index(self):
+        """Get the file's line index, building it if the file was not indexed when uploaded"""
+        if self.index is None:
+            try:
+                self.index = LineIndex.load(self.index_path)
+            except FileNotFoundError:
+                self.index = LineIndex.build(self.path)
+                self.index.save(self.index_path)
+        return self.index
+
+    def read_lines(self, first, last=None):
+        """Read lines first to last (inclusive, numbered from 1), or to the end of
+        the file if last is None"""
+        start, end = self.get_index().get_span(first, last)
+        if start >= end:
+            return ''
+        if self._map is None:
+            self._fp = open(self.path, 'rb')
+            self._map = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map[start:end].decode(errors='replace').replace('\r\n', '\n')
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._fp.close()
+            self._map = self._fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+DEFAULT_ADDRESS = '127.0.0.1'
+DEFAULT_PORT = 8000
+
+
+class Command(BaseCommand):
+    help = 'Starts an ASGI server (uvicorn), which streams job updates (unlike runserver, which is WSGI-only).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('addrport', nargs='?',
+                            help='Optional port number, or ipaddr:port')
+
+    def handle(self, *args, **options):
+        try:
+            import uvicorn
+        except ImportError as exc:
+            raise CommandError(
+                'uvicorn is not installed (see requirements_dev.txt)') from exc
+
+        address, port = DEFAULT_ADDRESS, DEFAULT_PORT
+        addrport = options['addrport']
+        if addrport:
+            address, _, port = addrport.rpartition(':')
+            address = address or DEFAULT_ADDRESS
+            if not port.isdigit():
+                raise CommandError(f'"{addrport}" is not a valid port number or address:port pair.')
+
+        uvicorn.run('automoss.asgi:application', host=address, port=int(port))
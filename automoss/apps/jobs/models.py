@@ -9,13 +9,17 @@ from ...settings import (
     SUBMISSION_TYPES,
     STATUSES,
     JOB_EVENT_CONTEXT,
+    JOB_STAGE_CONTEXT,
     SUPPORTED_LANGUAGES,
     DEFAULT_MOSS_SETTINGS,
     UUID_LENGTH,
     MAX_COMMENT_LENGTH,
-    JOB_URL_TEMPLATE
+    JOB_URL_TEMPLATE,
+    JOB_REPORT_CACHE_TEMPLATE,
+    MAX_REPORT_CACHE_SIZE
 )
 from ...apps.utils.core import (to_choices, get_longest_key, first)
+from ..moss.moss import ReportCache
 
 
 def get_default_comment():
@@ -26,6 +30,17 @@ def get_default_comment():
 User = get_user_model()
 
 
+def remove_job_files(user_id, job_id):
+    """ Removes the files (e.g., uploads) of a job """
+    media_path = JOB_URL_TEMPLATE.format(user_id=user_id, job_id=job_id)
+    if os.path.exists(media_path):
+        shutil.rmtree(media_path)
+
+        parent = os.path.dirname(media_path)
+        if len(os.listdir(parent)) == 0:  # Delete parent dir if empty
+            os.rmdir(parent)
+
+
 class JobManager(models.Manager):
     """ Custom Job manager """
 
@@ -84,27 +99,67 @@ class Job(models.Model):
     # Date and time job was created
     creation_date = models.DateTimeField(default=now)
 
+    # Date and time job was last saved (see JSONJobs, for syncing the job list)
+    modified = models.DateTimeField(auto_now=True)
+
     # Date and time job was started
     start_date = models.DateTimeField(null=True, blank=True)
 
     # Date and time job was completed
     completion_date = models.DateTimeField(null=True, blank=True)
 
+    # Number of attempts made at processing the job
+    attempts = models.PositiveIntegerField(default=0)
+
+    # Error which caused the most recent attempt to fail
+    last_error = models.CharField(max_length=256, null=True, blank=True)
+
+    # Date and time after which the job will no longer be retried
+    retry_deadline = models.DateTimeField(null=True, blank=True)
+
+    # Progress of the current attempt, from which it can be resumed (e.g., if
+    # its worker is restarted): the most recent stage to start, the job's MOSS
+    # report, and the position (in the report) of the next match to be stored
+    stage = models.CharField(
+        max_length=max(map(len, JOB_STAGE_CONTEXT.values())),
+        choices=list((x, x) for x in JOB_STAGE_CONTEXT.values()),
+        null=True,
+        blank=True
+    )
+    report_url = models.URLField(null=True, blank=True)
+    next_match_index = models.PositiveIntegerField(default=0)
+
+    # Celery task of the most recently queued step of processing the job
+    task_id = models.CharField(max_length=255, null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Pages of a user's jobs (newest first), and jobs modified since a given time
+            models.Index(fields=['user', '-creation_date', '-id']),
+            models.Index(fields=['user', 'modified'])
+        ]
+
     def __str__(self):
         """ Model to string method """
         return f"{self.comment} ({self.job_id})"
 
-    def delete(self, using=None, keep_parents=False):
-        super().delete(using=using, keep_parents=keep_parents)
+    def reset_attempts(self):
+        """ Forget previous attempts at processing the job, and their progress (does not save) """
+        self.attempts = 0
+        self.last_error = None
+        self.retry_deadline = None
+        self.stage = None
+        self.report_url = None
+        self.next_match_index = 0
 
-        media_path = JOB_URL_TEMPLATE.format(
-            user_id=self.user.user_id, job_id=self.job_id)
-        if os.path.exists(media_path):
-            shutil.rmtree(media_path)
+    def get_report_cache(self):
+        """ Cache of the pages of this job's MOSS report """
+        return ReportCache(JOB_REPORT_CACHE_TEMPLATE.format(
+            user_id=self.user.user_id, job_id=self.job_id), MAX_REPORT_CACHE_SIZE)
 
-            parent = os.path.dirname(media_path)
-            if len(os.listdir(parent)) == 0:  # Delete parent dir if empty
-                os.rmdir(parent)
+    def delete(self, using=None, keep_parents=False):
+        super().delete(using=using, keep_parents=keep_parents)
+        remove_job_files(self.user.user_id, self.job_id)
 
 
 class Submission(models.Model):
@@ -129,6 +184,10 @@ class Submission(models.Model):
         choices=to_choices(SUBMISSION_TYPES)
     )
 
+    # Size (in bytes) and SHA-256 digest of the file, recorded as it is uploaded
+    size = models.PositiveBigIntegerField(null=True, blank=True)
+    digest = models.CharField(max_length=64, null=True, blank=True)
+
     def __str__(self):
         return f'{self.submission_id} ({self.name})'
 
@@ -0,0 +1,103 @@
+import time
+import redis
+from ...redis import REDIS_INSTANCE
+from .models import Job
+
+# Status mirror - the status of each job, kept in Redis (written through when a
+# job is saved), so that polling statuses does not query the database
+JOB_STATUS_KEY_TEMPLATE = 'JOB_STATUS:{user}:{job_id}'  # Per user (primary key)
+JOB_STATUS_TIME = 24 * 60 * 60  # Seconds, before an unused status is removed (reloaded when next read)
+MISSING_STATUS = ''  # Stored for jobs which do not exist (or belong to another user), so they are not read again
+
+
+def _get_key(user_pk, job_id):
+    return JOB_STATUS_KEY_TEMPLATE.format(user=user_pk, job_id=job_id)
+
+
+def set_job_statuses(user_pk, statuses):
+    """Store the statuses (by job ID) of a user's jobs"""
+    pipeline = REDIS_INSTANCE.pipeline()
+    for job_id, status in statuses.items():
+        pipeline.set(_get_key(user_pk, job_id), status, ex=JOB_STATUS_TIME)
+    pipeline.execute()
+
+
+def mirror_job_status(sender, instance, **kwargs):
+    """Store the status of a job, once saved (post_save receiver)"""
+    try:
+        set_job_statuses(instance.user_id, {instance.job_id: instance.status})
+    except redis.RedisError:
+        pass  # Read from the database instead
+
+
+def forget_job_status(sender, instance, **kwargs):
+    """Mark a job as missing, once deleted (post_delete receiver)"""
+    try:
+        set_job_statuses(instance.user_id, {instance.job_id: MISSING_STATUS})
+    except redis.RedisError:
+        pass
+
+
+# Removed jobs - the IDs of each user's removed jobs (scored by time of removal),
+# so that job tables which are synced (see JSONJobs) can remove them too
+JOB_REMOVALS_KEY_TEMPLATE = 'JOB_REMOVALS:{user}'  # Per user (primary key)
+JOB_REMOVALS_TIME = 24 * 60 * 60  # Seconds, for which removals are kept
+
+
+def record_job_removal(sender, instance, **kwargs):
+    """Record the removal of a job, once deleted (post_delete receiver)"""
+    key = JOB_REMOVALS_KEY_TEMPLATE.format(user=instance.user_id)
+    removed = time.time()
+    try:
+        pipeline = REDIS_INSTANCE.pipeline()
+        pipeline.zadd(key, {str(instance.job_id): removed})
+        pipeline.zremrangebyscore(key, '-inf', removed - JOB_REMOVALS_TIME)
+        pipeline.expire(key, JOB_REMOVALS_TIME)
+        pipeline.execute()
+    except redis.RedisError:
+        pass  # Not synced (until the table is reloaded)
+
+
+def get_removed_jobs(user, since):
+    """Get the IDs of a user's jobs which were removed after since (a datetime),
+    within the last JOB_REMOVALS_TIME"""
+    try:
+        job_ids = REDIS_INSTANCE.zrangebyscore(
+            JOB_REMOVALS_KEY_TEMPLATE.format(user=user.pk), f'({since.timestamp()}', '+inf')
+    except redis.RedisError:
+        return []
+    return [job_id.decode() for job_id in job_ids]
+
+
+def get_job_statuses(user, job_ids):
+    """Get the statuses (by job ID) of a user's jobs, reading them with a single MGET.
+
+    Statuses which are not stored (e.g., expired) are read from the database,
+    and stored. Jobs which do not exist (or belong to another user) are excluded,
+    and stored as missing (until they are saved), so are not read again.
+    """
+
+    job_ids = [job_id for job_id in dict.fromkeys(job_ids) if job_id]
+    if not job_ids:
+        return {}
+
+    try:
+        values = REDIS_INSTANCE.mget([_get_key(user.pk, job_id) for job_id in job_ids])
+    except redis.RedisError:
+        values = [None] * len(job_ids)
+
+    statuses = {job_id: value.decode()
+                for job_id, value in zip(job_ids, values) if value is not None}
+
+    unknown = [job_id for job_id in job_ids if job_id not in statuses]
+    if unknown:
+        loaded = dict(Job.objects.user_jobs(user).filter(
+            job_id__in=unknown).values_list('job_id', 'status'))
+        statuses.update(loaded)
+        try:
+            set_job_statuses(user.pk, {
+                **{job_id: MISSING_STATUS for job_id in unknown}, **loaded})
+        except redis.RedisError:
+            pass
+
+    return {job_id: status for job_id, status in statuses.items() if status != MISSING_STATUS}
@@ -0,0 +1,256 @@
+import io
+import json
+import asyncio
+import redis
+from importlib import import_module
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.handlers.asgi import ASGIRequest
+from .models import Job, JobEvent
+from .events import AsyncJobEventReader, STATUS_EVENT, LOG_EVENT
+from ...settings import (
+    COMPLETED_STATUS,
+    FAILED_STATUS,
+    CANCELLED_STATUS,
+    STREAM_KEEP_ALIVE_TIME
+)
+
+# Server-Sent Events stream of job updates (served by automoss/asgi.py)
+STREAM_KEEP_ALIVE_INTERVAL = STREAM_KEEP_ALIVE_TIME / 1000  # Seconds, before an idle stream is sent a comment
+STREAM_FINISH_TIME = 1  # Seconds, waited for the last events of finished jobs (before catching up)
+STREAM_RETRY_TIME = 5000  # Milliseconds, before a client reconnects to a lost stream
+
+TERMINAL_STATUSES = (COMPLETED_STATUS, FAILED_STATUS, CANCELLED_STATUS)
+
+
+def format_message(event, data, event_id=None):
+    """Format a Server-Sent Events message"""
+    message = f'event: {event}\n'
+    if event_id is not None:
+        message += f'id: {event_id}\n'
+    return f'{message}data: {json.dumps(data)}\n\n'
+
+
+class JobUpdates:
+    """Tracks the updates of a user's jobs which have not yet been sent to a client.
+
+    The database is only read (polled) when a stream starts, or resumes after
+    reconnecting, to catch up from the cursor (the id of the last job event
+    sent). Afterwards, updates are built from the job events which are
+    published (see events.py and apply), as they carry each status and log.
+    """
+
+    def __init__(self, user, job_ids, cursor=None):
+        self.jobs = dict(Job.objects.user_jobs(user).filter(
+            job_id__in=job_ids).values_list('pk', 'job_id'))
+        self.statuses = {}
+
+        # Without a cursor, the full log of each job is sent first (replacing
+        # any the client has). Afterwards, only new events are sent (appended)
+        self.cursor = cursor
+        self._append = cursor is not None
+        self._check_statuses = True
+
+    @property
+    def finished(self):
+        """Whether all jobs have finished, so no more updates will occur"""
+        return all(self.statuses.get(job_id) in TERMINAL_STATUSES for job_id in self.jobs.values())
+
+    def poll(self):
+        """Get the updates (event and data) since the previous poll
+
+        :return: Messages, and the id of the most recent job event (cursor)
+        :rtype: tuple
+        """
+
+        messages = []
+
+        logs = {}
+        events = JobEvent.objects.filter(
+            job__in=list(self.jobs), pk__gt=self.cursor or 0).order_by('pk')
+        for event in events:
+            logs.setdefault(event.job_id, []).append(
+                {'id': event.pk, 'type': event.type, 'str': str(event)})
+            self.cursor = event.pk
+
+        for pk, job_logs in logs.items():
+            messages.append(('logs', {
+                'job_id': self.jobs[pk],
+                'logs': job_logs,
+                'append': self._append
+            }))
+
+        if self._check_statuses or logs:
+            statuses = dict(Job.objects.filter(
+                pk__in=list(self.jobs)).values_list('job_id', 'status'))
+
+            # Removed jobs will not be updated
+            self.jobs = {pk: job_id for pk, job_id in self.jobs.items() if job_id in statuses}
+
+            for job_id, status in statuses.items():
+                if self.statuses.get(job_id) != status:
+                    self.statuses[job_id] = status
+                    messages.append(
+                        ('status', {'job_id': job_id, 'status': status}))
+
+        self._check_statuses = bool(logs)
+        self._append = True
+        if self.cursor is None:
+            self.cursor = 0
+
+        return messages, self.cursor
+
+    def apply(self, events):
+        """Get the updates (event and data) given by published job events, without
+        reading the database. Events already read (e.g., by the previous poll) are ignored.
+
+        :return: Messages, and the id of the most recent job event (cursor)
+        :rtype: tuple
+        """
+
+        job_ids = set(self.jobs.values())
+        logs = {}
+        statuses = []
+        for event in events:
+            job_id = event['job_id']
+            if job_id not in job_ids:
+                continue
+
+            if event['kind'] == LOG_EVENT and event['event_id'] > (self.cursor or 0):
+                logs.setdefault(job_id, []).append(
+                    {'id': event['event_id'], 'type': event['type'], 'str': event['str']})
+                self.cursor = event['event_id']
+
+            elif event['kind'] == STATUS_EVENT and self.statuses.get(job_id) != event['status']:
+                self.statuses[job_id] = event['status']
+                statuses.append(('status', {'job_id': job_id, 'status': event['status']}))
+
+        messages = [('logs', {'job_id': job_id, 'logs': job_logs, 'append': True})
+                    for job_id, job_logs in logs.items()]
+        return messages + statuses, self.cursor
+
+
+def get_stream_request(scope):
+    """Create a request for a stream, authenticating its user (by session)"""
+
+    request = ASGIRequest(scope, io.BytesIO())
+    engine = import_module(settings.SESSION_ENGINE)
+    request.session = engine.SessionStore(
+        request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    request.user = get_user(request)
+    return request
+
+
+def get_job_updates(request):
+    """Create the job updates of a stream, given its request"""
+
+    job_ids = request.GET.get('job_ids', '').split(',')
+    try:
+        # Set by the client when reconnecting
+        cursor = int(request.headers.get('Last-Event-ID'))
+    except (TypeError, ValueError):
+        cursor = None
+
+    return JobUpdates(request.user, job_ids, cursor)
+
+
+async def job_stream(scope, receive, send):
+    """ASGI application which streams the status and log updates of a user's jobs.
+
+    The jobs (by ID) are given by the `job_ids` parameter. The stream ends once
+    all of the jobs have finished (`done` event). Idle streams are sent a
+    comment, to keep their connection open.
+    """
+
+    request = await sync_to_async(get_stream_request)(scope)
+    if not request.user.is_authenticated:
+        await send({'type': 'http.response.start', 'status': 403,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body',
+                    'body': json.dumps({'message': 'Not authenticated'}).encode()})
+        return
+
+    updates = await sync_to_async(get_job_updates)(request)
+
+    disconnected = asyncio.Event()
+
+    async def wait_for_disconnect():
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+        disconnected.set()
+
+    watcher = asyncio.create_task(wait_for_disconnect())
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'text/event-stream'),
+        (b'cache-control', b'no-cache'),
+        (b'x-accel-buffering', b'no')  # Do not buffer (e.g., nginx)
+    ]})
+
+    async def write(body):
+        await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+
+    def is_update(event):
+        return event['job_id'] in updates.statuses
+
+    try:
+        try:
+            # Subscribe before reading updates, so that none are missed
+            async with AsyncJobEventReader(request.user) as reader:
+                await write(f'retry: {STREAM_RETRY_TIME}\n\n')
+
+                # Catch up from the cursor, then only apply published events
+                messages, cursor = await sync_to_async(updates.poll)()
+                caught_up = updates.finished
+                while not disconnected.is_set():
+                    if messages:
+                        await write(''.join(format_message(event, data, cursor)
+                                            for event, data in messages))
+
+                    if updates.finished:
+                        if not caught_up:
+                            # Events logged after a job's final status are
+                            # read before the stream ends
+                            caught_up = True
+                            events = []
+                            while (event := await reader.wait(is_update, STREAM_FINISH_TIME)) is not None:
+                                events.append(event)
+                            messages, _ = updates.apply(events)
+                            missed, cursor = await sync_to_async(updates.poll)()
+                            messages += missed
+                            continue
+
+                        await write(format_message('done', {}, cursor))
+                        break
+
+                    update = asyncio.create_task(
+                        reader.wait(is_update, STREAM_KEEP_ALIVE_INTERVAL))
+                    await asyncio.wait((update, watcher), return_when=asyncio.FIRST_COMPLETED)
+                    if not update.done():
+                        update.cancel()
+                        messages = []
+                        continue
+
+                    events = []
+                    if (event := update.result()) is None:
+                        await write(': keep-alive\n\n')
+                    else:
+                        # Read any other events already published
+                        while event is not None:
+                            events.append(event)
+                            event = await reader.get()
+                    messages, cursor = updates.apply(events)
+
+        except redis.RedisError:
+            # Events may have been missed, so the stream is ended (and the
+            # client reconnects, catching up from its cursor)
+            pass
+
+        await send({'type': 'http.response.body', 'body': b''})
+
+    except OSError:
+        pass  # Client disconnected
+
+    finally:
+        watcher.cancel()
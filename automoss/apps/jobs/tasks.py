@@ -1,10 +1,23 @@
 
 from ..results.models import MOSSResult, Match
+from ..results.tasks import fetch_job_match_details
 from .models import Job, Submission, JobEvent
+from .lease import JobLease
+from .events import publish_job_event, PROGRESS_EVENT, ERROR_EVENT
+from .cancel import (
+    JobCancelled,
+    CancellationWatcher,
+    AsyncCancellationWatcher,
+    is_cancelled,
+    check_cancelled
+)
 from django.utils.timezone import now
+from datetime import timedelta
+from django.db import transaction
 from ..moss.pinger import Pinger, LoadStatus
 from ..moss.moss import (
     MOSS,
+    REPORT_DOWNLOADER,
     RecoverableMossException,
     ReportParsingError,
     EmptyResponse,
@@ -20,6 +33,7 @@ from ...settings import (
     INQUEUE_STATUS,
     COMPLETED_STATUS,
     FAILED_STATUS,
+    CANCELLED_STATUS,
     SUBMISSION_TYPES,
     FILES_NAME,
     STATUSES,
@@ -42,13 +56,31 @@ from ...settings import (
     FAILED_EVENT,
     RETRY_EVENT,
 
-    HOSTNAME
+    HOSTNAME,
+
+    # Stages
+    UPLOAD_STAGE,
+    FETCH_STAGE,
+    PARSE_STAGE,
+    NOTIFY_STAGE,
+
+    USE_ASYNC_JOBS,
+    MAX_ASYNC_JOBS,
+    LAZY_MATCH_DETAILS,
+    MATCH_BATCH_SIZE,
+    PREFETCH_MATCH_DETAILS
 )
-from ..utils.core import retry
+from ..utils.core import get_retry_time
+from asgiref.sync import sync_to_async
 import os
 import json
 import time
+import uuid
 import socket
+import asyncio
+import itertools
+import functools
+import threading
 from ...celery import app
 from celery.utils.log import get_task_logger
 logger = get_task_logger(__name__)
@@ -75,27 +107,8 @@ def send_email_notification(job):
     )
 
 
-@app.task(name='Upload')
-def process_job(job_id):
-    """Process a job, given its ID"""
-
-    try:
-        job = Job.objects.get(job_id=job_id)
-    except Job.DoesNotExist:
-        return
-
-    if job.status != INQUEUE_STATUS:
-        # A job will only be started if it is in the queue.
-        # Prevents jobs from being processed more than once.
-        # Necessary because redis and celery store their own caches/lists
-        # of jobs, which may cause process_job to be run more than once.
-        return
-
-    job.start_date = now()
-    msg = f'Starting job {job_id} with status {job.status}'
-    logger.info(msg)
-    JobEvent.objects.create(job=job, type=INQUEUE_EVENT, message=msg)
-    job.save()
+def get_job_paths(job):
+    """Get paths of the (non-empty) files uploaded for a job, by file type"""
 
     base_dir = JOB_UPLOAD_TEMPLATE.format(
         user_id=job.user.user_id, job_id=job.job_id)
@@ -114,6 +127,48 @@ def process_job(job_id):
                 # Only add non-empty files
                 paths[file_type].append(file_path)
 
+    return paths
+
+
+def start_job(job_id, attempt=None):
+    """Start an attempt at processing a job, returning it and its files (or None if it should not be processed)"""
+
+    try:
+        job = Job.objects.get(job_id=job_id)
+    except Job.DoesNotExist:
+        return None, None
+
+    if is_cancelled(job_id):
+        return None, None
+
+    # A job will only be started if it is in the queue, or its upload was
+    # interrupted (i.e., its worker was lost, as this worker now holds the job's
+    # lease). Prevents jobs from being processed more than once.
+    # Necessary because redis and celery store their own caches/lists
+    # of jobs, which may cause process_job to be run more than once.
+    if job.status == INQUEUE_STATUS:
+        current_attempt = job.attempts
+    elif job.status in (UPLOADING_STATUS, PROCESSING_STATUS):
+        current_attempt = job.attempts - 1  # Attempt which was interrupted
+    else:
+        return None, None
+
+    if attempt is not None and attempt != current_attempt:
+        # Scheduled by an earlier attempt, which has since been superseded
+        return None, None
+
+    if job.attempts == 0:
+        job.start_date = now()
+    job.attempts += 1
+    job.stage = UPLOAD_STAGE
+
+    msg = f'Starting job {job_id} with status {job.status} (attempt {job.attempts})'
+    logger.info(msg)
+    JobEvent.objects.create(job=job, type=INQUEUE_EVENT, message=msg)
+    job.save()
+
+    paths = get_job_paths(job)
+
     if not paths.get(FILES_NAME):
         job.status = FAILED_STATUS
         job.save()
@@ -122,135 +177,303 @@ def process_job(job_id):
             job=job, type=FAILED_EVENT, message='No files supplied')
 
         send_email_notification(job)
-        return None
+        return None, None
 
-    num_attempts = 0
-    url = None
-    result = None
-    error = None
+    return job, paths
 
-    for attempt, time_to_sleep in retry(MIN_RETRY_TIME, MAX_RETRY_TIME, EXPONENTIAL_BACKOFF_BASE, MAX_RETRY_DURATION, FIRST_RETRY_INSTANT):
-        num_attempts = attempt
 
-        try:
-            error = None  # Reset error
-            if not is_valid_moss_url(url):
-                # Keep retrying until valid url has been generated
-                # Do not restart whole job if this succeeds but parsing fails
+def get_moss_options(job, paths):
+    """Get the options used to generate a job's MOSS report"""
 
-                def on_upload_start():
-                    job.status = UPLOADING_STATUS
-                    job.save()
-                    JobEvent.objects.create(
-                        job=job, type=UPLOADING_EVENT, message='Started uploading files to MOSS')
+    return {
+        'user_id': job.user.moss_id,
+        'language': SUPPORTED_LANGUAGES[job.language][1],
+        **paths,
+        'max_until_ignored': job.max_until_ignored,
+        'max_displayed_matches': job.max_displayed_matches,
+        'use_basename': True
+    }
 
-                def on_upload_finish():
-                    JobEvent.objects.create(
-                        job=job, type=UPLOADING_EVENT, message='Finished uploading')
 
-                def on_processing_start():
-                    job.status = PROCESSING_STATUS
-                    job.save()
-                    JobEvent.objects.create(
-                        job=job, type=PROCESSING_EVENT, message='MOSS started processing files')
+def get_moss_callbacks(job):
+    """Get the callbacks used to log the progress of a job's MOSS report.
 
-                def on_processing_finish():
-                    JobEvent.objects.create(
-                        job=job, type=PROCESSING_EVENT, message='MOSS finished processing')
+    Each callback raises JobCancelled if the job has been cancelled, which
+    stops the upload between files.
+    """
 
-                url = MOSS.generate_url(
-                    user_id=job.user.moss_id,
-                    language=SUPPORTED_LANGUAGES[job.language][1],
-                    **paths,
-                    max_until_ignored=job.max_until_ignored,
-                    max_displayed_matches=job.max_displayed_matches,
-                    use_basename=True,
-
-                    # TODO other events to log?
-                    # on_start=None,
-                    # on_connect=None,
-
-                    on_upload_start=on_upload_start,
-                    on_upload_finish=on_upload_finish,
-
-                    on_processing_start=on_processing_start,
-                    on_processing_finish=on_processing_finish,
-                )
+    def on_upload_start():
+        check_cancelled(job.job_id)
+        job.status = UPLOADING_STATUS
+        job.save()
+        JobEvent.objects.create(
+            job=job, type=UPLOADING_EVENT, message='Started uploading files to MOSS')
 
-            msg = f'Started parsing MOSS report: {url}'
-            logger.info(msg)
+    def on_file_upload(path):
+        check_cancelled(job.job_id)
 
-            job.status = PARSING_STATUS
-            job.save()
-            JobEvent.objects.create(job=job, type=PARSING_EVENT, message=msg)
+    def on_upload_finish():
+        check_cancelled(job.job_id)
+        JobEvent.objects.create(
+            job=job, type=UPLOADING_EVENT, message='Finished uploading')
 
-            # Parsing and extraction
-            result = MOSS.generate_report(url)
-            msg = f'Result finished parsing: {len(result.matches)} matches detected'
-            logger.info(msg)
-            JobEvent.objects.create(job=job, type=PARSING_EVENT, message=msg)
+    def on_processing_start():
+        check_cancelled(job.job_id)
+        job.status = PROCESSING_STATUS
+        job.save()
+        JobEvent.objects.create(
+            job=job, type=PROCESSING_EVENT, message='MOSS started processing files')
+
+    def on_processing_finish():
+        check_cancelled(job.job_id)
+        JobEvent.objects.create(
+            job=job, type=PROCESSING_EVENT, message='MOSS finished processing')
+
+    return {
+        # TODO other events to log?
+        # on_start=None,
+        # on_connect=None,
+
+        'on_upload_start': on_upload_start,
+        'on_file_upload': on_file_upload,
+        'on_upload_finish': on_upload_finish,
+
+        'on_processing_start': on_processing_start,
+        'on_processing_finish': on_processing_finish
+    }
+
+
+def start_parsing(job, url):
+    """Log that a job's MOSS report has started parsing"""
+
+    msg = f'Started parsing MOSS report: {url}'
+    logger.info(msg)
+
+    if url != job.report_url:
+        # New report, so none of its matches have been stored
+        job.report_url = url
+        job.next_match_index = 0
+
+    job.status = PARSING_STATUS
+    job.stage = FETCH_STAGE
+    job.save()
+    JobEvent.objects.create(job=job, type=PARSING_EVENT, message=msg)
+
+
+def finish_parsing(job, moss_result):
+    """Log that a job's MOSS report has finished parsing (and has been stored)"""
+
+    msg = f'Result finished parsing: {moss_result.match_set.count()} matches detected'
+    logger.info(msg)
+    JobEvent.objects.create(job=job, type=PARSING_EVENT, message=msg)
+    logger.debug(f'Report download stats: {REPORT_DOWNLOADER.stats()}')
+
+
+def handle_error(job_id, e, load=None):
+    """Determine how to handle an error which occurred while processing a job.
+
+    The load of MOSS (see Pinger.get_load) is read if it is not given (e.g.,
+    once refreshed, see report_error).
 
-            break  # Success, do not retry
+    :return: The error to report, and whether the job can be retried
+    :rtype: tuple
+    """
 
-        except socket.error as e:
-            error = MossConnectionError(e.strerror or e)
+    if isinstance(e, socket.error):
+        return MossConnectionError(e.strerror or e), True
 
-        except RecoverableMossException as e:
-            error = e  # Handled below
-            if isinstance(e, ReportParsingError):
-                # Malformed MOSS report... must regenerate
-                url = None
+    if isinstance(e, RecoverableMossException):
+        return e, True  # Handled below
 
-        except EmptyResponse:
-            # Job ended without any response (i.e., timed out)
+    if isinstance(e, EmptyResponse):
+        # Job ended without any response (i.e., timed out)
 
-            load_status, ping, average_ping = Pinger.determine_load()
-            ping_message = f'({ping} vs. {average_ping})'
+        if load is None:
+            load = Pinger.get_load()
+        load_status = load['status']
+        ping_message = f'({load["current_ping"]} vs. {load["average_ping"]})'
 
-            if load_status == LoadStatus.NORMAL:
-                # This will terminate if MOSS is not under load and already tried MIN_RETRIES_COUNT times
-                #
-                # if attempt >= MIN_RETRIES_COUNT - 1:  # Retry job a minimum number of times
-                #     msg = f'Moss is not under load {ping_message} - job ({job_id}) will never finish'
-                #     error = FatalMossException(
-                #         f"MOSS returned no response at least {MIN_RETRIES_COUNT - 1} times, but isn't under load. The job will never finish.")
-                #     logger.debug(msg)
-                #     break
+        if load_status == LoadStatus.NORMAL:
+            # This will terminate if MOSS is not under load and already tried MIN_RETRIES_COUNT times
+            #
+            # if attempt >= MIN_RETRIES_COUNT - 1:  # Retry job a minimum number of times
+            #     msg = f'Moss is not under load {ping_message} - job ({job_id}) will never finish'
+            #     error = FatalMossException(
+            #         f"MOSS returned no response at least {MIN_RETRIES_COUNT - 1} times, but isn't under load. The job will never finish.")
+            #     logger.debug(msg)
+            #     break
 
-                # else:
-                #     msg = f'MOSS returned no response but is not under load. Will retry {MIN_RETRIES_COUNT - 1 - attempt} more times'
-                msg = f'Moss is not under load {ping_message}, retrying job ({job_id})'
+            # else:
+            #     msg = f'MOSS returned no response but is not under load. Will retry {MIN_RETRIES_COUNT - 1 - attempt} more times'
+            msg = f'Moss is not under load {ping_message}, retrying job ({job_id})'
 
-            elif load_status in (LoadStatus.UNDER_LOAD, LoadStatus.UNDER_SEVERE_LOAD):
-                msg = f'Moss is under load {ping_message}, retrying job ({job_id})'
+        elif load_status in (LoadStatus.UNDER_LOAD, LoadStatus.UNDER_SEVERE_LOAD):
+            msg = f'Moss is under load {ping_message}, retrying job ({job_id})'
 
-            else:
-                msg = f'Moss is down {ping_message}, retrying job ({job_id})'
+        else:
+            msg = f'Moss is down {ping_message}, retrying job ({job_id})'
 
-            error = RecoverableMossException(msg)
-            logger.debug(msg)
+        logger.debug(msg)
+        return RecoverableMossException(msg), True
 
-        except FatalMossException as e:
-            error = e
-            logger.error(f'Fatal moss exception: {e}')
-            break  # Will be handled below (result is None)
+    if isinstance(e, FatalMossException):
+        logger.error(f'Fatal moss exception: {e}')
+        return e, False  # Will be handled below (result is None)
 
-        except Exception as e:
-            error = e
-            # Something catastrophic happened
-            logger.error(f'Unknown error: {e}')
-            break  # Will be handled below (result is None)
+    # Something catastrophic happened
+    logger.error(f'Unknown error: {e}')
+    return e, False  # Will be handled below (result is None)
 
-        msg = f'(Attempt {attempt + 1}) Error: {error} | Retrying in {round(time_to_sleep, 2)} seconds'
 
+def schedule_retry(job, error, url):
+    """Schedule the next attempt at processing a job, if it is within its retry deadline.
 
-        # We can retry
-        logger.warning(msg)
-        JobEvent.objects.create(job=job, type=RETRY_EVENT, message=msg)
+    The attempt is placed back in the queue with a countdown, so no worker is
+    occupied while waiting to retry.
 
-        time.sleep(time_to_sleep)
+    :return: The next attempt (to be queued), or None if the job will not be retried
+    :rtype: celery.canvas.Signature
+    """
 
-    failed = result is None
+    time_to_sleep = get_retry_time(job.attempts - 1, MIN_RETRY_TIME, MAX_RETRY_TIME,
+                                   EXPONENTIAL_BACKOFF_BASE, FIRST_RETRY_INSTANT)
+
+    if job.retry_deadline is None:
+        job.retry_deadline = now() + timedelta(seconds=MAX_RETRY_DURATION)
+    job.last_error = str(error)[:256]
+
+    if now() + timedelta(seconds=time_to_sleep) > job.retry_deadline:
+        job.save()
+        return None
+
+    check_cancelled(job.job_id)  # Do not place a cancelled job back in the queue
+
+    job.status = INQUEUE_STATUS
+    job.report_url = url
+    job.save()
+
+    msg = f'(Attempt {job.attempts}) Error: {error} | Retrying in {round(time_to_sleep, 2)} seconds'
+    logger.warning(msg)
+    JobEvent.objects.create(job=job, type=RETRY_EVENT, message=msg)
+
+    return job_signature(job.job_id, url=url, attempt=job.attempts, countdown=time_to_sleep)
+
+
+class ResultWriter:
+    """Stores the matches of a MOSS report, in batches, as they are parsed.
+
+    Each batch is written (in a single transaction) as soon as it has been
+    parsed, so that matches can be viewed while the job is still parsing, and
+    memory usage does not grow with the size of the report. The position of the
+    next match to store is saved with each batch, so that an interrupted job
+    resumes from there (start). Otherwise, matches of a previous report are replaced.
+    """
+
+    def __init__(self, job, url):
+        self.job = job
+        self.skipped = set()
+
+        # Look up all of the job's submissions at once, instead of per match
+        self.submissions = {
+            submission.submission_id: submission
+            for submission in Submission.objects.filter(job=job)
+        }
+
+        self.moss_result = MOSSResult.objects.filter(job=job, url=url).first()
+        if self.moss_result is not None and job.next_match_index > 0:
+            # Resume storing matches (removing any which are not accounted for)
+            self.moss_result.match_set.filter(
+                index__gte=job.next_match_index).delete()
+        else:
+            MOSSResult.objects.filter(job=job).delete()
+            self.moss_result = MOSSResult.objects.create(
+                job=job,
+                url=url
+            )
+            self._set_next_match_index(0)
+
+        self.start = job.next_match_index
+        self.num_stored = self.moss_result.match_set.count()
+
+    def _set_next_match_index(self, index):
+        self.job.next_match_index = index
+        Job.objects.filter(pk=self.job.pk).update(next_match_index=index)
+
+    def write(self, matches):
+        """Store a batch of matches (in the order they appear in the report)"""
+        check_cancelled(self.job.job_id)
+
+        batch = []
+        for match in matches:
+            first_submission = self.submissions.get(match.name_1)
+            second_submission = self.submissions.get(match.name_2)
+
+            # Ensure matching submission is found (avoid future errors)
+            if first_submission is None or second_submission is None:
+                self.skipped.update(name for name in (match.name_1, match.name_2)
+                                    if name not in self.submissions)
+                continue
+
+            batch.append(Match(
+                moss_result=self.moss_result,
+                first_submission=first_submission,
+                second_submission=second_submission,
+                first_percentage=match.percentage_1,
+                second_percentage=match.percentage_2,
+                lines_matched=match.lines_matched,
+                line_matches=match.line_matches,
+                index=match.index
+            ))
+
+        with transaction.atomic():
+            Match.objects.bulk_create(batch, batch_size=MATCH_BATCH_SIZE)
+            if matches:
+                self._set_next_match_index(matches[-1].index + 1)
+        self.num_stored += len(batch)
+
+    def report_progress(self, num_matches):
+        """Log how many matches have been stored so far"""
+        JobEvent.objects.create(
+            job=self.job, type=PARSING_EVENT, message=f'Stored {self.num_stored} of {num_matches} matches')
+        publish_job_event(self.job, PROGRESS_EVENT,
+                          stored=self.num_stored, total=num_matches)
+
+    def close(self):
+        """Finish storing the report
+
+        :return: The stored result
+        :rtype: MOSSResult
+        """
+        if self.skipped:
+            logger.warning(
+                f'Skipped matches of job {self.job.job_id} with unknown submissions: {sorted(self.skipped)}')
+        return self.moss_result
+
+
+def next_batch(matches):
+    """Parse the next batch of matches of a (streamed) report"""
+    return list(itertools.islice(matches, MATCH_BATCH_SIZE))
+
+
+def store_result(writer, result):
+    """Store the matches of a MOSS report (from writer.start), in batches, as they are parsed.
+    Progress is reported after every batch (including the last), so the final
+    report counts every stored match.
+
+    :return: The stored result
+    :rtype: MOSSResult
+    """
+    matches = iter(result.matches)
+    while batch := next_batch(matches):
+        writer.write(batch)
+        writer.report_progress(result.num_matches)
+    return writer.close()
+
+
+def finish_job(job, error=None):
+    """Mark a job as completed (or failed, if an error is given) and notify the user"""
+
+    failed = error is not None
 
     # Represents when no more processing of the job will occur
     job.completion_date = now()
@@ -258,52 +481,30 @@ def process_job(job_id):
     try:
         if failed:
             job.status = FAILED_STATUS
-            if error is not None:
-                error_message = f'Error: {error}'
-            else:
-                error_message = 'Maximum processing time exceeded (job has been cancelled)'
+            # Remove any matches stored before the job failed
+            MOSSResult.objects.filter(job=job).delete()
 
             JobEvent.objects.create(
-                job=job, type=FAILED_EVENT, message=error_message)
+                job=job, type=FAILED_EVENT, message=f'Error: {error}')
             send_email_notification(job)
             return None
 
-        # Parse result
-        moss_result = MOSSResult.objects.create(
-            job=job,
-            url=result.url
-        )
-
-        for match in result.matches:
-            first_submission = Submission.objects.filter(
-                job=job, submission_id=match.name_1).first()
-            second_submission = Submission.objects.filter(
-                job=job, submission_id=match.name_2).first()
-
-            # Ensure matching submission is found (avoid future errors)
-            if first_submission and second_submission:
-                Match.objects.create(
-                    moss_result=moss_result,
-                    first_submission=first_submission,
-                    second_submission=second_submission,
-                    first_percentage=match.percentage_1,
-                    second_percentage=match.percentage_2,
-                    lines_matched=match.lines_matched,
-                    line_matches=match.line_matches
-                )
-
         JobEvent.objects.create(
             job=job, type=COMPLETED_EVENT, message='Completed')
         job.status = COMPLETED_STATUS
         send_email_notification(job)
 
-        return result.url
+        if LAZY_MATCH_DETAILS and PREFETCH_MATCH_DETAILS:
+            fetch_job_match_details.delay(job.job_id)
+
+        return job.mossresult.url
 
     finally:
         job.save()
 
         if DEBUG:
             # Calculate average file_size
+            paths = get_job_paths(job)
             num_files = len(paths[FILES_NAME])
             avg_file_size = sum([os.path.getsize(x)
                                 for x in paths[FILES_NAME]]) / num_files
@@ -314,7 +515,7 @@ def process_job(job_id):
                 'num_files': num_files,
                 'avg_file_size': avg_file_size,
                 'moss_id': job.user.moss_id,
-                'num_attempts': num_attempts
+                'num_attempts': job.attempts
             })
 
             # Perform a ping
@@ -328,3 +529,401 @@ def process_job(job_id):
                     log_info['completion_date'] - log_info['start_date']).total_seconds()
                 json.dump(log_info, fp, sort_keys=True, default=str)
                 print(file=fp)
+
+
+def continue_job(job_id, attempt, stage):
+    """Get a job to continue processing (in a later stage), or None if its attempt has ended (e.g., cancelled).
+
+    A stage is only continued if it is the one which was last started (see
+    set_stage), so a stage which is redelivered after it has finished (i.e., its
+    worker was lost before acknowledging it) does not queue its next step again.
+    """
+
+    try:
+        job = Job.objects.get(job_id=job_id)
+    except Job.DoesNotExist:
+        return None
+
+    if job.status != PARSING_STATUS or job.attempts != attempt or is_cancelled(job_id):
+        return None
+
+    if job.stage != stage:
+        logger.info(f'Job {job_id} is past stage {stage} (now {job.stage}), not continuing')
+        return None
+
+    return job
+
+
+def report_error(job, e):
+    """Publish an error which occurred in a stage of processing a job (unless the
+    job was cancelled), so that MOSS is pinged early (see pinger.monitor).
+
+    If handling the error depends on the load of MOSS (see handle_error), the
+    load is read once it has been refreshed.
+
+    :return: Whether the job was cancelled, and the refreshed load (or None)
+    :rtype: tuple
+    """
+
+    if isinstance(e, JobCancelled) or is_cancelled(job.job_id):
+        return True, None
+
+    reported = time.time()
+    publish_job_event(job, ERROR_EVENT, error=str(e))
+
+    load = None
+    if isinstance(e, EmptyResponse):
+        load = Pinger.wait_for_load(reported)
+    return False, load
+
+
+def fail_stage(job, e, url, report=None):
+    """Handle an error which occurred in a stage of processing a job.
+
+    The job is retried (from the start, but reusing the MOSS report's url if it
+    is still valid), or failed if this is not possible. The error is reported
+    first (see report_error), unless its report is given.
+
+    :return: The next step (to be queued), or None if the job was cancelled
+    :rtype: celery.canvas.Signature
+    """
+
+    cancelled, load = report_error(job, e) if report is None else report
+    if cancelled:
+        # Errors caused by cancelling (e.g., aborting the MOSS connection) are ignored
+        logger.info(f'Job {job.job_id} was cancelled, stopping ({e})')
+        return None
+
+    error, can_retry = handle_error(job.job_id, e, load)
+
+    if can_retry:
+        if isinstance(error, ReportParsingError):
+            # Malformed MOSS report... must regenerate. Pages which could not
+            # be downloaded (ReportDownloadTimeout) are retried with the same url
+            url = None
+
+        next_attempt = schedule_retry(job, error, url)
+        if next_attempt is not None:
+            return next_attempt
+
+    return notify_job.si(job.job_id, str(error))
+
+
+def set_stage(job, stage):
+    """Record that a stage of processing a job has started"""
+    job.stage = stage
+    job.save(update_fields=['stage'])
+
+
+def acquire_lease(task, job_id, *args, **kwargs):
+    """Acquire the lease of a job, for a stage (task) of processing it.
+
+    If another worker holds the lease, the stage is queued again for when the
+    lease would expire (i.e., if the other worker has been lost), and None is returned.
+    The job's recorded task is left as is (see dispatch), as it is the one
+    holding the lease, which cancelling the job should revoke.
+    """
+
+    lease = JobLease(job_id)
+    if lease.acquire():
+        return lease
+
+    countdown = lease.remaining()
+    logger.info(
+        f'Job {job_id} is being processed by another worker, retrying {task.name} in {countdown} seconds')
+    task.apply_async((job_id, *args), kwargs, countdown=countdown)
+    return None
+
+
+def dispatch(job_id, step):
+    """Queue a step (signature) of processing a job, recording its task on the job.
+
+    The task's id is recorded before it is queued, so that a cancelled job's
+    pending step can be revoked without inspecting the workers (see Cancel).
+    """
+
+    task_id = str(uuid.uuid4())
+    Job.objects.filter(job_id=job_id).update(task_id=task_id)
+    step.apply_async(task_id=task_id)
+
+
+def queue_next_step(lease, job_id, next_step):
+    """Queue the next step of processing a job, once the lease of the previous step has been released"""
+
+    if lease.lost:
+        # Another worker may have taken over the job
+        logger.warning(f'Lease of job {job_id} was lost, not continuing')
+    elif next_step is not None:
+        dispatch(job_id, next_step)
+
+
+def job_stage(name, **options):
+    """Define a stage of processing a job: a task which returns its next step (a signature), or None.
+
+    A stage only runs while its worker holds the job's lease (see JobLease),
+    which is renewed until the stage finishes. The next step is queued once the
+    lease has been released.
+    """
+
+    def decorator(f):
+        @app.task(name=name, **options)
+        @functools.wraps(f)
+        def stage(job_id, *args, **kwargs):
+            lease = acquire_lease(stage, job_id, *args, **kwargs)
+            if lease is None:
+                return None
+
+            with lease:
+                next_step = f(job_id, *args, **kwargs)
+
+            queue_next_step(lease, job_id, next_step)
+
+        return stage
+    return decorator
+
+
+# Processing a job consists of the following stages, each of which queues the next:
+#  1. process_job: upload the job's files to MOSS, and wait for the report's url
+#  2. fetch_report: download the pages of the report (into the job's report cache)
+#  3. parse_report: parse the (cached) pages, storing matches as they are parsed
+#  4. notify_job: mark the job as completed (or failed), and notify the user
+# Each stage has its own queue (see CELERY_ROUTES), so that workers which wait
+# on MOSS do not compete with those which parse reports. The stage which was
+# most recently started is stored on the job, so that it can be resumed (see
+# resume_job). Later stages are acknowledged once finished, so they are
+# redelivered if their worker is lost.
+
+@job_stage('Upload')
+def process_job(job_id, url=None, attempt=None):
+    """Start an attempt at processing a job, given its ID, by uploading its files to MOSS.
+
+    If the report's url is given (i.e., from a previous attempt), the job is not
+    uploaded again. If a stage fails (and can be retried), another attempt is
+    scheduled (see schedule_retry).
+    """
+
+    job, paths = start_job(job_id, attempt)
+    if job is None:
+        return None
+
+    try:
+        if not is_valid_moss_url(url):
+            # Keep retrying until valid url has been generated
+            # Do not restart whole job if this succeeds but parsing fails
+            with CancellationWatcher(job_id) as watcher:
+                # If cancelled while waiting for MOSS, abort the connection
+                url = MOSS.generate_url(
+                    **get_moss_options(job, paths),
+                    **get_moss_callbacks(job),
+                    on_connect=lambda moss: watcher.add_hook(moss.abort)
+                )
+
+        start_parsing(job, url)
+
+    except Exception as e:
+        return fail_stage(job, e, url)
+
+    return fetch_report.si(job_id, url, job.attempts)
+
+
+async def process_job_async(job_id, url=None, attempt=None):
+    """Start an attempt at processing a job, given its ID, using the asyncio MOSS client.
+
+    While waiting for MOSS, the event loop is free to run other jobs. Database
+    work is run in a thread (via sync_to_async). Later stages are the same as
+    for process_job (whose lease is held by AsyncJobRunner).
+
+    :return: The next step (to be queued)
+    :rtype: celery.canvas.Signature
+    """
+
+    job, paths = await sync_to_async(start_job)(job_id, attempt)
+    if job is None:
+        return None
+
+    options = await sync_to_async(get_moss_options)(job, paths)
+    callbacks = {name: sync_to_async(f)
+                 for name, f in get_moss_callbacks(job).items()}
+
+    try:
+        if not is_valid_moss_url(url):
+            async with AsyncCancellationWatcher(job_id) as watcher:
+                # If cancelled while waiting for MOSS, abort the connection
+                url = await MOSS.generate_url_async(
+                    **options, **callbacks,
+                    on_connect=lambda moss: watcher.add_hook(moss.abort)
+                )
+
+        await sync_to_async(start_parsing)(job, url)
+
+    except Exception as e:
+        # Waiting for the load of MOSS to be refreshed does not block the thread
+        # which runs database work (see sync_to_async)
+        report = await asyncio.to_thread(report_error, job, e)
+        return await sync_to_async(fail_stage)(job, e, url, report)
+
+    return fetch_report.si(job_id, url, job.attempts)
+
+
+@job_stage('FetchReport', acks_late=True)
+def fetch_report(job_id, url, attempt):
+    """Download the pages of a job's MOSS report (into the job's report cache)"""
+
+    job = continue_job(job_id, attempt, FETCH_STAGE)
+    if job is None:
+        return None
+
+    try:
+        MOSS.download_report(url, job.get_report_cache(),
+                             summary_only=LAZY_MATCH_DETAILS)
+    except Exception as e:
+        return fail_stage(job, e, url)
+
+    set_stage(job, PARSE_STAGE)
+    return parse_report.si(job_id, url, attempt)
+
+
+@job_stage('ParseReport', acks_late=True)
+def parse_report(job_id, url, attempt):
+    """Parse a job's MOSS report, storing its matches as they are parsed.
+
+    Pages are read from the job's report cache (or downloaded again, if evicted).
+    If some matches have already been stored, parsing resumes after them.
+    """
+
+    job = continue_job(job_id, attempt, PARSE_STAGE)
+    if job is None:
+        return None
+
+    try:
+        writer = ResultWriter(job, url)
+        report = MOSS.generate_report(
+            url, summary_only=LAZY_MATCH_DETAILS, cache=job.get_report_cache(), stream=True, start=writer.start)
+        finish_parsing(job, store_result(writer, report))
+    except Exception as e:
+        return fail_stage(job, e, url)
+
+    set_stage(job, NOTIFY_STAGE)
+    return notify_job.si(job_id)
+
+
+@job_stage('Notify', acks_late=True)
+def notify_job(job_id, error=None):
+    """Finish processing a job (see finish_job)"""
+
+    try:
+        job = Job.objects.get(job_id=job_id)
+    except Job.DoesNotExist:
+        return None
+
+    if job.status in (COMPLETED_STATUS, FAILED_STATUS, CANCELLED_STATUS):
+        return None  # Already finished
+
+    finish_job(job, error)
+
+
+def resume_job(job):
+    """Continue processing an unfinished job (e.g., after workers were restarted).
+
+    Jobs which have obtained their MOSS report resume from the stage that was
+    last started (and parsing, from the next match to be stored). Otherwise,
+    the job is placed back in the queue, reusing its report's url (if any).
+    """
+
+    stages = {
+        FETCH_STAGE: fetch_report,
+        PARSE_STAGE: parse_report
+    }
+
+    if job.status == PARSING_STATUS and is_valid_moss_url(job.report_url):
+        if job.stage in stages:
+            msg = f'Resuming job {job.job_id} from stage {job.stage} (match {job.next_match_index})'
+            logger.info(msg)
+            JobEvent.objects.create(job=job, type=PARSING_EVENT, message=msg)
+            dispatch(job.job_id, stages[job.stage].si(
+                job.job_id, job.report_url, job.attempts))
+            return
+
+        if job.stage == NOTIFY_STAGE:
+            dispatch(job.job_id, notify_job.si(job.job_id))
+            return
+
+    job.status = INQUEUE_STATUS
+    job.save()
+    JobEvent.objects.create(
+        job=job, type=INQUEUE_EVENT, message='Restarting... Placed in processing queue')
+    queue_job(job.job_id, url=job.report_url)
+
+
+class AsyncJobRunner:
+    """Runs asynchronous jobs on an event loop in a background thread.
+
+    One runner exists per worker process, so a single process can drive many
+    jobs at once (which spend most of their time waiting for MOSS).
+    """
+
+    def __init__(self, max_jobs):
+        self.max_jobs = max_jobs
+        self._loop = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    def _get_loop(self):
+        with self._lock:
+            if self._loop is None:  # Started lazily, i.e., after the worker process has forked
+                self._loop = asyncio.new_event_loop()
+                self._semaphore = asyncio.Semaphore(self.max_jobs)
+                threading.Thread(target=self._loop.run_forever,
+                                 daemon=True).start()
+            return self._loop
+
+    async def _run(self, job_id, url, attempt):
+        async with self._semaphore:
+            try:
+                lease = await asyncio.to_thread(
+                    acquire_lease, start_async_job, job_id, url=url, attempt=attempt)
+                if lease is None:
+                    return
+
+                with lease:
+                    next_step = await process_job_async(job_id, url, attempt)
+
+                await asyncio.to_thread(queue_next_step, lease, job_id, next_step)
+
+            except Exception as e:
+                logger.error(f'Unknown error while processing job ({job_id}): {e}')
+
+    def submit(self, job_id, url=None, attempt=None):
+        """Start an attempt at processing a job on the event loop"""
+        loop = self._get_loop()
+        return asyncio.run_coroutine_threadsafe(self._run(job_id, url, attempt), loop)
+
+
+ASYNC_JOB_RUNNER = AsyncJobRunner(MAX_ASYNC_JOBS)
+
+
+@app.task(name='UploadAsync')
+def start_async_job(job_id, url=None, attempt=None):
+    """Start processing a job on this worker's event loop.
+
+    Returns immediately, freeing the worker slot. If the worker is restarted,
+    unfinished jobs are placed back in the queue (see JobsConfig.ready).
+    """
+    ASYNC_JOB_RUNNER.submit(job_id, url, attempt)
+
+
+def job_signature(job_id, url=None, attempt=None, countdown=None):
+    """Get the task which starts an attempt at processing a job
+
+    :param url: URL of the job's MOSS report (if already generated), defaults to None
+    :param attempt: Attempt which is being retried (see start_job), defaults to None
+    :param countdown: Seconds to wait before processing the job, defaults to None
+    """
+
+    task = start_async_job if USE_ASYNC_JOBS else process_job
+    return task.signature((job_id,), {'url': url, 'attempt': attempt}, countdown=countdown)
+
+
+def queue_job(job_id, **kwargs):
+    """Place a job in the processing queue (see job_signature)"""
+    dispatch(job_id, job_signature(job_id, **kwargs))
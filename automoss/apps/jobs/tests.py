@@ -1,23 +1,72 @@
 from ..users.tests import AuthenticatedUserTest
 from ...settings import (
     COMPLETED_STATUS,
-    TESTS_ROOT
+    CANCELLED_STATUS,
+    INQUEUE_STATUS,
+    INQUEUE_EVENT,
+    COMPLETED_EVENT,
+    PARSING_STATUS,
+    PARSING_EVENT,
+    PARSE_STAGE,
+    NOTIFY_STAGE,
+    TESTS_ROOT,
+    SUBMISSION_UPLOAD_TEMPLATE,
+    JOB_URL_TEMPLATE,
+    JOBS_SYNC_MARGIN
 )
-from .tasks import process_job
-from .models import Job
-from ..results.models import Match
+from .tasks import process_job, process_job_async, fetch_report, store_result, resume_job, report_error, ResultWriter
+from .models import Job, Submission, JobEvent
+from .lease import JobLease
+from .events import JobEventReader, publish_job_event, STATUS_EVENT, LOG_EVENT, PROGRESS_EVENT, ERROR_EVENT
+from .status import get_job_statuses
+from .stream import JobUpdates, job_stream
+from .archives import ArchiveIngestor, ArchiveError, ExtractionWriteError
+from .lines import LineIndexer, LineIndex, SubmissionFile
+from ..results.blocks import MATCH_BLOCKS_KEY_TEMPLATE
+from .cancel import (
+    JobCancelled,
+    CancellationWatcher,
+    AsyncCancellationWatcher,
+    CancellationListener,
+    cancel_job,
+    clear_cancelled,
+    is_cancelled
+)
+from ...redis import REDIS_INSTANCE
+from asgiref.sync import async_to_sync, sync_to_async
+from unittest import mock
+from ..results.models import Match, MOSSResult
 from django.utils.timezone import now
+from datetime import timedelta
 from django.http.response import HttpResponse
 from django.urls import reverse
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from types import SimpleNamespace
 from django.contrib.auth import get_user_model
+import io
 import os
+import time
+import uuid
+import hashlib
+import asyncio
+import json
+import socket
 import zipfile
+import tarfile
+import threading
 from automoss.apps.moss.moss import (
     MOSS,
+    MossAPIWrapper,
     RecoverableMossException,
     FatalMossException,
     EmptyResponse
 )
+from automoss.apps.moss.pinger import Pinger
 
 User = get_user_model()
 
@@ -28,7 +77,7 @@ class TestJobs(AuthenticatedUserTest):
     def setUp(self):
         super().setUp()
 
-    def _run_test(self, files, expected_status=200):
+    def _submit_job(self, files):
         job_params = {
             "job-language": "Python",
             "job-max-until-ignored": "10",
@@ -36,7 +85,12 @@ class TestJobs(AuthenticatedUserTest):
             'job-name': 'Job Name',
             "files": files
         }
-        submit_response = self.client.post(reverse("jobs:new"), job_params)
+        # Jobs are processed by the tests themselves (tasks are run eagerly)
+        with mock.patch('automoss.apps.jobs.views.queue_job'):
+            return self.client.post(reverse("jobs:new"), job_params)
+
+    def _run_test(self, files, expected_status=200):
+        submit_response = self._submit_job(files)
 
         response = submit_response.json()
         self.assertEqual(submit_response.status_code, expected_status)
@@ -101,6 +155,88 @@ class TestJobs(AuthenticatedUserTest):
         for test_path in self._get_test_files():
             self._run_zip_test(test_path)
 
+    def test_process_job_async(self):
+        """Test that the asynchronous version of process job runs correctly"""
+
+        test_file = next(self._get_test_files())
+        with zipfile.ZipFile(test_file, 'r') as archive:
+            files = [archive.open(name) for name in archive.namelist()]
+            job_id = self._submit_job(files).json().get('job_id')
+
+        # Queue the remaining stages (run eagerly)
+        async_to_sync(process_job_async)(job_id).apply_async()
+
+        job = Job.objects.get(job_id=job_id)
+        self.assertEqual(job.status, COMPLETED_STATUS)
+        self.assertTrue(Match.objects.filter(moss_result__job=job).exists())
+        job.delete()
+
+    def test_lazy_match_details(self):
+        """Test that matches can be stored from the report's index, and fetched when viewed"""
+
+        test_file = next(self._get_test_files())
+        with zipfile.ZipFile(test_file, 'r') as archive:
+            files = [archive.open(name) for name in archive.namelist()]
+            job_id = self._submit_job(files).json().get('job_id')
+
+        with mock.patch('automoss.apps.jobs.tasks.LAZY_MATCH_DETAILS', True), \
+                mock.patch('automoss.apps.jobs.tasks.PREFETCH_MATCH_DETAILS', False):
+            process_job(job_id)
+
+        match = Match.objects.filter(moss_result__job__job_id=job_id).first()
+        self.assertIsNotNone(match)
+        self.assertIsNone(match.line_matches)
+
+        response = self.client.get(reverse("jobs:results:match", kwargs={
+            "job_id": job_id,
+            'match_id': match.match_id
+        }))
+        self.assertEqual(response.status_code, 200)
+
+        match.refresh_from_db()
+        self.assertTrue(match.line_matches)
+        Job.objects.get(job_id=job_id).delete()
+
+    def test_store_result(self):
+        """Test that matches are stored in batches, reporting progress"""
+
+        test_file = next(self._get_test_files())
+        with zipfile.ZipFile(test_file, 'r') as archive:
+            files = [archive.open(name) for name in archive.namelist()]
+            job_id = self._submit_job(files).json().get('job_id')
+
+        job = Job.objects.get(job_id=job_id)
+        names = list(Submission.objects.filter(
+            job=job).values_list('submission_id', flat=True))
+        self.assertGreaterEqual(len(names), 2)
+
+        num_matches = 1000
+        matches = [
+            SimpleNamespace(name_1=names[i % len(names)], name_2=names[(i + 1) % len(names)],
+                            percentage_1=50, percentage_2=60, lines_matched=10,
+                            line_matches=[], index=i)
+            for i in range(num_matches)
+        ]
+        # Matches with unknown submissions are skipped
+        matches.append(SimpleNamespace(name_1='unknown', name_2=names[0], percentage_1=1,
+                                       percentage_2=1, lines_matched=1, line_matches=[], index=num_matches))
+
+        result = SimpleNamespace(url='http://localhost/results/1/1',
+                                 matches=iter(matches), num_matches=len(matches))
+        with CaptureQueriesContext(connection) as queries, \
+                mock.patch('automoss.apps.jobs.tasks.MATCH_BATCH_SIZE', 250):
+            moss_result = store_result(ResultWriter(job, result.url), result)
+
+        self.assertLess(len(queries), 50)  # Batch size may be limited by the database
+        self.assertEqual(Match.objects.filter(
+            moss_result=moss_result).count(), num_matches)
+        progress = JobEvent.objects.filter(
+            job=job, message__startswith='Stored').order_by('pk')
+        self.assertEqual(progress.count(), num_matches // 250 + 1)  # Including the last (partial) batch
+        self.assertEqual(progress.last().message,
+                         f'Stored {num_matches} of {len(matches)} matches')
+        job.delete()
+
     def test_invalid_jobs(self):
         """Test invalid jobs"""
 
@@ -159,7 +295,560 @@ class TestJobs(AuthenticatedUserTest):
 
             setattr(MOSS, 'generate_url', test_method)
 
-            self._run_zip_test(test_file)
+            # MOSS is not pinged (without the monitor), so the load is not refreshed
+            with mock.patch('automoss.apps.moss.pinger.LOAD_WAIT_TIME', 0):
+                self._run_zip_test(test_file)
+
+    def test_resume_job(self):
+        """Test that interrupted jobs resume parsing from the next match to be stored"""
+
+        test_file = next(self._get_test_files())
+        with zipfile.ZipFile(test_file, 'r') as archive:
+            files = [archive.open(name) for name in archive.namelist()]
+            job_id = self._submit_job(files).json().get('job_id')
+
+        process_job(job_id)
+        job = Job.objects.get(job_id=job_id)
+        num_matches = Match.objects.filter(moss_result__job=job).count()
+        self.assertGreater(num_matches, 1)
+        self.assertEqual(job.stage, NOTIFY_STAGE)
+
+        # Simulate the worker being restarted after storing the first match
+        first = Match.objects.get(moss_result__job=job, index=0)
+        Match.objects.filter(moss_result__job=job, index__gt=0).delete()
+        job.status = PARSING_STATUS
+        job.stage = PARSE_STAGE
+        job.next_match_index = 1
+        job.save()
+
+        with mock.patch.object(MOSS, 'generate_url') as generate_url:
+            resume_job(job)
+            generate_url.assert_not_called()  # Not uploaded again
+
+        job = Job.objects.get(job_id=job_id)
+        self.assertEqual(job.status, COMPLETED_STATUS)
+        self.assertEqual(Match.objects.filter(
+            moss_result__job=job).count(), num_matches)
+        self.assertTrue(Match.objects.filter(match_id=first.match_id).exists())
+        job.delete()
+
+    def test_retry_scheduled(self):
+        """Recoverable errors schedule another attempt, instead of waiting in the worker"""
+
+        test_file = next(self._get_test_files())
+        with zipfile.ZipFile(test_file, 'r') as archive:
+            files = [archive.open(name) for name in archive.namelist()]
+            job_id = self._submit_job(files).json().get('job_id')
+
+        original = MOSS.generate_url
+
+        def test_method(**kwargs):
+            setattr(MOSS, 'generate_url', original)
+            raise RecoverableMossException('Test')
+
+        setattr(MOSS, 'generate_url', test_method)
+        with mock.patch('automoss.apps.jobs.tasks.job_signature') as queue:
+            self.assertIsNone(process_job(job_id))
+
+        job = Job.objects.get(job_id=job_id)
+        self.assertEqual(job.status, INQUEUE_STATUS)
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(job.last_error, 'Test')
+        self.assertIsNotNone(job.retry_deadline)
+
+        queue.assert_called_once()
+        args, kwargs = queue.call_args
+        self.assertEqual(args, (job_id,))
+        self.assertEqual(kwargs['attempt'], 1)
+
+        # Stale attempts are ignored
+        self.assertIsNone(process_job(job_id, attempt=0))
+        self.assertEqual(Job.objects.get(job_id=job_id).attempts, 1)
+
+        process_job(job_id, url=kwargs['url'], attempt=kwargs['attempt'])
+        job = Job.objects.get(job_id=job_id)
+        self.assertEqual(job.status, COMPLETED_STATUS)
+        self.assertEqual(job.attempts, 2)
+        job.delete()
+
+    def test_lease(self):
+        """Test that a job is only processed by the worker which holds its lease"""
+
+        test_file = next(self._get_test_files())
+        with zipfile.ZipFile(test_file, 'r') as archive:
+            files = [archive.open(name) for name in archive.namelist()]
+            job_id = self._submit_job(files).json().get('job_id')
+
+        lease = JobLease(job_id, lease_time=30)
+        self.assertTrue(lease.acquire())
+        self.assertFalse(JobLease(job_id).acquire())
+        task_id = Job.objects.get(job_id=job_id).task_id
+
+        # Other workers queue the stage again, for when the lease would expire
+        with mock.patch.object(process_job, 'apply_async') as apply_async:
+            process_job(job_id)
+        apply_async.assert_called_once()
+        self.assertGreater(apply_async.call_args.kwargs['countdown'], 0)
+        job = Job.objects.get(job_id=job_id)
+        self.assertEqual(job.status, INQUEUE_STATUS)
+        self.assertEqual(job.task_id, task_id)  # Task holding the lease is still revoked when cancelled
+
+        self.assertTrue(lease.renew())
+        lease.release()
+        self.assertFalse(lease.renew())
+
+        process_job(job_id)
+        job = Job.objects.get(job_id=job_id)
+        self.assertEqual(job.status, COMPLETED_STATUS)
+        self.assertTrue(JobLease(job_id).acquire())  # Released once finished
+        job.delete()
+
+    def test_redelivered_stage(self):
+        """Test that a stage which is redelivered after it has finished is not continued"""
+
+        test_file = next(self._get_test_files())
+        with zipfile.ZipFile(test_file, 'r') as archive:
+            files = [archive.open(name) for name in archive.namelist()]
+            job_id = self._submit_job(files).json().get('job_id')
+
+        process_job(job_id)
+        job = Job.objects.get(job_id=job_id)
+
+        # Simulate the worker being lost after fetching the report (i.e., before acknowledging it)
+        job.status = PARSING_STATUS
+        job.stage = PARSE_STAGE
+        job.save()
+
+        with mock.patch.object(MOSS, 'download_report') as download_report, \
+                mock.patch('automoss.apps.jobs.tasks.dispatch') as dispatch:
+            fetch_report(job_id, job.report_url, job.attempts)
+        download_report.assert_not_called()
+        dispatch.assert_not_called()  # Report is not parsed again
+
+        job = Job.objects.get(job_id=job_id)
+        self.assertEqual(job.stage, PARSE_STAGE)
+        job.delete()
+
+    def test_lease_heartbeat(self):
+        """Test that leases are renewed while held, and lost once taken by another worker"""
+
+        lease = JobLease('heartbeat', lease_time=0.3, heartbeat_interval=0.1)
+        self.assertTrue(lease.acquire())
+
+        with lease:
+            time.sleep(0.5)
+            self.assertFalse(lease.lost)
+            self.assertFalse(JobLease('heartbeat').acquire())
+
+            # Simulate the lease expiring (e.g., worker paused) and being acquired by another
+            REDIS_INSTANCE.delete(lease.key)
+            self.assertTrue(JobLease('heartbeat', lease_time=1).acquire())
+            time.sleep(0.3)
+            self.assertTrue(lease.lost)
+
+        REDIS_INSTANCE.delete(lease.key)
+
+    def test_report_error(self):
+        """Test that errors are published before the load of MOSS is read, once refreshed by the monitor"""
+
+        job = Job.objects.create(user=self.user, status=INQUEUE_STATUS)
+        published = []
+
+        def monitor():
+            # Pings (saving the load) once the error is read
+            published.append(reader.wait(lambda event: event['kind'] == ERROR_EVENT, 5))
+            Pinger.save_load()
+
+        with JobEventReader() as reader:
+            thread = threading.Thread(target=monitor)
+            thread.start()
+            start = time.time()
+            cancelled, load = report_error(job, EmptyResponse('Test'))
+            thread.join()
+
+        self.assertFalse(cancelled)
+        self.assertEqual(load, Pinger.get_load())
+        self.assertEqual(published[0]['job_id'], str(job.job_id))
+        self.assertLess(time.time() - start, 5)
+
+        # Cancelled jobs are not reported
+        cancel_job(job.job_id)
+        self.assertEqual(report_error(job, EmptyResponse('Test')), (True, None))
+        clear_cancelled(job.job_id)
+        job.delete()
+
+    def test_event_bus(self):
+        """Test that changes to a user's jobs are published to the user's channel"""
+
+        other_user = User.objects.create_user(
+            course_code='other', primary_email_address='other@localhost', moss_id=2, password='Testing123!')
+
+        with JobEventReader(self.user) as reader, JobEventReader() as all_reader:
+            job = Job.objects.create(user=self.user, status=INQUEUE_STATUS)
+            JobEvent.objects.create(job=job, type=INQUEUE_EVENT, message='Queued')
+            publish_job_event(job, PROGRESS_EVENT, stored=1, total=2)
+            Job.objects.create(user=other_user)  # Not read
+
+            events = [reader.get(1) for _ in range(3)]
+            self.assertEqual([event['kind'] for event in events], [
+                STATUS_EVENT, LOG_EVENT, PROGRESS_EVENT])
+            self.assertTrue(all(event['job_id'] == str(job.job_id) for event in events))
+            self.assertEqual(events[0]['status'], INQUEUE_STATUS)
+            self.assertEqual(events[1]['message'], 'Queued')
+            self.assertIsNone(reader.get(0.1))
+
+            # Reads the events of all users
+            event = all_reader.wait(lambda event: event['job_id'] != str(job.job_id), 1)
+            self.assertIsNotNone(event)
+
+        job.delete()
+
+    def test_cancel_job(self):
+        """Test that cancelled jobs are flagged, not processed, and can be retried"""
+
+        test_file = next(self._get_test_files())
+        with zipfile.ZipFile(test_file, 'r') as archive:
+            files = [archive.open(name) for name in archive.namelist()]
+            job_id = self._submit_job(files).json().get('job_id')
+
+        response = self.client.post(reverse('jobs:cancel'), json.dumps(
+            {'job_id': job_id}), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(is_cancelled(job_id))
+
+        process_job(job_id)
+        job = Job.objects.get(job_id=job_id)
+        self.assertEqual(job.status, CANCELLED_STATUS)
+        self.assertEqual(job.attempts, 0)
+
+        # Stops storing matches, if cancelled while parsing
+        writer = ResultWriter(job, 'http://localhost/results/1/1')
+        with self.assertRaises(JobCancelled):
+            writer.write([])
+
+        with mock.patch('automoss.apps.jobs.views.queue_job') as queue_job:
+            self.client.post(reverse('jobs:retry'), json.dumps(
+                {'job_id': job_id}), content_type='application/json')
+        queue_job.assert_called_once()
+        self.assertFalse(is_cancelled(job_id))
+        job.delete()
+
+    def test_cancellation_watcher(self):
+        """Test that a worker waiting for MOSS is interrupted once its job is cancelled"""
+
+        server = socket.create_server(('localhost', 0))  # Never responds
+        moss = MossAPIWrapper(1)
+        moss.socket.connect(server.getsockname())
+        moss.socket.settimeout(10)
+
+        job_id = 'watched'
+        with CancellationWatcher(job_id, poll_interval=60) as watcher:  # Notified, not polled
+            watcher.add_hook(moss.abort)
+            threading.Timer(0.2, cancel_job, (job_id,)).start()
+
+            start = time.time()
+            self.assertEqual(moss.read(), '')  # Connection aborted
+            self.assertLess(time.time() - start, 5)
+
+        self.assertTrue(watcher.cancelled)
+        clear_cancelled(job_id)
+        moss.socket.close()
+        server.close()
+
+    def test_async_cancellation_watcher(self):
+        """Test that jobs on an event loop share a listener, which calls the hooks of cancelled jobs"""
+
+        cancel_job('cancelled')  # Before being watched (found by checking the flags)
+
+        async def watch():
+            listener = CancellationListener(poll_interval=60)  # Notified, not polled
+            watchers = [AsyncCancellationWatcher(job_id, listener)
+                        for job_id in ('cancelled', 'watched', 'other')]
+            aborted = []
+            for watcher in watchers:
+                await watcher.__aenter__()
+                watcher.add_hook(lambda job_id=watcher.job_id: aborted.append(job_id))
+
+            loop = asyncio.get_running_loop()
+            start = loop.time()
+            await asyncio.sleep(0.2)
+            await asyncio.to_thread(cancel_job, 'watched')
+            while len(aborted) < 2 and loop.time() - start < 5:
+                await asyncio.sleep(0.05)
+
+            for watcher in watchers:
+                await watcher.__aexit__(None, None, None)
+            await asyncio.sleep(0.1)
+            return [watcher.cancelled for watcher in watchers], aborted, listener
+
+        cancelled, aborted, listener = asyncio.run(watch())
+        self.assertEqual(cancelled, [True, True, False])
+        self.assertCountEqual(aborted, ['cancelled', 'watched'])
+        self.assertEqual(listener.callbacks, {})
+        self.assertIsNone(listener._task)  # Stopped, once nothing is watched
+
+        for job_id in ('cancelled', 'watched'):
+            clear_cancelled(job_id)
+
+    def test_match_blocks(self):
+        """Test that a match's blocks are cut from its submissions' files, and cached until its job is deleted"""
+
+        test_file = next(self._get_test_files())
+        with zipfile.ZipFile(test_file, 'r') as archive:
+            files = [archive.open(name) for name in archive.namelist()]
+            job_id = self._submit_job(files).json().get('job_id')
+        process_job(job_id)
+
+        match = Match.objects.filter(moss_result__job__job_id=job_id).order_by('-lines_matched').first()
+        self.assertIsNotNone(match)
+        match_url = reverse("jobs:results:match", kwargs={"job_id": job_id, 'match_id': match.match_id})
+
+        response = self.client.get(match_url)
+        self.assertEqual(response.status_code, 200)
+
+        # Blocks contain each file, in full
+        for key, submission in (('first', match.first_submission), ('second', match.second_submission)):
+            with open(SUBMISSION_UPLOAD_TEMPLATE.format(user_id=self.user.user_id, job_id=job_id,
+                                                        file_type='files', file_id=submission.submission_id)) as fp:
+                self.assertEqual(''.join(block['text'] for block in response.context['blocks'][key]), fp.read())
+        self.assertEqual(sorted(response.context['match_numbers']), list(range(1, len(match.line_matches) + 1)))
+
+        with mock.patch('automoss.apps.results.blocks.get_block_structure') as get_block_structure:
+            self.assertEqual(self.client.get(match_url).status_code, 200)
+            get_block_structure.assert_not_called()
+
+        Job.objects.get(job_id=job_id).delete()
+        self.assertIsNone(cache.get(MATCH_BLOCKS_KEY_TEMPLATE.format(match_id=match.match_id)))
+
+    def test_windowed_match(self):
+        """Test that only similar sections of a match are sent when windowed, and the rest on request"""
+
+        test_file = next(self._get_test_files())
+        with zipfile.ZipFile(test_file, 'r') as archive:
+            files = [archive.open(name) for name in archive.namelist()]
+            job_id = self._submit_job(files).json().get('job_id')
+        process_job(job_id)
+
+        match = Match.objects.filter(moss_result__job__job_id=job_id).order_by('-lines_matched').first()
+        kwargs = {"job_id": job_id, 'match_id': match.match_id}
+
+        with mock.patch('automoss.apps.results.views.MATCH_WINDOW_CONTEXT_LINES', 1):
+            response = self.client.get(reverse("jobs:results:match", kwargs=kwargs), {'view': 'windowed'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['view'], 'windowed')
+
+        lines_url = reverse("jobs:results:match_lines", kwargs=kwargs)
+        for key, submission in (('first', match.first_submission), ('second', match.second_submission)):
+            blocks = response.context['blocks'][key]
+            self.assertTrue(any(block.get('collapsed') for block in blocks))
+
+            text = ''
+            for block in blocks:
+                if block.get('collapsed'):
+                    lines = self.client.get(lines_url, {'submission': key, 'from': block['from'], 'to': block['to']})
+                    self.assertEqual(lines.status_code, 200)
+                    text += lines.json()['text']
+                else:
+                    text += block['text']
+
+            with open(SUBMISSION_UPLOAD_TEMPLATE.format(user_id=self.user.user_id, job_id=job_id,
+                                                        file_type='files', file_id=submission.submission_id)) as fp:
+                self.assertEqual(text, fp.read())
+
+        # Invalid requests
+        self.assertEqual(self.client.get(lines_url, {'submission': 'third', 'from': 1, 'to': 2}).status_code, 400)
+        self.assertEqual(self.client.get(lines_url, {'submission': 'first', 'from': 2, 'to': 1}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("jobs:results:match_lines", kwargs={
+            "job_id": job_id, 'match_id': uuid.uuid4()}), {'submission': 'first', 'from': 1, 'to': 2}).status_code, 404)
+
+        Job.objects.get(job_id=job_id).delete()
+
+    def test_submission_upload(self):
+        """Test that submitted files are written (and indexed) as they are uploaded, recording their size and digest"""
+
+        contents = [b'print("first")\n' * 1000, b'print("second")']
+        files = [SimpleUploadedFile(f'student{i}.py', data) for i, data in enumerate(contents)]
+        job_id = self._submit_job(files).json().get('job_id')
+
+        submissions = Submission.objects.filter(job__job_id=job_id).order_by('name')
+        self.assertEqual(len(submissions), len(contents))
+        for submission, data in zip(submissions, contents):
+            self.assertEqual(submission.size, len(data))
+            self.assertEqual(submission.digest, hashlib.sha256(data).hexdigest())
+
+            source = SubmissionFile(self.user.user_id, job_id, 'files', submission.submission_id)
+            with open(source.path, 'rb') as fp:
+                self.assertEqual(fp.read(), data)
+            self.assertTrue(os.path.exists(source.index_path))
+        Job.objects.get(job_id=job_id).delete()
+
+        # Files of rejected jobs are removed
+        user_path = os.path.dirname(JOB_URL_TEMPLATE.format(user_id=self.user.user_id, job_id=''))
+        response = self.client.post(reverse("jobs:new"), {
+            'job-language': 'Unknown', 'files': [SimpleUploadedFile('student.py', b'print()')]})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(os.path.exists(user_path))
+
+        client = Client(enforce_csrf_checks=True)
+        client.login(**self.login_credentials)
+        with mock.patch('automoss.apps.jobs.views.queue_job'):
+            response = client.post(reverse("jobs:new"), {
+                'job-language': 'Python', 'job-max-until-ignored': 10, 'job-max-displayed-matches': 250,
+                'files': [SimpleUploadedFile('student.py', b'print()')]})
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(os.path.exists(user_path))
+        self.assertFalse(Job.objects.filter(user=self.user).exists())
+
+    def test_bulk_submissions(self):
+        """Test that the number of queries made to create a job does not depend on its number of files"""
+
+        num_queries = []
+        for num_files in (2, 50):
+            files = [SimpleUploadedFile(f'student{i}.py', b'print()') for i in range(num_files)]
+            with CaptureQueriesContext(connection) as queries:
+                job_id = self._submit_job(files).json().get('job_id')
+            num_queries.append(len(queries))
+
+            self.assertEqual(Submission.objects.filter(job__job_id=job_id).count(), num_files)
+            Job.objects.get(job_id=job_id).delete()
+
+        self.assertEqual(num_queries[0], num_queries[1])
+
+    def test_archive_submission(self):
+        """Test that a class's archive is extracted into a submission per student"""
+
+        def make_zip(files):
+            buffer = io.BytesIO()
+            with zipfile.ZipFile(buffer, 'w') as archive:
+                for name, data in files.items():
+                    archive.writestr(name, data)
+            return buffer.getvalue()
+
+        def make_tar(files):
+            buffer = io.BytesIO()
+            with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+                for name, data in files.items():
+                    info = tarfile.TarInfo(name)
+                    info.size = len(data)
+                    archive.addfile(info, io.BytesIO(data))
+            return buffer.getvalue()
+
+        files = {
+            'Class/Alice (1)/Submission attachment(s)/code.zip': make_zip({'a.py': b'print("a")', 'notes.txt': b'notes'}),
+            'Class/Bob (2)/Submission attachment(s)/code.tar+1.gz': make_tar({'src/b.py': b'print("b")'}),
+            'Class/Carol (3)/c.py': b'print("c")',
+            'Class/Dave (4)/Submission attachment(s)/code.zip': b'Not an archive',
+            'Class/__MACOSX/Carol (3)/._c.py': b'',
+            'Class/grades.csv': b'',
+        }
+        params = {
+            'job-name': 'Class', 'job-language': 'Python', 'job-max-until-ignored': 10,
+            'job-max-displayed-matches': 250
+        }
+
+        def submit(name, data):
+            with mock.patch('automoss.apps.jobs.views.queue_job'):
+                return self.client.post(reverse('jobs:new_archive'), {
+                    **params, 'archive': SimpleUploadedFile(name, data)})
+
+        response = submit('class.zip', make_zip(files))
+        self.assertEqual(response.status_code, 200)
+        job_id = response.json().get('job_id')
+
+        submissions = {submission.name: submission for submission in Submission.objects.filter(job__job_id=job_id)}
+        self.assertEqual(set(submissions), {'Alice (1)', 'Bob (2)', 'Carol (3)'})
+        self.assertEqual(Job.objects.get(job_id=job_id).num_students, 3)
+        with open(SubmissionFile(self.user.user_id, job_id, 'files', submissions['Alice (1)'].submission_id).path, 'rb') as fp:
+            self.assertEqual(fp.read(), b'>>> a.py <<<\nprint("a")\n\n')
+        self.assertEqual(submissions['Bob (2)'].digest, hashlib.sha256(b'>>> src/b.py <<<\nprint("b")\n\n').hexdigest())
+        self.assertTrue(JobEvent.objects.filter(job__job_id=job_id, message__contains='Dave (4)').exists())
+        Job.objects.get(job_id=job_id).delete()
+
+        # Tars are read as streams
+        response = submit('class.tar.gz', make_tar(files))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Submission.objects.filter(job__job_id=response.json().get('job_id')).count(), 3)
+        Job.objects.get(job_id=response.json().get('job_id')).delete()
+
+        # Invalid archives
+        self.assertEqual(submit('class.rar', b'').status_code, 400)
+        self.assertEqual(submit('class.zip', b'Not an archive').status_code, 400)
+        self.assertEqual(submit('class.zip', make_zip({'Class/Carol/c.py': b''})).status_code, 400)
+        self.assertFalse(Job.objects.filter(user=self.user).exists())
+
+        # Limits
+        def ingest(**limits):
+            ingestor = ArchiveIngestor(['py'], lambda student: mock.MagicMock(), **limits)
+            return ingestor.ingest(io.BytesIO(make_zip(files)), 'class.zip')
+
+        self.assertEqual(len(ingest()), 3)
+        for limits in ({'max_size': 100}, {'max_files': 3}, {'max_depth': 1}):
+            with self.assertRaises(ArchiveError):
+                ingest(**limits)
+
+        # Members which are not extracted count towards the size limit, before they are decompressed
+        big = {'Class/Alice (1)/a.py': b'', 'Class/Bob (2)/b.py': b'', 'Class/big.bin': bytes(10 * 1024 * 1024)}
+        cases = [
+            ('class.tar.gz', make_tar(big), 0),
+            ('class.zip', make_zip(big), 0),
+            ('class.zip', make_zip({'Class/Alice (1)/code.tar.gz': make_tar(big)}), 1)  # Only the nested archive is read
+        ]
+        for name, data, num_copies in cases:
+            ingestor = ArchiveIngestor(['py'], lambda student: mock.MagicMock(), max_size=100000)
+            with mock.patch.object(ingestor, '_copy', wraps=ingestor._copy) as copy:
+                with self.assertRaises(ArchiveError):
+                    ingestor.ingest(io.BytesIO(data), name)
+            self.assertEqual(copy.call_count, num_copies)
+
+        # Encrypted archives (flagged, as zipfile cannot encrypt) are skipped within a student's folder
+        encrypted = make_zip({'attach.py': b'print("b")'})
+        encrypted = encrypted.replace(b'PK\x03\x04\x14\x00\x00', b'PK\x03\x04\x14\x00\x01')
+        encrypted = encrypted.replace(b'PK\x01\x02\x14\x03\x14\x00\x00', b'PK\x01\x02\x14\x03\x14\x00\x01')
+        with self.assertRaises(RuntimeError):
+            zipfile.ZipFile(io.BytesIO(encrypted)).read('attach.py')
+
+        classes = {'alice/a.py': b'print("a")', 'bob/b.py': b'print("b")', 'bob/attach.zip': encrypted}
+        ingestor = ArchiveIngestor(['py'], lambda student: mock.MagicMock())
+        self.assertEqual(set(ingestor.ingest(io.BytesIO(make_zip(classes)), 'class.zip')), {'alice', 'bob'})
+        self.assertEqual(ingestor.skipped, ['bob/attach.zip'])
+        with self.assertRaises(ArchiveError):
+            ArchiveIngestor(['py'], lambda student: mock.MagicMock()).ingest(io.BytesIO(encrypted), 'class.zip')
+
+        # Errors writing the files of a nested archive (e.g., disk full) are not skipped
+        def create_full_writer(student):
+            writer = mock.MagicMock()
+            writer.write.side_effect = OSError(28, 'No space left on device')
+            return writer
+
+        ingestor = ArchiveIngestor(['py'], create_full_writer)
+        with self.assertRaises(ExtractionWriteError):
+            ingestor.ingest(io.BytesIO(make_zip(files)), 'class.zip')
+        self.assertEqual(ingestor.skipped, [])
+
+    def test_line_index(self):
+        """Test that ranges of lines are read from a submission's file by its line index"""
+
+        contents = b'first\nsecond\r\n\nfourth'
+        indexer = LineIndexer()
+        for i in range(0, len(contents), 4):  # Lines are split across chunks
+            indexer.update(contents[i:i + 4])
+        index = indexer.finish()
+        self.assertEqual(index.num_lines, 4)
+
+        job = Job.objects.create(user=self.user)
+        source = SubmissionFile(self.user.user_id, job.job_id, 'files', 'test')
+        os.makedirs(os.path.dirname(source.path))
+        with open(source.path, 'wb') as fp:
+            fp.write(contents)
+
+        # Files which were not indexed when uploaded are indexed when first read
+        with source:
+            self.assertEqual(source.read_lines(1, 2), 'first\nsecond\n')
+            self.assertEqual(source.read_lines(3), '\nfourth')
+            self.assertEqual(source.read_lines(3, 2), '')
+            self.assertEqual(source.read_lines(5), '')
+        self.assertEqual(LineIndex.load(source.index_path).bounds, index.bounds)
+        job.delete()
 
 
 class TestAPI(AuthenticatedUserTest):
@@ -177,6 +866,49 @@ class TestAPI(AuthenticatedUserTest):
         self.assertEqual(response.status_code, 200)
         self.assertTrue(isinstance(response, HttpResponse))
 
+    def test_get_jobs_pages(self):
+        """Test loading a user's jobs a page at a time, and then only those which changed"""
+
+        creation_date = now()
+        for _ in range(4):  # Jobs created at the same time are ordered by id
+            Job.objects.create(user=self.user, creation_date=creation_date)
+
+        jobs, params = [], {'limit': 2}
+        while True:
+            data = self.client.get(reverse("api:jobs:get_jobs"), params).json()
+            self.assertLessEqual(len(data['jobs']), 2)
+            jobs += data['jobs']
+            if data['next'] is None:
+                break
+            params['before'] = data['next']
+
+        expected = list(Job.objects.user_jobs(self.user).order_by(
+            '-creation_date', '-pk').values_list('job_id', flat=True))
+        self.assertEqual([job['job_id'] for job in jobs], expected)
+        self.assertNotIn('report_url', jobs[0])  # Only displayed fields
+
+        # Only jobs modified since (or within the margin before)
+        Job.objects.user_jobs(self.user).update(modified=now() - timedelta(
+            milliseconds=JOBS_SYNC_MARGIN + 1000))
+        data = self.client.get(reverse("api:jobs:get_jobs"), {'updated_since': data['updated']}).json()
+        self.assertEqual(data['jobs'], [])
+
+        job = Job.objects.get(job_id=expected[-1])
+        job.status = COMPLETED_STATUS
+        job.save()
+        for _ in range(2):  # Syncs overlap (e.g., for jobs committed late)
+            data = self.client.get(reverse("api:jobs:get_jobs"), {'updated_since': data['updated']}).json()
+            self.assertEqual([job['job_id'] for job in data['jobs']], [job.job_id])
+
+        # Removed jobs
+        removed = Job.objects.get(job_id=expected[0])
+        removed.delete()
+        data = self.client.get(reverse("api:jobs:get_jobs"), {'updated_since': data['updated']}).json()
+        self.assertIn(str(removed.job_id), data['removed'])
+
+        response = self.client.get(reverse("api:jobs:get_jobs"), {'before': 'invalid'})
+        self.assertEqual(response.status_code, 400)
+
     def test_get_statuses(self):
         """Test API for getting statuses of a user's jobs"""
 
@@ -186,6 +918,49 @@ class TestAPI(AuthenticatedUserTest):
         self.assertEqual(response.status_code, 200)
         self.assertTrue(isinstance(response, HttpResponse))
 
+    def test_status_mirror(self):
+        """Test that statuses are read from the status mirror, and unchanged statuses are not sent again"""
+
+        job = Job.objects.create(user=self.user, status=INQUEUE_STATUS)
+        params = {'job_ids': f'{job.job_id},{self.test_job.job_id}'}
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("api:jobs:get_statuses"), params)
+        self.assertEqual(response.json(), {
+            str(job.job_id): INQUEUE_STATUS, str(self.test_job.job_id): COMPLETED_STATUS})
+        self.assertFalse(any('"jobs_job"' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(get_job_statuses(self.user, ['unknown']), {})
+
+        # Jobs which do not exist (or belong to another user) are only read once
+        other = Job.objects.create(user=User.objects.create_user(
+            course_code='other', primary_email_address='other@localhost', moss_id=2, password='Testing123!'))
+        for _ in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                missing = self.client.get(reverse("api:jobs:get_statuses"), {
+                    'job_ids': f',unknown,{other.job_id}'})
+            self.assertEqual(missing.json(), {})
+        self.assertFalse(any('"jobs_job"' in query['sql'] for query in queries.captured_queries))
+
+        # Unchanged
+        response = self.client.get(reverse("api:jobs:get_statuses"), params,
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        job.status = CANCELLED_STATUS
+        job.save()
+        response = self.client.get(reverse("api:jobs:get_statuses"), params,
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()[str(job.job_id)], CANCELLED_STATUS)
+
+        job.delete()
+        self.assertNotIn(str(job.job_id), get_job_statuses(self.user, [str(job.job_id)]))
+
+        response = self.client.get(reverse("api:moss:get_status"))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse("api:moss:get_status"), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
     def test_get_logs(self):
         """Test API for getting logs of a user's jobs"""
 
@@ -195,6 +970,124 @@ class TestAPI(AuthenticatedUserTest):
         self.assertEqual(response.status_code, 200)
         self.assertTrue(isinstance(response, HttpResponse))
 
+    def test_get_new_logs(self):
+        """Test that only the events after each job's cursor are returned, using a single query"""
+
+        other_job = Job.objects.create(user=self.user, status=INQUEUE_STATUS)
+        events = [JobEvent.objects.create(job=job, type=INQUEUE_EVENT, message=str(i))
+                  for i in range(3) for job in (self.test_job, other_job)]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("api:jobs:get_logs"), {
+                'job_ids': f'{self.test_job.job_id},{other_job.job_id}',
+                'since': f'{events[2].pk},0'
+            })
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if 'jobs_jobevent' in query['sql']]), 1)
+
+        data = response.json()
+        self.assertEqual([log['id'] for log in data[str(self.test_job.job_id)]], [events[4].pk])
+        self.assertEqual([log['id'] for log in data[str(other_job.job_id)]],
+                         [events[1].pk, events[3].pk, events[5].pk])
+
+    def test_job_updates(self):
+        """Test that only new job events (and changed statuses) are read for streams"""
+
+        job = Job.objects.create(user=self.user, status=INQUEUE_STATUS)
+        JobEvent.objects.create(job=job, type=INQUEUE_EVENT, message='Queued')
+
+        updates = JobUpdates(self.user, [job.job_id])
+        messages, cursor = updates.poll()
+        self.assertEqual([event for event, _ in messages], ['logs', 'status'])
+        self.assertFalse(messages[0][1]['append'])
+        self.assertFalse(updates.finished)
+
+        self.assertEqual(updates.poll(), ([], cursor))  # Statuses checked again
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(updates.poll(), ([], cursor))
+        self.assertEqual(len(queries), 1)  # Only new events
+
+        job.status = COMPLETED_STATUS
+        job.save()
+        JobEvent.objects.create(job=job, type=COMPLETED_EVENT, message='Completed')
+
+        messages, _ = updates.poll()
+        self.assertEqual(messages[0][1]['logs'][0]['type'], COMPLETED_EVENT)
+        self.assertTrue(messages[0][1]['append'])
+        self.assertEqual(messages[1][1]['status'], COMPLETED_STATUS)
+        self.assertTrue(updates.finished)
+
+        # Published events are applied without reading the database
+        job = Job.objects.create(user=self.user, status=INQUEUE_STATUS)
+        updates = JobUpdates(self.user, [job.job_id])
+        _, cursor = updates.poll()
+        with JobEventReader(self.user) as reader:
+            job.status = PARSING_STATUS
+            job.save()
+            event = JobEvent.objects.create(job=job, type=PARSING_EVENT, message='Parsing')
+            JobEvent.objects.create(job=self.test_job, type=COMPLETED_EVENT, message='Other')
+            events = [reader.get(1) for _ in range(3)]
+
+        with CaptureQueriesContext(connection) as queries:
+            messages, cursor = updates.apply(events + events)  # Repeated events are ignored
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(cursor, event.pk)
+        self.assertEqual(messages, [
+            ('logs', {'job_id': str(job.job_id), 'logs': [{'id': event.pk, 'type': PARSING_EVENT, 'str': str(event)}], 'append': True}),
+            ('status', {'job_id': str(job.job_id), 'status': PARSING_STATUS})
+        ])
+
+    def test_stream(self):
+        """Test streaming the updates of a user's jobs (until they have finished)"""
+
+        self.test_job.status = PARSING_STATUS
+        self.test_job.save()
+        session = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+
+        def finish_job():
+            self.test_job.status = COMPLETED_STATUS
+            self.test_job.save()
+            JobEvent.objects.create(
+                job=self.test_job, type=COMPLETED_EVENT, message='Completed')
+
+        def run_stream(cookie):
+            sent = []
+
+            async def receive():
+                # Finish the job while streaming (publishing its events)
+                await asyncio.sleep(0.5)
+                await sync_to_async(finish_job)()
+                await asyncio.sleep(60)
+                return {'type': 'http.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+
+            scope = {
+                'type': 'http',
+                'method': 'GET',
+                'path': reverse('api:jobs:stream'),
+                'query_string': f'job_ids={self.test_job.job_id}'.encode(),
+                'headers': [(b'cookie', f'{settings.SESSION_COOKIE_NAME}={cookie}'.encode())]
+            }
+            async_to_sync(job_stream)(scope, receive, send)
+            return sent
+
+        start = time.time()
+        sent = run_stream(session)
+        self.assertLess(time.time() - start, 5)  # Not waiting to poll again
+        self.assertEqual(sent[0]['status'], 200)
+        body = b''.join(message.get('body', b'') for message in sent[1:]).decode()
+        self.assertIn('event: logs', body)
+        self.assertIn(f'"status": "{COMPLETED_STATUS}"', body)
+        self.assertTrue(body.endswith('data: {}\n\n'))  # done
+
+        self.assertEqual(run_stream('invalid')[0]['status'], 403)
+
+        # Not served by Django
+        response = self.client.get(reverse('api:jobs:stream'))
+        self.assertEqual(response.status_code, 501)
+
 
 class TestResults(AuthenticatedUserTest):
     """ Test case to test user views """
@@ -211,3 +1104,43 @@ class TestResults(AuthenticatedUserTest):
             reverse("jobs:results:index", kwargs={"job_id": self.test_job.job_id}))
         self.assertEqual(report_response.status_code, 200)
         self.assertTrue(isinstance(report_response, HttpResponse))
+
+    def test_get_result_pages(self):
+        """Test that matches are sorted, filtered and paginated by the database"""
+
+        moss_result = MOSSResult.objects.create(job=self.test_job, url='http://localhost/results/1/1')
+        submissions = [Submission.objects.create(job=self.test_job, name=f'student{i}', file_type='files')
+                       for i in range(4)]
+        num_matches = 30
+        Match.objects.bulk_create([
+            Match(moss_result=moss_result, first_submission=submissions[i % 4],
+                  second_submission=submissions[(i + 1) % 4], first_percentage=i,
+                  second_percentage=num_matches - i, lines_matched=i, index=i)
+            for i in range(num_matches)
+        ])
+
+        def get_page(**params):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse("jobs:results:index", kwargs={
+                    "job_id": self.test_job.job_id}), params)
+            self.assertEqual(response.status_code, 200)
+            return response.context['page'], len(queries)
+
+        with mock.patch('automoss.apps.results.views.MATCHES_PAGE_SIZE', 10):
+            page, num_queries = get_page()
+            self.assertEqual([m.lines_matched for m in page], list(range(29, 19, -1)))
+            self.assertEqual(page.paginator.num_pages, 3)
+
+            # Submissions are read with their matches (not once per row)
+            _, last_num_queries = get_page(page=3)
+            self.assertEqual(num_queries, last_num_queries)
+
+            page, _ = get_page(sort='similarity', min_similarity=25)
+            self.assertEqual([max(m.first_percentage, m.second_percentage) for m in page],
+                             [30, 29, 29, 28, 28, 27, 27, 26, 26, 25])
+            self.assertEqual(page.paginator.count, 11)
+
+            # Invalid parameters are ignored
+            page, _ = get_page(sort='invalid', min_similarity='invalid', page='invalid')
+            self.assertEqual(page.number, 1)
+            self.assertEqual(page.paginator.count, num_matches)
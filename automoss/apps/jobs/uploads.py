@@ -0,0 +1,162 @@
+import os
+import uuid
+import hashlib
+from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.core.files.uploadedfile import UploadedFile
+from .lines import LineIndexer
+from ...settings import (
+    SUBMISSION_TYPES,
+    SUBMISSION_UPLOAD_TEMPLATE,
+    SUBMISSION_LINES_TEMPLATE
+)
+
+# Submission uploads - the files of a new job are written straight to their
+# submission's path as they are received, instead of being spooled first
+UPLOAD_CHUNK_SIZE = 256 * 1024  # Bytes, received (and written) at a time
+UPLOAD_DIGEST = 'sha256'
+
+
+class InvalidSubmission(Exception):
+    """Raised when the files of a new job cannot be used (e.g., none were submitted)"""
+
+
+class SubmissionUpload(UploadedFile):
+    """A submission's file, already written (and indexed) at its path"""
+
+    def __init__(self, path, submission_id, file_type, digest, name, content_type, size, charset, content_type_extra=None):
+        super().__init__(None, name, content_type, size, charset, content_type_extra)
+        self.path = path
+        self.submission_id = submission_id
+        self.file_type = file_type
+        self.digest = digest
+
+    def open(self, mode='rb'):
+        self.file = open(self.path, mode)
+        return self
+
+
+class SubmissionWriter:
+    """Writes a new submission's file (a chunk at a time), recording its size,
+    digest and line index (see lines.py) as it is written.
+
+    The file is opened when written to, so can be paused (closed) between writes.
+    """
+
+    def __init__(self, user_id, job_id, file_type, name, content_type=None, charset=None, content_type_extra=None):
+        self.submission_id = str(uuid.uuid4())
+        self.file_type = file_type
+        self.name = name
+        self.content_type = content_type
+        self.charset = charset
+        self.content_type_extra = content_type_extra
+
+        path_args = dict(user_id=user_id, job_id=job_id, file_type=file_type, file_id=self.submission_id)
+        self.path = SUBMISSION_UPLOAD_TEMPLATE.format(**path_args)
+        self.index_path = SUBMISSION_LINES_TEMPLATE.format(**path_args)
+
+        self.file = None
+        self.size = 0
+        self.digest = hashlib.new(UPLOAD_DIGEST)
+        self.indexer = LineIndexer()
+
+    def write(self, data):
+        if self.file is None:
+            self.file = open(self.path, 'ab')
+        self.file.write(data)
+        self.digest.update(data)
+        self.indexer.update(data)
+        self.size += len(data)
+
+    def pause(self):
+        """Close the file until it is next written to"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        """Finish the file, returning it as an upload"""
+        self.pause()
+        self.indexer.finish().save(self.index_path)
+
+        return SubmissionUpload(
+            path=self.path,
+            submission_id=self.submission_id,
+            file_type=self.file_type,
+            digest=self.digest.hexdigest(),
+            name=self.name,
+            content_type=self.content_type,
+            size=self.size,
+            charset=self.charset,
+            content_type_extra=self.content_type_extra
+        )
+
+    def discard(self):
+        self.pause()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SubmissionWriters:
+    """Creates the writers of a new job's submissions (and their directories, once per submission type)"""
+
+    def __init__(self, user_id, job_id):
+        self.user_id = user_id
+        self.job_id = job_id
+        self.directories = set()
+
+    def create(self, file_type, name, **kwargs):
+        writer = SubmissionWriter(self.user_id, self.job_id, file_type, name, **kwargs)
+
+        directory = os.path.dirname(writer.path)
+        if directory not in self.directories:
+            os.makedirs(directory, exist_ok=True)
+            self.directories.add(directory)
+
+        return writer
+
+
+class SubmissionUploadHandler(FileUploadHandler):
+    """Writes the files of a new job (fields named by submission type) to their
+    submissions' paths, a chunk at a time (see SubmissionWriter).
+
+    Submission IDs are chosen as files are received. Other files are left to
+    the next handler.
+    """
+
+    chunk_size = UPLOAD_CHUNK_SIZE
+
+    def __init__(self, request, job_id):
+        super().__init__(request)
+        self.writers = SubmissionWriters(request.user.user_id, job_id)
+        self.writer = None
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        if field_name not in SUBMISSION_TYPES:
+            self.writer = None
+            return
+
+        self.writer = self.writers.create(
+            field_name, self.file_name, content_type=self.content_type,
+            charset=self.charset, content_type_extra=self.content_type_extra)
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.writer is None:
+            return raw_data
+
+        self.writer.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if self.writer is None:
+            return None
+
+        upload = self.writer.close()
+        self.writer = None
+        return upload
+
+    def upload_interrupted(self):
+        if self.writer is not None:
+            self.writer.discard()
+            self.writer = None
@@ -7,6 +7,7 @@ app_name = 'jobs'
 urlpatterns = [
     # Submit new job
     path('new', views.New.as_view(), name='new'),
+    path('new/archive', views.NewFromArchive.as_view(), name='new_archive'),
     path('cancel', views.Cancel.as_view(), name='cancel'),
     path('remove', views.Remove.as_view(), name='remove'),
     path('retry', views.Retry.as_view(), name='retry'),
@@ -28,6 +29,9 @@ apipatterns = [
 
     # Get log of jobs
     path('get_logs', views.JSONJobEvents.as_view(), name='get_logs'),
+
+    # Stream status and log updates of jobs (served by automoss/asgi.py)
+    path('stream', views.JobStream.as_view(), name='stream'),
 ]
 
 urlpatterns += apipatterns
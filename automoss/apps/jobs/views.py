@@ -1,9 +1,11 @@
 
-import os
 import json
+import uuid
+from datetime import timedelta
 
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
 from django.shortcuts import render
 from django.template.defaulttags import register
 from django.http.response import JsonResponse
@@ -11,13 +13,21 @@ from django.core.serializers import serialize
 from django.utils.safestring import mark_safe
 from django.views import View
 from django.utils.timezone import now
+from django.utils.dateparse import parse_datetime
+from django.db import transaction
+from django.db.models import Q, F
 
-from .tasks import process_job
+from .tasks import queue_job
+from .cancel import cancel_job, clear_cancelled
+from .status import get_job_statuses, get_removed_jobs
+from .uploads import SubmissionUploadHandler, SubmissionWriters, InvalidSubmission
+from .archives import ArchiveIngestor
 
 from .models import (
     Job,
     Submission,
-    JobEvent
+    JobEvent,
+    remove_job_files
 )
 from ...settings import (
     STATUS_CONTEXT,
@@ -30,21 +40,26 @@ from ...settings import (
     READABLE_LANGUAGE_MAPPING,
     SUBMISSION_TYPES,
 
-    SUBMISSION_UPLOAD_TEMPLATE,
-
     INQUEUE_EVENT,
     CREATED_EVENT,
     FILES_NAME,
+    BASE_FILES_NAME,
+    ARCHIVE_NAME,
+    SUPPORTED_LANGUAGES,
 
     MAX_UNTIL_IGNORED_RANGE,
     MAX_DISPLAYED_MATCHES_RANGE,
 
     CANCELLED_STATUS,
     INQUEUE_STATUS,
-    CANCELLED_EVENT
+    CANCELLED_EVENT,
+
+    JOBS_PAGE_SIZE,
+    JOBS_SYNC_MARGIN
 )
 from ...celery import app
 from ..utils.core import in_range
+from ..utils.http import conditional_json_response
 
 
 @register.filter(is_safe=True)
@@ -71,12 +86,36 @@ class Index(View):
         return render(request, self.template, self.context)
 
 
+@method_decorator(csrf_exempt, name='dispatch')
 @method_decorator(login_required, name='dispatch')
 class New(View):
     """ Job creation view """
 
     def post(self, request):
         """ Post new job """
+
+        # Files are written to their submissions' paths as they are received
+        # (see uploads.py), so the handler is added (and the job's ID chosen)
+        # before the request is read, including by the CSRF check
+        job_id = str(uuid.uuid4())
+        request.upload_handlers.insert(0, SubmissionUploadHandler(request, job_id))
+
+        # Messages about the submitted files, logged once the job is created
+        self.messages = []
+
+        try:
+            response = self.create_job(request, job_id)
+        except Exception:
+            remove_job_files(request.user.user_id, job_id)
+            raise
+
+        if response.status_code != 200:
+            remove_job_files(request.user.user_id, job_id)
+        return response
+
+    @method_decorator(csrf_protect)
+    def create_job(self, request, job_id):
+        """ Create a job from the request (with uploaded files) """
         posted_language = request.POST.get('job-language')
         language = READABLE_LANGUAGE_MAPPING.get(posted_language)
 
@@ -100,55 +139,84 @@ class New(View):
             }
             return JsonResponse(data, status=400)
 
-        if not request.FILES.getlist(FILES_NAME):
+        try:
+            uploads = self.get_uploads(request, job_id, language)
+        except InvalidSubmission as e:
             data = {
-                'message': 'No files submitted'
+                'message': str(e)
             }
             return JsonResponse(data, status=400)
 
         comment = request.POST.get('job-name')
 
-        num_students = len(request.FILES.getlist(FILES_NAME))
+        num_students = sum(f.file_type == FILES_NAME for f in uploads)
+
+        # The job is created with all of its submissions (in one query), whose
+        # files were written (and indexed) as they were uploaded
+        with transaction.atomic():
+            new_job = Job.objects.create(
+                job_id=job_id,
+                user=request.user,
+                language=language,
+                num_students=num_students,
+                comment=comment,
+                max_until_ignored=max_until_ignored,
+                max_displayed_matches=max_displayed_matches
+            )
+            JobEvent.objects.create(job=new_job, type=CREATED_EVENT,
+                                    message=f'Created job for {num_students} students with language=\'{posted_language}\', {max_until_ignored=} and {max_displayed_matches=}')
+            for message in self.messages:
+                JobEvent.objects.create(job=new_job, type=CREATED_EVENT, message=message[:256])
+
+            Submission.objects.bulk_create([
+                Submission(job=new_job, submission_id=f.submission_id, name=f.name,
+                           file_type=f.file_type, size=f.size, digest=f.digest)
+                for f in uploads
+            ])
+
+            JobEvent.objects.create(
+                job=new_job, type=INQUEUE_EVENT, message='Placed in the processing queue')
+
+        queue_job(job_id)
+
+        data = json.loads(serialize('json', [new_job]))[0]['fields']
+        return JsonResponse(data, status=200, safe=False)
 
-        new_job = Job.objects.create(
-            user=request.user,
-            language=language,
-            num_students=num_students,
-            comment=comment,
-            max_until_ignored=max_until_ignored,
-            max_displayed_matches=max_displayed_matches
-        )
-        JobEvent.objects.create(job=new_job, type=CREATED_EVENT,
-                                message=f'Created job for {num_students} students with language=\'{posted_language}\', {max_until_ignored=} and {max_displayed_matches=}')
+    def get_uploads(self, request, job_id, language):
+        """ Get the (written) files of the job's submissions, raising InvalidSubmission if they cannot be used """
+        if not request.FILES.getlist(FILES_NAME):
+            raise InvalidSubmission('No files submitted')
 
-        job_id = new_job.job_id
+        return [f for file_type in SUBMISSION_TYPES for f in request.FILES.getlist(file_type)]
 
-        for file_type in SUBMISSION_TYPES:
-            for f in request.FILES.getlist(file_type):
 
-                submission = Submission.objects.create(
-                    job=new_job, name=f.name, file_type=file_type)
+class NewFromArchive(New):
+    """ Job creation view, from an archive of a class's submissions (extracted by the server) """
 
-                file_path = SUBMISSION_UPLOAD_TEMPLATE.format(
-                    user_id=request.user.user_id,
-                    job_id=job_id,
-                    file_type=file_type,
-                    file_id=submission.submission_id
-                )
+    def get_uploads(self, request, job_id, language):
+        """ Extract a submission for each student in the archive (see archives.py) """
+        archive = request.FILES.get(ARCHIVE_NAME)
+        if archive is None:
+            raise InvalidSubmission('No archive submitted')
 
-                # Ensure directory exists (only run once)
-                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        writers = SubmissionWriters(request.user.user_id, job_id)
+        name_length = Submission._meta.get_field('name').max_length
+        ingestor = ArchiveIngestor(SUPPORTED_LANGUAGES[language][2], lambda student: writers.create(
+            FILES_NAME, student[:name_length], content_type='text/plain'))
 
-                with open(file_path, 'wb') as fp:
-                    fp.write(f.read())
+        try:
+            students = ingestor.ingest(archive, archive.name)
+        finally:
+            archive.close()
 
-        JobEvent.objects.create(
-            job=new_job, type=INQUEUE_EVENT, message='Placed in the processing queue')
+        if ingestor.skipped:
+            self.messages.append(f'Skipped unreadable archives: {", ".join(ingestor.skipped)}')
 
-        process_job.delay(job_id)
+        if len(students) < 2:
+            raise InvalidSubmission('Must include at least 2 students.')
 
-        data = json.loads(serialize('json', [new_job]))[0]['fields']
-        return JsonResponse(data, status=200, safe=False)
+        # Base files may also be submitted (written as they were uploaded)
+        return [writer.close() for writer in students.values()] + request.FILES.getlist(BASE_FILES_NAME)
 
 
 @method_decorator(login_required, name='dispatch')
@@ -165,19 +233,13 @@ class Cancel(View):
             }
             return JsonResponse(data, status=404, safe=False)
 
-        def get_task_id(job_id):  # Find task currently being processed by celery
-            i = app.control.inspect()
-            for job_list in (i.active, i.scheduled, i.reserved):
-                for jobs in job_list().values():
-                    for job in jobs:
-                        if job['args'][0] == job_id:
-                            return job['id']
-            return None
+        # The worker processing the job stops at its next check of the flag (or
+        # immediately, if waiting for MOSS), leaving the worker process intact
+        cancel_job(job.job_id)
 
-        task_id = get_task_id(job_id)
-
-        if task_id is not None:
-            app.control.revoke(task_id, terminate=True)
+        if job.task_id is not None:
+            # Discard the job's queued step, if it has not started (e.g., waiting to be retried)
+            app.control.revoke(job.task_id)
 
         job.status = CANCELLED_STATUS
         job.completion_date = now()
@@ -224,12 +286,14 @@ class Retry(View):
                 'message': f'Job does not exist ({job_id})'
             }
             return JsonResponse(data, status=404, safe=False)
-     
+
+        clear_cancelled(job.job_id)
         job.status = INQUEUE_STATUS
+        job.reset_attempts()
         job.save()
         JobEvent.objects.create(
             job=job, type=INQUEUE_EVENT, message='Restarting... Placed in processing queue')
-        process_job.delay(job_id)
+        queue_job(job_id)
 
         return JsonResponse({
             'message': 'Success'
@@ -240,10 +304,78 @@ class Retry(View):
 class JSONJobs(View):
     """ JSON view of Jobs """
 
+    # Fields of each job which are displayed in the job table
+    fields = ('job_id', 'comment', 'language', 'num_students',
+              'status', 'creation_date', 'completion_date')
+
+    @staticmethod
+    def get_cursor(job):
+        """ Position of a job in the list of jobs (newest first) """
+        return f"{job['creation_date'].isoformat()},{job['id']}"
+
+    @staticmethod
+    def parse_cursor(cursor):
+        creation_date, pk = cursor.rsplit(',', 1)
+        creation_date = parse_datetime(creation_date)
+        if creation_date is None:
+            raise ValueError(f'Invalid date ({creation_date})')
+        return creation_date, int(pk)
+
     def get(self, request):
-        """ Get user's jobs """
-        results = Job.objects.user_jobs(request.user).values()
-        return JsonResponse(list(results), status=200, safe=False)
+        """ Get a page of the user's jobs (newest first), after the cursor `before`, or all of
+        the user's jobs which were modified after `updated_since` (given by a previous response),
+        and the IDs of those which were removed since.
+
+        Jobs are modified when saved, which may be before their transaction commits (e.g., in
+        New), so each sync overlaps the last by JOBS_SYNC_MARGIN (clients ignore jobs they have
+        already loaded). Removals are kept for a limited time (see status.py). """
+
+        updated = now()  # Before reading, so later changes are not missed
+        jobs = Job.objects.user_jobs(request.user)
+        removed = []
+
+        try:
+            updated_since = request.GET.get('updated_since')
+            if updated_since is not None:
+                updated_since = parse_datetime(updated_since)
+                if updated_since is None:
+                    raise ValueError('Invalid date')
+                updated_since -= timedelta(milliseconds=JOBS_SYNC_MARGIN)
+                jobs = jobs.filter(modified__gt=updated_since)
+                removed = get_removed_jobs(request.user, updated_since)
+                limit = None
+            else:
+                limit = int(request.GET.get('limit', JOBS_PAGE_SIZE))
+                if not in_range(limit, (1, JOBS_PAGE_SIZE)):
+                    raise ValueError(f'Limit must be at most {JOBS_PAGE_SIZE}')
+
+            before = request.GET.get('before')
+            if before is not None:
+                creation_date, pk = self.parse_cursor(before)
+                jobs = jobs.filter(Q(creation_date__lt=creation_date) | Q(
+                    creation_date=creation_date, pk__lt=pk))
+
+        except ValueError as e:
+            return JsonResponse({
+                'message': f'Invalid parameters ({e})'
+            }, status=400)
+
+        jobs = jobs.order_by('-creation_date', '-pk').values('id', *self.fields)
+        if limit is not None:
+            jobs = jobs[:limit + 1]  # Determine whether another page exists
+
+        results = list(jobs)
+        next_cursor = None
+        if limit is not None and len(results) > limit:
+            results = results[:limit]
+            next_cursor = self.get_cursor(results[-1])
+
+        return JsonResponse({
+            'jobs': [{field: job[field] for field in self.fields} for job in results],
+            'next': next_cursor,
+            'removed': removed,
+            'updated': updated.isoformat()  # Not truncated (see DjangoJSONEncoder)
+        }, status=200)
 
 
 @method_decorator(login_required, name='dispatch')
@@ -251,13 +383,10 @@ class JSONStatuses(View):
     """ JSON view of statuses """
 
     def get(self, request):
-        """ Get statuses of requested jobs (by ID) """
+        """ Get statuses of requested jobs (by ID), from the status mirror (see status.py) """
         job_ids = request.GET.get('job_ids', '').split(',')
-        results = Job.objects.user_jobs(
-            request.user).filter(job_id__in=job_ids)
-
-        data = {j.job_id: j.status for j in results}
-        return JsonResponse(data, status=200)
+        data = get_job_statuses(request.user, job_ids)
+        return conditional_json_response(request, data)
 
 
 @method_decorator(login_required, name='dispatch')
@@ -265,15 +394,39 @@ class JSONJobEvents(View):
     """ JSON view of job events """
 
     def get(self, request):
-        """ Get statuses of requested jobs (by ID) """
+        """ Get events of requested jobs (by ID), after the (optional) id of the last event received for each job (since) """
         job_ids = request.GET.get('job_ids', '').split(',')
-        results = Job.objects.user_jobs(
-            request.user).filter(job_id__in=job_ids)
-
-        data = {
-            j.job_id: [{'type': x.type, 'str': str(
-                x)} for x in JobEvent.objects.filter(job=j)]
-            for j in results
-        }
+        since = request.GET.get('since', '').split(',')
+
+        # Only the events after each job's cursor are read (in a single query)
+        cursors = {}
+        for index, job_id in enumerate(job_ids):
+            try:
+                cursors[job_id] = int(since[index])
+            except (IndexError, ValueError):
+                cursors[job_id] = 0
+
+        new_events = Q(job__job_id__in=[job_id for job_id, cursor in cursors.items() if cursor <= 0])
+        for job_id, cursor in cursors.items():
+            if cursor > 0:
+                new_events |= Q(job__job_id=job_id, pk__gt=cursor)
+
+        data = {}
+        events = JobEvent.objects.filter(new_events, job__user=request.user).annotate(
+            job_uuid=F('job__job_id')).order_by('pk')
+        for x in events:
+            data.setdefault(x.job_uuid, []).append(
+                {'id': x.pk, 'type': x.type, 'str': str(x)})
 
         return JsonResponse(data, status=200)
+
+
+@method_decorator(login_required, name='dispatch')
+class JobStream(View):
+    """ Stream of job updates, only available when served with ASGI """
+
+    def get(self, request):
+        """ Handled by automoss/asgi.py (see stream.job_stream), so clients fall back to polling """
+        return JsonResponse({
+            'message': 'Streaming job updates requires an ASGI server'
+        }, status=501)
@@ -1,31 +1,62 @@
 from urllib.parse import urlparse
-from bs4 import BeautifulSoup
+from lxml import html as lxml_html
+import abc
 import socket
 import os
 import re
-import requests
+import time
+import random
 import asyncio
 import aiohttp
+import atexit
+import gzip
+import hashlib
+import inspect
+import threading
+from collections import deque
 
 from ...settings import (
     SUPPORTED_LANGUAGES,
-    DEFAULT_MOSS_SETTINGS
+    DEFAULT_MOSS_SETTINGS,
+    MOSS_URL,
+    MOSS_PORT,
+    HTTP_MOSS_URL,
+    MAX_REPORT_CACHE_SIZE
 )
 
 
 MOSS_SOCKET_TIMEOUT = 3600 * 2  # 2 hours
-MOSS_URL = 'moss.stanford.edu'
-HTTP_MOSS_URL = f'http://{MOSS_URL}'
 SUPPORTED_MOSS_LANGUAGES = [SUPPORTED_LANGUAGES[language][1]
                             for language in SUPPORTED_LANGUAGES]
 HTTP_RETRY_COUNT = 5
 
+# Downloading of reports
+HTTP_TIMEOUT = 60  # Per request (seconds)
+HTTP_MAX_CONNECTIONS_PER_HOST = 8
+HTTP_MAX_CONCURRENT_REQUESTS = 16
+HTTP_RETRY_BASE_DELAY = 0.5  # Seconds
+HTTP_RETRY_MAX_DELAY = 10  # Seconds
+HTTP_RETRY_STATUSES = (408, 429)  # Client errors which are worth retrying
+HTTP_MAX_TIMINGS = 1000
+REPORT_CACHE_SUFFIX = '.html.gz'
+
+# Files larger than this are streamed from disk (sendfile), instead of being
+# sent together with their header
+MAX_COALESCED_FILE_SIZE = 64 * 1024
+
 ERROR_PREFIX = 'Error: '
 
+NAME_PERCENTAGE_PATTERN = re.compile(r'(\S+)\s+\((\d+)%\)')
+
 
 def is_valid_moss_url(url):
     """Determine if the url given is a valid url for a MOSS report (correct host)"""
-    return url and urlparse(url).netloc == MOSS_URL
+    return url and urlparse(url).netloc == urlparse(HTTP_MOSS_URL).netloc
+
+
+def get_match_url(url, index):
+    """Get the url of the page describing a match of a MOSS report"""
+    return f"{url.rstrip('/')}/match{index}-top.html"
 
 
 class MossException(Exception):
@@ -117,8 +148,12 @@ class MossConnectionError(RecoverableMossException):
     pass
 
 
-class MossAPIWrapper:
-    """Wrapper class for the MOSS API."""
+class MossProtocol(abc.ABC):
+    """Commands of the MOSS protocol, shared by the blocking and asyncio clients.
+
+    Subclasses implement `_send_string` and `_send_all`. Commands return
+    whatever these return, so they must be awaited when using the asyncio client.
+    """
 
     _ERRORS = {
         NoFiles.message: NoFiles
@@ -131,31 +166,6 @@ class MossAPIWrapper:
         :type user_id: int
         """
         self.user_id = user_id
-        self.socket = socket.socket()
-
-    def connect(self):
-        """Connect to the MOSS server"""
-        self.socket.connect((MOSS_URL, 7690))
-        self.socket.settimeout(MOSS_SOCKET_TIMEOUT)
-        self._send_string(f'moss {self.user_id}')  # authenticate user
-
-    def close(self):
-        """Close the MOSS connection"""
-        try:
-            self._send_string('end')
-            self.socket.shutdown(socket.SHUT_RDWR)
-            self.socket.close()
-            return True
-        except ConnectionError:
-            return False  # Do not throw error if unable to close
-
-    def read_raw(self, buffer):
-        """Read the raw information in the socket's buffer"""
-        return self.socket.recv(buffer)
-
-    def read(self, buffer=1024):
-        """Read the information in the socket's buffer as a string"""
-        return self.read_raw(buffer).decode().rstrip('\n')
 
     def set_directory(self, is_directory=True):
         """Set the upload to be directory mode
@@ -163,7 +173,7 @@ class MossAPIWrapper:
         :param is_directory: Whether the upload is in directory mode, defaults to True
         :type is_directory: bool, optional
         """
-        self._send_string(f'directory {is_directory:d}')
+        return self._send_string(f'directory {is_directory:d}')
 
     def set_experimental(self, experimental=True):
         """Set the upload to use the experimental server
@@ -171,7 +181,7 @@ class MossAPIWrapper:
         :param experimental: Whether the upload should be experimental, defaults to True
         :type experimental: bool, optional
         """
-        self._send_string(f'X {experimental:d}')
+        return self._send_string(f'X {experimental:d}')
 
     def set_max_matches(self, max_matches):
         """Set the max number of matches until ignored
@@ -183,7 +193,7 @@ class MossAPIWrapper:
         if max_matches < 1:
             raise InvalidParameter(
                 f'Max matches must be positive ({max_matches} is invalid).')
-        self._send_string(f'maxmatches {max_matches}')
+        return self._send_string(f'maxmatches {max_matches}')
 
     def set_max_displayed_matches(self, max_displayed_matches):
         """Set the max number of displayed matches
@@ -195,7 +205,7 @@ class MossAPIWrapper:
         if max_displayed_matches < 1:
             raise InvalidParameter(
                 f'Max displayed matches must be positive ({max_displayed_matches} is invalid).')
-        self._send_string(f'show {max_displayed_matches}')
+        return self._send_string(f'show {max_displayed_matches}')
 
     def set_language(self, language):
         """Set the language of the job
@@ -207,54 +217,38 @@ class MossAPIWrapper:
         if language not in SUPPORTED_MOSS_LANGUAGES:
             raise UnsupportedLanguage(language)
 
-        self._send_string(f'language {language}')
+        return self._send_string(f'language {language}')
 
     def upload_raw_file(self, file_path, bytes, language, file_id, use_basename=False):
         """Upload raw file to MOSS"""
 
-        size = len(bytes)
-
-        if use_basename:
-            file_path = os.path.basename(file_path)
-
-        # Replace whitespace with _
-        file_name = re.sub(r'\s+', '_', file_path).replace('\\', '/')
-
-        # Send file header information
-        self._send_string(f'file {file_id} {language} {size} {file_name}')
+        header = self._file_header(
+            file_path, len(bytes), language, file_id, use_basename)
 
-        # Send actual file info
-        self._send_raw(bytes)
+        # Send file header information and actual file info together
+        return self._send_all(header, bytes)
 
     def upload_raw_base_file(self, file_path, bytes, language, use_basename=False):
         """Upload raw base file to MOSS"""
 
-        self.upload_raw_file(file_path, bytes, language, 0, use_basename)
+        return self.upload_raw_file(file_path, bytes, language, 0, use_basename)
 
     def upload_base_file(self, file_path, language, use_basename=False):
         """Upload base file to MOSS"""
 
-        self.upload_file(file_path, language, 0, use_basename)
+        return self.upload_file(file_path, language, 0, use_basename)
 
-    def upload_file(self, file_path, language, file_id, use_basename=False):
-        """Upload file to MOSS"""
-
-        with open(file_path, 'rb') as f:
-            self.upload_raw_file(file_path, f.read(),
-                                 language, file_id, use_basename)
+    def _file_header(self, file_path, size, language, file_id, use_basename):
+        if use_basename:
+            file_path = os.path.basename(file_path)
 
-    def process(self, comment=''):
-        """Process the Job and return the generated report URL.
+        # Replace whitespace with _
+        file_name = re.sub(r'\s+', '_', file_path).replace('\\', '/')
 
-        :param comment: Name of the job, defaults to ''
-        :type comment: str, optional
-        :return: Generated report URL
-        :rtype: str
-        """
-        # Send final query
-        self._send_string(f'query 0 {comment}')
+        return f'file {file_id} {language} {size} {file_name}\n'.encode()
 
-        data = self.read()
+    def _parse_url(self, data):
+        """Return the report URL sent by MOSS after processing, or raise the error sent instead"""
         if is_valid_moss_url(data):
             return data
 
@@ -273,25 +267,214 @@ class MossAPIWrapper:
 
         raise EmptyResponse
 
+    @abc.abstractmethod
+    def _send_string(self, text):
+        """Send a line of the protocol"""
+
+    @abc.abstractmethod
+    def _send_all(self, *buffers):
+        """Send the given buffers, in order"""
+
+
+class MossAPIWrapper(MossProtocol):
+    """Wrapper class for the MOSS API."""
+
+    def __init__(self, user_id):
+        """Create an API wrapper object.
+
+        :param user_id: The user's MOSS ID
+        :type user_id: int
+        """
+        super().__init__(user_id)
+        self.socket = socket.socket()
+
+    def connect(self):
+        """Connect to the MOSS server"""
+        self.socket.connect((MOSS_URL, MOSS_PORT))
+        self.socket.settimeout(MOSS_SOCKET_TIMEOUT)
+        self._send_string(f'moss {self.user_id}')  # authenticate user
+
+    def close(self):
+        """Close the MOSS connection"""
+        try:
+            self._send_string('end')
+            self.socket.shutdown(socket.SHUT_RDWR)
+            self.socket.close()
+            return True
+        except OSError:
+            return False  # Do not throw error if unable to close (e.g., server closed connection)
+
+    def abort(self):
+        """Abort the MOSS connection (e.g., from another thread), interrupting any blocking reads"""
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # Not connected, or already closed
+
+    def read_raw(self, buffer):
+        """Read the raw information in the socket's buffer"""
+        return self.socket.recv(buffer)
+
+    def read(self, buffer=1024):
+        """Read the information in the socket's buffer as a string"""
+        return self.read_raw(buffer).decode().rstrip('\n')
+
+    def upload_file(self, file_path, language, file_id, use_basename=False):
+        """Upload file to MOSS, streaming it from disk"""
+
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            header = self._file_header(
+                file_path, size, language, file_id, use_basename)
+
+            if size <= MAX_COALESCED_FILE_SIZE:
+                # Small file (most submissions), send with header in one call
+                self._send_all(header, f.read(size))
+            else:
+                # Large file, copy directly from disk to the socket
+                self._send_all(header)
+                self.socket.sendfile(f, 0, size)
+
+    def process(self, comment=''):
+        """Process the Job and return the generated report URL.
+
+        :param comment: Name of the job, defaults to ''
+        :type comment: str, optional
+        :return: Generated report URL
+        :rtype: str
+        """
+        # Send final query
+        self._send_string(f'query 0 {comment}')
+
+        return self._parse_url(self.read())
+
     def _send_raw(self, bytes):
-        self.socket.send(bytes)
+        self.socket.sendall(bytes)
+
+    def _send_all(self, *buffers):
+        """Send buffers using a single (scatter/gather) call where possible, handling partial writes"""
+        if not hasattr(self.socket, 'sendmsg'):  # e.g., Windows
+            self._send_raw(b''.join(buffers))
+            return
+
+        buffers = [memoryview(b) for b in buffers if b]
+        while buffers:
+            sent = self.socket.sendmsg(buffers)
+            while buffers and sent >= len(buffers[0]):
+                sent -= len(buffers.pop(0))
+            if sent:
+                buffers[0] = buffers[0][sent:]
 
     def _send_string(self, text):
         return self._send_raw(f'{text}\n'.encode())
 
 
+class AsyncMossClient(MossProtocol):
+    """Client for the MOSS API, built on asyncio streams.
+
+    Has the same interface as MossAPIWrapper, but every method must be
+    awaited. While waiting for MOSS, the event loop is free to run other
+    sessions, so a single process can drive many jobs at once.
+    """
+
+    def __init__(self, user_id):
+        """Create an asyncio MOSS client.
+
+        :param user_id: The user's MOSS ID
+        :type user_id: int
+        """
+        super().__init__(user_id)
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        """Connect to the MOSS server"""
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(MOSS_URL, MOSS_PORT), MOSS_SOCKET_TIMEOUT)
+        await self._send_string(f'moss {self.user_id}')  # authenticate user
+
+    async def close(self):
+        """Close the MOSS connection"""
+        if self.writer is None:
+            return False  # Never connected
+
+        try:
+            await self._send_string('end')
+            self.writer.close()
+            await self.writer.wait_closed()
+            return True
+        except OSError:
+            return False  # Do not throw error if unable to close (e.g., server closed connection)
+
+    def abort(self):
+        """Abort the MOSS connection, interrupting any pending reads (must be called from the event loop)"""
+        if self.writer is not None:
+            self.writer.transport.abort()
+
+    async def read_raw(self, buffer):
+        """Read the raw information in the stream's buffer"""
+        return await asyncio.wait_for(self.reader.read(buffer), MOSS_SOCKET_TIMEOUT)
+
+    async def read(self, buffer=1024):
+        """Read the information in the stream's buffer as a string"""
+        return (await self.read_raw(buffer)).decode().rstrip('\n')
+
+    async def upload_file(self, file_path, language, file_id, use_basename=False):
+        """Upload file to MOSS, streaming it from disk"""
+
+        with open(file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            header = self._file_header(
+                file_path, size, language, file_id, use_basename)
+
+            if size <= MAX_COALESCED_FILE_SIZE:
+                await self._send_all(header, f.read(size))
+            else:
+                await self._send_all(header)
+                await asyncio.get_running_loop().sendfile(self.writer.transport, f, 0, size)
+
+    async def process(self, comment=''):
+        """Process the Job and return the generated report URL.
+
+        :param comment: Name of the job, defaults to ''
+        :type comment: str, optional
+        :return: Generated report URL
+        :rtype: str
+        """
+        # Send final query
+        await self._send_string(f'query 0 {comment}')
+
+        return self._parse_url(await self.read())
+
+    async def _send_all(self, *buffers):
+        self.writer.writelines(buffers)
+        await asyncio.wait_for(self.writer.drain(), MOSS_SOCKET_TIMEOUT)
+
+    async def _send_string(self, text):
+        await self._send_all(f'{text}\n'.encode())
+
+
 class MossMatch:
-    def __init__(self, html):
-        """Create a MossMatch object, given the HTML"""
+    def __init__(self, html, index=None):
+        """Create a MossMatch object, given the HTML.
+
+        Only the first table of the page (the match summary) is read, using
+        lxml's element API directly (no BeautifulSoup tree is built).
 
+        :param html: HTML of the match's page
+        :type html: str
+        :param index: Position of the match in the report, defaults to None
+        :type index: int, optional
+        """
+
+        self.index = index
         try:
-            soup = BeautifulSoup(html, 'lxml')
-            table = soup.find('table')
-            rows = iter(table.find_all('tr'))
+            table = lxml_html.fromstring(html).find('.//table')
+            rows = table.iter('tr')
 
             header = next(rows)
 
-            a, _, b, _, _ = header.find_all('th')
+            a, _, b, _, _ = header.findall('th')
             self.name_1, self.percentage_1 = self._parse_name_percentage(a)
             self.name_2, self.percentage_2 = self._parse_name_percentage(b)
 
@@ -299,7 +482,7 @@ class MossMatch:
             self.line_matches = []
             self.lines_matched = 0
             for tr in rows:
-                a, _, b, _ = tr.find_all('td')
+                a, _, b, _ = tr.findall('td')
                 first, second = [self._parse_from_to(x) for x in (a, b)]
                 self.line_matches.append({
                     'first': first,
@@ -312,68 +495,364 @@ class MossMatch:
             raise UnparseableMatch
 
     def _parse_from_to(self, tag):
-        info = list(map(int, tag.get_text(strip=True).split('-')))
+        info = list(map(int, tag.text_content().strip().split('-')))
         return {
             'from': info[0],
             'to': info[1]
         }
 
     def _parse_name_percentage(self, tag):
-        return re.search(r'(\S+)\s+\((\d+)%\)', tag.get_text(strip=True)).groups()
+        return NAME_PERCENTAGE_PATTERN.search(tag.text_content()).groups()
 
     def __str__(self):
         return f'{self.name_1} ({self.percentage_1}%) : {self.name_2} ({self.percentage_2}%) | {self.line_matches}'
 
 
-class Result:
-
-    def __init__(self, url):
-        """Create a Result object from a MOSS URL
+class MossMatchSummary(MossMatch):
+    def __init__(self, row, index):
+        """Create a MossMatchSummary object, given a row of the report's index table.
 
-        :param url: The MOSS URL
-        :type url: str
+        The row lists both percentages and the number of lines matched, but not
+        which lines match (line_matches is None). These can be fetched later,
+        from the match's own page.
         """
-        self.url = url
-        self.matches = list(self._parse_matches(url))
 
-    # https://stackoverflow.com/a/54878794
-    async def _fetch(self, session, url):
+        self.index = index
+        try:
+            a, b, lines = row.findall('td')
+            self.name_1, self.percentage_1 = self._parse_name_percentage(a)
+            self.name_2, self.percentage_2 = self._parse_name_percentage(b)
+            self.lines_matched = int(lines.text_content().strip())
+            self.line_matches = None
+        except Exception:
+            raise UnparseableMatch
+
+
+class ReportCache:
+    """Compressed on-disk cache of downloaded report pages, keyed by URL.
+
+    The pages of a MOSS report never change, so a page only needs to be
+    downloaded once: retries (and re-parses) of the same report read it from
+    disk instead. Once the cache grows larger than `max_size` bytes, the least
+    recently used pages are removed.
+    """
+
+    def __init__(self, directory, max_size=MAX_REPORT_CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self._size = None  # Unknown until first write
+        self._lock = threading.Lock()
+
+    def _path(self, url):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(self.directory, f'{key}{REPORT_CACHE_SUFFIX}')
+
+    def _entries(self):
+        try:
+            return [entry for entry in os.scandir(self.directory)
+                    if entry.name.endswith(REPORT_CACHE_SUFFIX)]
+        except FileNotFoundError:
+            return []
+
+    def get(self, url):
+        """Get the contents of a cached page, or None if it is not cached"""
+        path = self._path(url)
+        try:
+            with open(path, 'rb') as fp:
+                data = gzip.decompress(fp.read())
+            os.utime(path)  # Mark as recently used
+        except (OSError, EOFError):  # Missing, evicted or truncated
+            return None
+        return data.decode()
+
+    def set(self, url, text):
+        """Add a page to the cache, evicting old pages if it becomes too large"""
+        data = gzip.compress(text.encode())
+        path = self._path(url)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(entry.stat().st_size for entry in self._entries())
+
+            os.makedirs(self.directory, exist_ok=True)
+
+            # Write to a temporary file first, so partial pages are never read
+            temp_path = f'{path}.tmp'
+            with open(temp_path, 'wb') as fp:
+                fp.write(data)
+            os.replace(temp_path, path)
+
+            self._size += len(data)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry.stat().st_mtime)
+        self._size = sum(entry.stat().st_size for entry in entries)
+
+        for entry in entries:
+            if self._size <= self.max_size:
+                break
+            size = entry.stat().st_size
+            try:
+                os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+            self._size -= size
+
+    def __contains__(self, url):
+        return os.path.exists(self._path(url))
+
+    def __len__(self):
+        return len(self._entries())
+
+
+class ReportDownloader:
+    """Downloads MOSS report pages over a pool of keep-alive connections.
+
+    A single downloader (REPORT_DOWNLOADER) is shared by every report parsed
+    in a process. It runs its own event loop in a background thread, so that
+    its connection pool outlives any single report. At most
+    `max_concurrent_requests` requests are in flight at once, and failed
+    requests are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, max_connections_per_host=HTTP_MAX_CONNECTIONS_PER_HOST,
+                 max_concurrent_requests=HTTP_MAX_CONCURRENT_REQUESTS,
+                 retry_count=HTTP_RETRY_COUNT, timeout=HTTP_TIMEOUT):
+        self.max_connections_per_host = max_connections_per_host
+        self.max_concurrent_requests = max_concurrent_requests
+        self.retry_count = retry_count
+        self.timeout = timeout
+
+        # Timing information of the most recent requests
+        self.timings = deque(maxlen=HTTP_MAX_TIMINGS)
+
+        self._pid = None
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._semaphore = None
+        self._lock = threading.Lock()
+
+    def _get_loop(self):
+        with self._lock:
+            if self._pid != os.getpid():  # Not started (in this process)
+                self._pid = os.getpid()
+                self._loop = asyncio.new_event_loop()
+                self._session = None
+                self._thread = threading.Thread(target=self._loop.run_forever,
+                                                daemon=True)
+                self._thread.start()
+            return self._loop
+
+    async def _close_session(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def close(self):
+        """Close the connection pool, and stop the event loop (restarted if used again)"""
+        with self._lock:
+            if self._pid != os.getpid():  # Not started (in this process)
+                return
+            loop, thread = self._loop, self._thread
+            self._pid = self._loop = self._thread = None
+
+        asyncio.run_coroutine_threadsafe(self._close_session(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+    def _get_session(self):
+        if self._session is None:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=self.max_connections_per_host)
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+            self._semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        return self._session
+
+    def _backoff(self, attempt):
+        delay = min(HTTP_RETRY_MAX_DELAY, HTTP_RETRY_BASE_DELAY * 2 ** attempt)
+        return random.uniform(delay / 2, delay)
+
+    async def _fetch(self, url, cache=None):
+        if cache is not None:
+            text = await asyncio.to_thread(cache.get, url)
+            if text is not None:
+                return text
+
+        session = self._get_session()
+        start = time.perf_counter()
         error = None
-        for _ in range(HTTP_RETRY_COUNT):
+        for attempt in range(self.retry_count):
+            if attempt:
+                await asyncio.sleep(self._backoff(attempt))
+
             try:
-                async with session.get(url, raise_for_status=True) as resp:
-                    return await resp.text()
+                async with self._semaphore:
+                    async with session.get(url) as resp:
+                        if 400 <= resp.status < 500 and resp.status not in HTTP_RETRY_STATUSES:
+                            # Retrying will not help (e.g., report does not exist)
+                            self._record(url, start, attempt + 1, False)
+                            raise ReportParsingError(
+                                f'Invalid status code ({resp.status})')
+
+                        resp.raise_for_status()
+                        text = await resp.text()
+
+                self._record(url, start, attempt + 1, True)
+                if cache is not None:
+                    # Store immediately, so it is kept even if other pages fail
+                    await asyncio.to_thread(cache.set, url, text)
+                return text
 
             except (aiohttp.ClientError, asyncio.TimeoutError) as e:
                 error = e  # Retry
 
+        self._record(url, start, self.retry_count, False)
         raise ReportDownloadTimeout(error)
 
-    async def _fetch_concurrent(self, urls):
-        loop = asyncio.get_event_loop()
-        async with aiohttp.ClientSession() as session:
-            tasks = [loop.create_task(self._fetch(session, u))
-                     for u in urls]
-            return [await result for result in asyncio.as_completed(tasks)]
+    async def _fetch_all(self, urls, cache=None):
+        return await asyncio.gather(*(self._fetch(url, cache) for url in urls))
 
-    def _parse_matches(self, url):
-        base_url = f"{url.rstrip('/')}/"  # Ensure link ends with a /
-        req = requests.get(base_url, verify=False)
-        if req.status_code != 200:
-            raise ReportParsingError(
-                f'Invalid status code ({req.status_code})')
+    def _record(self, url, start, attempts, success):
+        self.timings.append({
+            'url': url,
+            'duration': time.perf_counter() - start,
+            'attempts': attempts,
+            'success': success
+        })
+
+    def fetch_all(self, urls, cache=None):
+        """Download pages, returning their contents (in the same order as the urls).
+
+        If a cache (ReportCache) is given, pages in it are not downloaded again,
+        and downloaded pages are added to it.
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self._fetch_all(urls, cache), self._get_loop())
+        return future.result()
+
+    def fetch(self, url, cache=None):
+        """Download a single page"""
+        return self.fetch_all([url], cache)[0]
+
+    def iter_fetch(self, urls, cache=None, window=None):
+        """Download pages, yielding their contents (in the same order as the urls).
+
+        At most `window` pages (by default, twice the number of concurrent
+        requests) are downloaded ahead of the consumer, so memory usage does
+        not grow with the number of urls.
+        """
+        window = window or 2 * self.max_concurrent_requests
+        loop = self._get_loop()
+
+        pending = deque()
+        try:
+            for url in urls:
+                pending.append(asyncio.run_coroutine_threadsafe(
+                    self._fetch(url, cache), loop))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+
+        finally:  # Stopped early (e.g., error or consumer closed generator)
+            for future in pending:
+                future.cancel()
+
+    def stats(self):
+        """Summary of the most recent requests"""
+        timings = list(self.timings)
+        durations = [x['duration'] for x in timings]
+        return {
+            'requests': len(timings),
+            'failed': sum(not x['success'] for x in timings),
+            'retries': sum(x['attempts'] - 1 for x in timings),
+            'mean_duration': sum(durations) / len(durations) if durations else None,
+            'max_duration': max(durations, default=None)
+        }
+
+
+REPORT_DOWNLOADER = ReportDownloader()
+atexit.register(REPORT_DOWNLOADER.close)
+
+
+class Result:
+
+    def __init__(self, url, downloader=REPORT_DOWNLOADER, summary_only=False, cache=None, stream=False, start=0):
+        """Create a Result object from a MOSS URL
+
+        :param url: The MOSS URL
+        :type url: str
+        :param downloader: Downloader used to fetch the report's pages, defaults to REPORT_DOWNLOADER
+        :type downloader: ReportDownloader, optional
+        :param summary_only: Only read the report's index page (see MossMatchSummary), defaults to False
+        :type summary_only: bool, optional
+        :param cache: Cache of the report's pages (see ReportCache), defaults to None
+        :type cache: ReportCache, optional
+        :param stream: Parse match pages as they are downloaded, in which case matches
+            is an iterator (which can only be consumed once), defaults to False
+        :type stream: bool, optional
+        :param start: Position (in the report) of the first match to parse, defaults to 0
+        :type start: int, optional
+        """
+        self.url = url
+        self.downloader = downloader
+        self.cache = cache
+        self.start = start
+
+        self.base_url = f"{url.rstrip('/')}/"  # Ensure link ends with a /
 
         # Possible to parse errors here
-        html = req.text
+        html = self.downloader.fetch(self.base_url, self.cache)
+
+        if summary_only:
+            rows = list(lxml_html.fromstring(html).find('.//table').iter('tr'))[1:]  # Skip header
+            self.num_matches = len(rows)
+            matches = self._parse_summaries(rows)
+        else:
+            self.num_matches = html.count('<TR>') - 1
+            matches = self._parse_matches()
+
+        self.matches = matches if stream else list(matches)
 
+    @classmethod
+    def download(cls, url, cache, downloader=REPORT_DOWNLOADER, summary_only=False):
+        """Download the pages of a report into a cache (see ReportCache), without parsing them
+
+        :return: The number of matches in the report
+        :rtype: int
+        """
+        base_url = f"{url.rstrip('/')}/"  # Ensure link ends with a /
+        html = downloader.fetch(base_url, cache)
         num_matches = html.count('<TR>') - 1
 
-        urls = [f'{base_url}match{i}-top.html' for i in range(num_matches)]
-        responses = asyncio.run(self._fetch_concurrent(urls))
+        if not summary_only:
+            urls = (get_match_url(base_url, i) for i in range(num_matches))
+            for _ in downloader.iter_fetch(urls, cache):
+                pass  # Only stored in the cache
 
-        for response in responses:
+        return num_matches
+
+    def _parse_matches(self):
+        urls = (get_match_url(self.base_url, i)
+                for i in range(self.start, self.num_matches))
+        responses = self.downloader.iter_fetch(urls, self.cache)
+
+        for index, response in enumerate(responses, start=self.start):
             try:
-                yield MossMatch(response)
+                yield MossMatch(response, index)
+            except UnparseableMatch:
+                pass
+
+    def _parse_summaries(self, rows):
+        for index, row in enumerate(rows[self.start:], start=self.start):
+            try:
+                yield MossMatchSummary(row, index)
             except UnparseableMatch:
                 pass
 
@@ -405,16 +884,50 @@ class MOSS:
         return cls.generate_report(url)
 
     @classmethod
-    def generate_report(cls, url):
+    def generate_report(cls, url, summary_only=False, cache=None, stream=False, start=0):
         """Generate a MOSS report, given a valid URL"""
 
         if not is_valid_moss_url(url):
             raise InvalidReportURL(f'Invalid report url: "{url}"')
 
         try:
-            return Result(url)
+            result = Result(url, summary_only=summary_only,
+                            cache=cache, stream=stream, start=start)
 
-        except ReportParsingError:
+        except ReportError:
+            # Includes download timeouts, which are worth retrying with the same url
+            raise
+
+        except Exception as e:
+            raise ReportParsingError(f'Malformed Report: {url}. Error: {e}')
+
+        if stream:
+            result.matches = cls._stream_matches(url, result.matches)
+        return result
+
+    @classmethod
+    def download_report(cls, url, cache, summary_only=False):
+        """Download the pages of a MOSS report, given a valid URL, so that it can be generated from the cache"""
+
+        if not is_valid_moss_url(url):
+            raise InvalidReportURL(f'Invalid report url: "{url}"')
+
+        try:
+            return Result.download(url, cache, summary_only=summary_only)
+
+        except ReportError:
+            raise
+
+        except Exception as e:
+            raise ReportParsingError(f'Malformed Report: {url}. Error: {e}')
+
+    @classmethod
+    def _stream_matches(cls, url, matches):
+        """Raise errors which occur while streaming matches as in generate_report"""
+        try:
+            yield from matches
+
+        except ReportError:
             raise
 
         except Exception as e:
@@ -427,6 +940,27 @@ class MOSS:
         if f and callable(f):
             f(*args, **kwargs)
 
+    @classmethod
+    async def async_callback(cls, f, *args, **kwargs):
+        """Run callback function, which may be a coroutine function"""
+
+        if f and callable(f):
+            result = f(*args, **kwargs)
+            if inspect.isawaitable(result):
+                await result
+
+    @classmethod
+    def _check_language_response(cls, data, language):
+        """Double check on server-side that language is accepted"""
+
+        if data == 'no':
+            raise UnsupportedLanguage(language)  # Unsupported language
+        elif data == '':
+            raise EmptyResponse
+        elif data != 'yes':
+            raise InvalidRequest(
+                f'Moss did not understand this request. Response: "{data}"')
+
     @classmethod
     def generate_url(cls, user_id, language=SUPPORTED_MOSS_LANGUAGES[0],
                      files=None, base_files=None, is_directory=False,
@@ -437,7 +971,7 @@ class MOSS:
 
                      # Define callbacks
                      on_start=None,
-                     on_connect=None,
+                     on_connect=None,  # Called with the connection
                      on_file_upload=None,  # Called for every file
                      on_base_file_upload=None,  # Called for every base file
 
@@ -466,7 +1000,7 @@ class MOSS:
             moss = MossAPIWrapper(user_id)
             moss.connect()
 
-            cls.callback(on_connect)
+            cls.callback(on_connect, moss)
 
             # Set options
             moss.set_directory(is_directory)
@@ -475,15 +1009,7 @@ class MOSS:
             moss.set_max_displayed_matches(max_displayed_matches)
             moss.set_language(language)
 
-            data = moss.read()
-            # Double check on server-side that language is accepted
-            if data == 'no':
-                raise UnsupportedLanguage(language)  # Unsupported language
-            elif data == '':
-                raise EmptyResponse
-            elif data != 'yes':
-                raise InvalidRequest(
-                    f'Moss did not understand this request. Response: "{data}"')
+            cls._check_language_response(moss.read(), language)
 
             cls.callback(on_upload_start)
 
@@ -516,3 +1042,79 @@ class MOSS:
             moss.close()
 
         return url
+
+    @classmethod
+    async def generate_url_async(cls, user_id, language=SUPPORTED_MOSS_LANGUAGES[0],
+                                 files=None, base_files=None, is_directory=False,
+                                 experimental=False,
+                                 max_until_ignored=DEFAULT_MOSS_SETTINGS['max_until_ignored'],
+                                 max_displayed_matches=DEFAULT_MOSS_SETTINGS['max_displayed_matches'],
+                                 comment='', use_basename=False,
+
+                                 # Define callbacks (may be coroutine functions)
+                                 on_start=None,
+                                 on_connect=None,  # Called with the connection
+                                 on_file_upload=None,  # Called for every file
+                                 on_base_file_upload=None,  # Called for every base file
+
+                                 on_upload_start=None,
+                                 on_upload_finish=None,
+
+                                 on_processing_start=None,
+                                 on_processing_finish=None
+                                 ):
+        """Asynchronous version of generate_url, using the asyncio MOSS client"""
+
+        await cls.async_callback(on_start)
+
+        # Returns report
+        if language not in SUPPORTED_MOSS_LANGUAGES:
+            raise UnsupportedLanguage(language)
+
+        if files is None:
+            raise MossException('No files supplied')
+
+        if base_files is None:
+            base_files = []
+
+        moss = AsyncMossClient(user_id)
+        try:
+            await moss.connect()
+
+            await cls.async_callback(on_connect, moss)
+
+            # Set options
+            await moss.set_directory(is_directory)
+            await moss.set_experimental(experimental)
+            await moss.set_max_matches(max_until_ignored)
+            await moss.set_max_displayed_matches(max_displayed_matches)
+            await moss.set_language(language)
+
+            cls._check_language_response(await moss.read(), language)
+
+            await cls.async_callback(on_upload_start)
+
+            # Upload base files
+            for base_file in base_files:
+                await moss.upload_base_file(base_file, language, use_basename)
+                await cls.async_callback(on_base_file_upload, base_file)
+
+            # Upload submissions
+            for index, path in enumerate(files, start=1):
+                await moss.upload_file(path, language, index, use_basename)
+                await cls.async_callback(on_file_upload, path)
+
+            await cls.async_callback(on_upload_finish)
+
+            # Read and return data
+            await cls.async_callback(on_processing_start)
+            url = await moss.process(comment)
+            await cls.async_callback(on_processing_finish)
+
+        except ConnectionError as e:
+            raise MossConnectionError(e.strerror)
+
+        finally:  # Close session as soon as possible
+            await moss.close()
+
+        return url
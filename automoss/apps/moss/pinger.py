@@ -2,9 +2,11 @@
 
 from enum import IntEnum
 import time
+import json
 from ...redis import REDIS_INSTANCE
 from .moss import HTTP_MOSS_URL
 import requests
+import redis
 
 
 class LoadStatus(IntEnum):
@@ -16,9 +18,17 @@ class LoadStatus(IntEnum):
 
 # Pinging - to determine whether MOSS is under load
 PING_EVERY = 30  # Ping every x seconds
+MIN_PING_EVERY = 5  # Ping at most every x seconds (e.g., when jobs report errors)
+PING_TIMEOUT = 30  # Seconds, after which MOSS is considered down
 PING_OFFSET_THRESHOLD = 0.3
 AVERAGE_PING_KEY = 'AVERAGE_PING'
 LATEST_PING_KEY = 'LATEST_PING'
+LOAD_KEY = 'MOSS_LOAD'  # Snapshot of the load (see get_load), updated by each ping
+LOAD_TIME_KEY = 'MOSS_LOAD_TIME'  # Time at which the snapshot was taken
+
+# Waiting for the load to be refreshed (see wait_for_load)
+LOAD_WAIT_TIME = MIN_PING_EVERY + PING_TIMEOUT  # Seconds, for the monitor to read an error and ping
+LOAD_POLL_INTERVAL = 0.5  # Seconds, between checks for a new snapshot
 
 # Used for exponential moving average
 UP_ALPHA = 0.0001
@@ -92,14 +102,51 @@ class Pinger:
 
         return status, current_ping, average_ping
 
+    @staticmethod
+    def save_load():
+        """Store a snapshot of the current load of MOSS"""
+        status, current_ping, average_ping = Pinger.determine_load()
+        pipeline = REDIS_INSTANCE.pipeline()
+        pipeline.set(LOAD_KEY, json.dumps({
+            'status': status,
+            'current_ping': current_ping,
+            'average_ping': average_ping
+        }))
+        pipeline.set(LOAD_TIME_KEY, time.time())
+        pipeline.execute()
+
+    @staticmethod
+    def get_load():
+        """Get the most recent snapshot of the load of MOSS (with a single read)"""
+        load = REDIS_INSTANCE.get(LOAD_KEY)
+        if load is None:  # Not pinged yet
+            Pinger.save_load()
+            load = REDIS_INSTANCE.get(LOAD_KEY)
+        return json.loads(load)
+
+    @staticmethod
+    def wait_for_load(since, timeout=None):
+        """Wait (up to timeout seconds, or LOAD_WAIT_TIME) for a snapshot of the load
+        taken after since (e.g., by the monitor, once a job reports an error), and get
+        the most recent snapshot"""
+        deadline = time.monotonic() + (LOAD_WAIT_TIME if timeout is None else timeout)
+        while True:
+            try:
+                taken = float(REDIS_INSTANCE.get(LOAD_TIME_KEY))
+            except (TypeError, ValueError):
+                taken = None
+
+            if (taken is not None and taken > since) or time.monotonic() >= deadline:
+                return Pinger.get_load()
+            time.sleep(LOAD_POLL_INTERVAL)
+
     @staticmethod
     def ping():
         """Pings moss, and updates current known ping"""
         new_ping = None
         try:
-            timeout = 30  # TODO global
             new_ping = requests.head(
-                HTTP_MOSS_URL, verify=False, allow_redirects=False, timeout=timeout).elapsed.total_seconds()
+                HTTP_MOSS_URL, verify=False, allow_redirects=False, timeout=PING_TIMEOUT).elapsed.total_seconds()
 
             latest_average = Pinger.get_latest_ping()
 
@@ -126,6 +173,8 @@ class Pinger:
             # Set latest ping to "None" (i.e., moss is down)
             Pinger.set_latest_ping(None)
 
+        Pinger.save_load()
+
         with open('ping.log', 'a') as fp:
             print(time.time(), new_ping, Pinger.get_latest_ping(),
                   Pinger.get_average_ping(), file=fp)
@@ -133,7 +182,23 @@ class Pinger:
 
 
 def monitor():
-    """Monitor the status of MOSS"""
+    """Monitor the status of MOSS.
+
+    MOSS is pinged every PING_EVERY seconds, or sooner if a job reports an
+    error (read from the job event bus), so its load is known when retrying.
+    """
+    from ..jobs.events import JobEventReader, ERROR_EVENT  # Avoid circular import
+
+    reader = None
     while True:
         Pinger.ping()
-        time.sleep(PING_EVERY)
+        time.sleep(MIN_PING_EVERY)
+
+        timeout = PING_EVERY - MIN_PING_EVERY
+        try:
+            if reader is None:
+                reader = JobEventReader()
+            reader.wait(lambda event: event['kind'] == ERROR_EVENT, timeout)
+        except redis.RedisError:
+            reader = None  # e.g., Redis has not started yet
+            time.sleep(timeout)
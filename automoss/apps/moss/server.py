@@ -0,0 +1,375 @@
+"""Local stand-in for the MOSS server.
+
+Speaks the same line protocol as moss.stanford.edu (port 7690) and serves a
+matching HTTP report tree (index.html, match{i}-top.html), so that the MOSS
+client, the test suite and throughput measurements of the whole job pipeline
+can be run offline and reproducibly.
+
+Usage (standalone):
+    python -m automoss.apps.moss.server --latency 5 --empty-response-rate 0.1
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingTCPServer, StreamRequestHandler
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from difflib import SequenceMatcher
+from itertools import combinations, count
+import argparse
+import threading
+import random
+import time
+
+from .moss import (
+    SUPPORTED_MOSS_LANGUAGES,
+    ERROR_PREFIX,
+    NoFiles
+)
+from ...settings import (
+    MOSS_URL,
+    MOSS_PORT,
+    HTTP_MOSS_URL
+)
+
+MIN_MATCH_LINES = 2  # Minimum number of consecutive lines for a match
+MAX_STORED_REPORTS = 1000  # Oldest reports are discarded after this
+
+MALFORMED_PAGE = '<HTML><BODY>Malformed page</BODY></HTML>'
+
+
+class LocalMatch:
+    """Match between two files, as found by the local server"""
+
+    def __init__(self, name_1, name_2, blocks, num_lines_1, num_lines_2):
+        self.name_1 = name_1
+        self.name_2 = name_2
+        self.blocks = blocks  # List of ((from_1, to_1), (from_2, to_2))
+
+        lines_1 = sum(b[0][1] - b[0][0] + 1 for b in blocks)
+        lines_2 = sum(b[1][1] - b[1][0] + 1 for b in blocks)
+        self.percentage_1 = lines_1 * 100 // max(num_lines_1, 1)
+        self.percentage_2 = lines_2 * 100 // max(num_lines_2, 1)
+        self.lines_matched = max(lines_1, lines_2)
+
+
+def find_matches(files, base_files, max_matches, max_displayed_matches):
+    """Compare every pair of files line-by-line.
+
+    Blank lines, lines found in base files and lines which appear in more than
+    `max_matches` files are ignored (as MOSS would do with the equivalent options).
+    """
+
+    base_lines = {line.strip() for _, data in base_files
+                  for line in data.decode(errors='replace').splitlines()}
+
+    documents = []
+    for name, data in files:
+        lines = [x.strip() for x in data.decode(errors='replace').splitlines()]
+        documents.append((name, lines))
+
+    frequency = {}
+    for _, lines in documents:
+        for line in set(lines):
+            frequency[line] = frequency.get(line, 0) + 1
+
+    def tokens(index, lines):
+        # Ignored lines are replaced with unique tokens, so they never match
+        return [line if line and line not in base_lines and frequency[line] <= max_matches
+                else (index, i) for i, line in enumerate(lines)]
+
+    tokenised = [tokens(i, lines) for i, (_, lines) in enumerate(documents)]
+
+    matches = []
+    for i, j in combinations(range(len(documents)), 2):
+        matcher = SequenceMatcher(None, tokenised[i], tokenised[j], autojunk=False)
+        blocks = [((a + 1, a + size), (b + 1, b + size))
+                  for a, b, size in matcher.get_matching_blocks()
+                  if size >= MIN_MATCH_LINES]
+        if blocks:
+            matches.append(LocalMatch(
+                documents[i][0], documents[j][0], blocks,
+                len(documents[i][1]), len(documents[j][1])))
+
+    matches.sort(key=lambda x: x.lines_matched, reverse=True)
+    return matches[:max_displayed_matches]
+
+
+def render_index(url, matches):
+    """Render the index page of a report, in the same layout as MOSS"""
+    rows = ''.join(
+        f'<TR><TD><A HREF="{url}/match{i}.html">{m.name_1} ({m.percentage_1}%)</A>\n'
+        f'    <TD><A HREF="{url}/match{i}.html">{m.name_2} ({m.percentage_2}%)</A>\n'
+        f'<TD ALIGN=right>{m.lines_matched}\n'
+        for i, m in enumerate(matches)
+    )
+    return (
+        '<HTML>\n<HEAD>\n<TITLE>Moss Results</TITLE>\n</HEAD>\n<BODY>\n'
+        'Moss Results<p>\n<HR>\n<TABLE>\n'
+        '<TR><TH>File 1<TH>File 2<TH>Lines Matched\n'
+        f'{rows}'
+        '</TABLE>\n<HR>\n</BODY>\n</HTML>\n'
+    )
+
+
+def render_match(index, match):
+    """Render the top frame of a match page, in the same layout as MOSS"""
+    rows = ''.join(
+        f'<TR><TD><A HREF="match{index}-0.html#{n}" NAME="{n}" TARGET="0">{a[0]}-{a[1]}</A>\n'
+        f'<TD><A HREF="match{index}-0.html#{n}" NAME="{n}" TARGET="0"><IMG SRC="../../../bitmaps/tm_0_{match.percentage_1}.gif" ALT="other" BORDER="0" ALIGN=left VSPACE="0"></A>\n'
+        f'<TD><A HREF="match{index}-1.html#{n}" NAME="{n}" TARGET="1">{b[0]}-{b[1]}</A>\n'
+        f'<TD><A HREF="match{index}-1.html#{n}" NAME="{n}" TARGET="1"><IMG SRC="../../../bitmaps/tm_1_{match.percentage_2}.gif" ALT="other" BORDER="0" ALIGN=left VSPACE="0"></A>\n'
+        for n, (a, b) in enumerate(match.blocks)
+    )
+    return (
+        '<HTML>\n<HEAD>\n<TITLE>Top</TITLE>\n</HEAD>\n<BODY BGCOLOR=white>\n<HR>\n<CENTER>\n'
+        '<TABLE BORDER="1" CELLSPACING="0" BGCOLOR="#d0d0d0">\n'
+        f'<TR><TH><A HREF="match{index}.html" TARGET="_top">{match.name_1} ({match.percentage_1}%)</A>\n'
+        f'<TH><IMG SRC="../../../bitmaps/tm_0_{match.percentage_1}.gif" ALT="Other" BORDER="0" ALIGN=left>\n'
+        f'<TH><A HREF="match{index}.html" TARGET="_top">{match.name_2} ({match.percentage_2}%)</A>\n'
+        f'<TH><IMG SRC="../../../bitmaps/tm_1_{match.percentage_2}.gif" ALT="Other" BORDER="0" ALIGN=left>\n'
+        '<TH>\n'
+        f'{rows}'
+        '</TABLE>\n</CENTER>\n</BODY>\n</HTML>\n'
+    )
+
+
+class MossProtocolHandler(StreamRequestHandler):
+    """Handles a single MOSS session (one job)"""
+
+    def handle(self):
+        server = self.server.moss
+        options = {'maxmatches': 10, 'show': 250}
+        files = []
+        base_files = []
+        user_id = None
+
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return  # Client disconnected
+
+            command, *args = line.decode().rstrip('\n').split(' ', 4)
+
+            if command == 'moss':
+                user_id = args[0] if args else ''
+                if not user_id.isdigit():
+                    return  # Unknown user, MOSS closes the connection
+
+            elif command in ('directory', 'X', 'maxmatches', 'show'):
+                options[command] = int(args[0])
+
+            elif command == 'language':
+                language = args[0] if args else ''
+                self._send('yes' if language in SUPPORTED_MOSS_LANGUAGES else 'no')
+
+            elif command == 'file':
+                file_id, _, size, name = args
+                data = self.rfile.read(int(size))
+                (base_files if file_id == '0' else files).append((name, data))
+
+            elif command == 'query':
+                server.simulate_processing()
+
+                if server.should_send_empty_response():
+                    return  # Empty response (i.e., MOSS timed out)
+
+                if not files:
+                    self._send(f'{ERROR_PREFIX}{NoFiles.message}')
+                    continue
+
+                matches = find_matches(
+                    files, base_files, options['maxmatches'], options['show'])
+                self._send(server.add_report(user_id, matches))
+
+            elif command == 'end':
+                return
+
+    def _send(self, text):
+        self.wfile.write(f'{text}\n'.encode())
+
+
+class ReportRequestHandler(BaseHTTPRequestHandler):
+    """Serves the HTML report tree of generated reports"""
+
+    def do_HEAD(self):
+        self._respond(include_body=False)
+
+    def do_GET(self):
+        self._respond()
+
+    def _respond(self, include_body=True):
+        server = self.server.moss
+        server.simulate_load()
+
+        path = urlparse(self.path).path
+        if path.endswith('/'):
+            path += 'index.html'
+
+        if path == '/index.html':
+            page = '<HTML><BODY>Moss</BODY></HTML>'
+        else:
+            page = server.get_page(path)
+
+        if page is None:
+            self.send_error(404)
+            return
+
+        body = page.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if include_body:
+            self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Do not log every request
+
+
+class LocalMossServer:
+    """Local stand-in for the MOSS server.
+
+    :param latency: Seconds taken to process each job, defaults to 0
+    :type latency: float, optional
+    :param http_latency: Seconds added to each HTTP request (simulates load), defaults to 0
+    :type http_latency: float, optional
+    :param empty_response_rate: Fraction of jobs which return no response, defaults to 0
+    :type empty_response_rate: float, optional
+    :param malformed_page_rate: Fraction of match pages which are malformed, defaults to 0
+    :type malformed_page_rate: float, optional
+    :param seed: Seed used for simulated failures, defaults to None
+    :type seed: int, optional
+    """
+
+    def __init__(self, host=MOSS_URL, port=MOSS_PORT, http_url=HTTP_MOSS_URL,
+                 latency=0, http_latency=0, empty_response_rate=0,
+                 malformed_page_rate=0, seed=None):
+
+        self.host = host
+        self.port = port
+        self.http_url = http_url.rstrip('/')
+
+        self.latency = latency
+        self.http_latency = http_latency
+        self.empty_response_rate = empty_response_rate
+        self.malformed_page_rate = malformed_page_rate
+
+        self._random = random.Random(seed)
+        self._report_ids = count(1)
+        self._reports = OrderedDict()
+        self._lock = threading.Lock()
+        self._servers = []
+
+    def simulate_processing(self):
+        """Wait for the time MOSS takes to process a job"""
+        if self.latency:
+            time.sleep(self.latency)
+
+    def simulate_load(self):
+        """Wait for the time MOSS takes to serve a page"""
+        if self.http_latency:
+            time.sleep(self.http_latency)
+
+    def should_send_empty_response(self):
+        """Determine whether the current job should return no response"""
+        with self._lock:
+            return self._random.random() < self.empty_response_rate
+
+    def add_report(self, user_id, matches):
+        """Store a report and return its URL"""
+        with self._lock:
+            path = f'/results/{user_id}/{next(self._report_ids)}'
+            self._reports[path] = matches
+            while len(self._reports) > MAX_STORED_REPORTS:
+                self._reports.popitem(last=False)
+
+        return f'{self.http_url}{path}'
+
+    def get_page(self, path):
+        """Get the HTML of a page of a report (None if it does not exist)"""
+        report_path, _, page = path.rpartition('/')
+
+        with self._lock:
+            matches = self._reports.get(report_path)
+            malformed = self._random.random() < self.malformed_page_rate
+
+        if matches is None:
+            return None
+
+        if page == 'index.html':
+            return render_index(f'{self.http_url}{report_path}', matches)
+
+        if page.startswith('match') and page.endswith('-top.html'):
+            try:
+                index = int(page[len('match'):-len('-top.html')])
+                match = matches[index]
+            except (ValueError, IndexError):
+                return None
+
+            return MALFORMED_PAGE if malformed else render_match(index, match)
+
+        return None
+
+    @contextmanager
+    def configure(self, **options):
+        """Temporarily change the behaviour of the server"""
+        previous = {k: getattr(self, k) for k in options}
+        for k, v in options.items():
+            setattr(self, k, v)
+        try:
+            yield self
+        finally:
+            for k, v in previous.items():
+                setattr(self, k, v)
+
+    def start(self):
+        """Start serving (in background threads)"""
+        ThreadingTCPServer.allow_reuse_address = True
+        ThreadingHTTPServer.allow_reuse_address = True
+
+        http_address = urlparse(self.http_url)
+        self._servers = [
+            ThreadingTCPServer((self.host, self.port), MossProtocolHandler),
+            ThreadingHTTPServer(
+                (http_address.hostname, http_address.port or 80), ReportRequestHandler)
+        ]
+
+        for server in self._servers:
+            server.daemon_threads = True
+            server.moss = self
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        return self
+
+    def stop(self):
+        """Stop serving"""
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+
+LOCAL_MOSS_SERVER = LocalMossServer()
+
+
+def main():
+    """Run the local MOSS server until interrupted"""
+    parser = argparse.ArgumentParser(description='Local stand-in for the MOSS server')
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--http-latency', type=float, default=0)
+    parser.add_argument('--empty-response-rate', type=float, default=0)
+    parser.add_argument('--malformed-page-rate', type=float, default=0)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    server = LocalMossServer(**vars(args)).start()
+    print(f'Serving MOSS on {MOSS_URL}:{MOSS_PORT} and {HTTP_MOSS_URL}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,44 @@
 from ..users.tests import AuthenticatedUserTest
 from django.urls import reverse
 from .pinger import Pinger
+from .server import LOCAL_MOSS_SERVER
 from unittest import TestCase
+import tempfile
+import asyncio
+import time
 import os
 from .moss import (
     MOSS,
     is_valid_moss_url,
     InvalidReportURL,
-    ReportParsingError
+    ReportParsingError,
+    EmptyResponse,
+    UnsupportedLanguage,
+    UnparseableMatch,
+    MossMatch,
+    ReportDownloader,
+    ReportCache,
+    REPORT_DOWNLOADER,
+    Result,
+    get_match_url
 )
-from ...settings import DEFAULT_MOSS_SETTINGS, TESTS_ROOT
+from ...settings import DEFAULT_MOSS_SETTINGS, TESTS_ROOT, HTTP_MOSS_URL
+
+
+def get_test_paths():
+    """Get paths of the test files and base files"""
+    base_dir = os.path.join(TESTS_ROOT, 'test_files')
+
+    paths = {
+        'files': [],
+        'base_files': []
+    }
+    for file_type in paths:
+        path = os.path.join(base_dir, file_type)
+        if os.path.isdir(path):
+            paths[file_type] = [os.path.join(path, k)
+                                for k in os.listdir(path)]
+    return paths
 
 
 class TestMossAPI(TestCase):
@@ -18,17 +47,7 @@ class TestMossAPI(TestCase):
     def test_upload_and_parse(self):
         """Upload a job to MOSS and parse the result"""
 
-        base_dir = os.path.join(TESTS_ROOT, 'test_files')
-
-        paths = {
-            'files': [],
-            'base_files': []
-        }
-        for file_type in paths:
-            path = os.path.join(base_dir, file_type)
-            if os.path.isdir(path):
-                paths[file_type] = [os.path.join(path, k)
-                                    for k in os.listdir(path)]
+        paths = get_test_paths()
 
         if not paths['files']:
             return
@@ -53,8 +72,110 @@ class TestMossAPI(TestCase):
             MOSS.generate_report('invalid_url')
 
         with self.assertRaises(ReportParsingError):
-            MOSS.generate_report(
-                'http://moss.stanford.edu/results/0/1234567890')
+            MOSS.generate_report(f'{HTTP_MOSS_URL}/results/0/1234567890')
+
+
+class TestMossMatch(TestCase):
+    """Class which controls test cases for parsing MOSS match pages"""
+
+    def test_parse(self):
+        """Parse a recorded match page"""
+        with open(os.path.join(TESTS_ROOT, 'test_files', 'reports', 'match0-top.html')) as fp:
+            match = MossMatch(fp.read())
+
+        self.assertEqual((match.name_1, match.percentage_1), ('LCHDAN004.py', '66'))
+        self.assertEqual((match.name_2, match.percentage_2), ('CMBCAR007.py', '42'))
+        self.assertEqual(match.line_matches, [
+            {'first': {'from': 4, 'to': 19}, 'second': {'from': 10, 'to': 27}},
+            {'first': {'from': 22, 'to': 30}, 'second': {'from': 33, 'to': 41}}
+        ])
+        self.assertEqual(match.lines_matched, 27)
+
+    def test_unparseable(self):
+        """Incorrectly formatted match pages cannot be parsed"""
+        for html in ('', '<HTML><BODY>Malformed page</BODY></HTML>', '<TABLE><TR><TH>a</TABLE>'):
+            with self.assertRaises(UnparseableMatch):
+                MossMatch(html)
+
+
+class TestLocalMossServer(TestCase):
+    """Class which controls test cases for the local MOSS server"""
+
+    def _generate(self, language='python', **kwargs):
+        return MOSS.generate(
+            user_id=1,
+            language=language,
+            **get_test_paths(),
+            use_basename=True,
+            **kwargs
+        )
+
+    def test_matches(self):
+        """Matches are reported between similar files"""
+        result = self._generate()
+        self.assertTrue(result.matches)
+
+        for match in result.matches:
+            self.assertGreater(match.lines_matched, 0)
+            self.assertTrue(match.line_matches)
+
+    def test_max_displayed_matches(self):
+        """Number of matches is limited by max_displayed_matches"""
+        result = self._generate(max_displayed_matches=1)
+        self.assertEqual(len(result.matches), 1)
+
+    def test_unsupported_language(self):
+        """Server rejects unsupported languages"""
+        with self.assertRaises(UnsupportedLanguage):
+            self._generate(language='invalid')
+
+    def test_empty_response(self):
+        """Server simulates MOSS timing out"""
+        with LOCAL_MOSS_SERVER.configure(empty_response_rate=1):
+            with self.assertRaises(EmptyResponse):
+                self._generate()
+
+    def test_malformed_pages(self):
+        """Malformed match pages are skipped"""
+        with LOCAL_MOSS_SERVER.configure(malformed_page_rate=1):
+            result = self._generate()
+        self.assertEqual(result.matches, [])
+
+    def test_large_files(self):
+        """Large files are streamed to the server in full"""
+        lines = ''.join(f'print({i})\n' for i in range(20000))  # Above MAX_COALESCED_FILE_SIZE
+
+        with tempfile.TemporaryDirectory() as directory:
+            files = []
+            for name in ('first.py', 'second.py'):
+                path = os.path.join(directory, name)
+                with open(path, 'w') as fp:
+                    fp.write(lines)
+                files.append(path)
+
+            result = MOSS.generate(user_id=1, language='python', files=files)
+
+        self.assertEqual(len(result.matches), 1)
+        self.assertEqual(result.matches[0].percentage_1, '100')
+        self.assertEqual(result.matches[0].lines_matched, 20000)
+
+    def test_summary(self):
+        """Summaries from the index page agree with the match pages"""
+        url = MOSS.generate_url(user_id=1, language='python', **get_test_paths())
+
+        def key(x):
+            return x.index, x.name_1, x.percentage_1, x.name_2, x.percentage_2
+
+        summaries = Result(url, summary_only=True).matches
+        self.assertTrue(summaries)
+        self.assertTrue(all(x.line_matches is None for x in summaries))
+        self.assertEqual([key(x) for x in summaries],
+                         [key(x) for x in Result(url).matches])
+
+    def test_validate_moss_id(self):
+        """Validate MOSS IDs using the server"""
+        self.assertTrue(MOSS.validate_moss_id(1))
+        self.assertFalse(MOSS.validate_moss_id('invalid'))
 
 
 class TestJobs(AuthenticatedUserTest):
@@ -68,3 +189,173 @@ class TestJobs(AuthenticatedUserTest):
         Pinger.ping()
         response = self.client.get(reverse("api:moss:get_status"))
         self.assertEqual(response.status_code, 200)
+
+
+class TestReportDownloader(TestCase):
+    """Class which controls test cases for downloading MOSS reports"""
+
+    def test_concurrency_limit(self):
+        """No more than max_concurrent_requests requests are in flight at once"""
+        url = MOSS.generate_url(user_id=1, language='python', **get_test_paths())
+        downloader = ReportDownloader(max_concurrent_requests=2)
+        self.addCleanup(downloader.close)
+
+        num_requests = 8
+        latency = 0.1
+        with LOCAL_MOSS_SERVER.configure(http_latency=latency):
+            start = time.time()
+            pages = downloader.fetch_all([f'{url}/'] * num_requests)
+            duration = time.time() - start
+
+        self.assertEqual(len(pages), num_requests)
+        self.assertGreaterEqual(duration, num_requests / 2 * latency)
+        self.assertEqual(downloader.stats()['requests'], num_requests)
+
+    def test_not_found(self):
+        """Missing pages are not retried"""
+        downloader = ReportDownloader()
+        self.addCleanup(downloader.close)
+        with self.assertRaises(ReportParsingError):
+            downloader.fetch(f'{HTTP_MOSS_URL}/results/0/1234567890/')
+
+        self.assertEqual(downloader.stats()['failed'], 1)
+        self.assertEqual(downloader.stats()['retries'], 0)
+
+    def test_cache(self):
+        """Cached pages of a report are not downloaded again"""
+        url = MOSS.generate_url(user_id=1, language='python', **get_test_paths())
+        downloader = ReportDownloader()
+        self.addCleanup(downloader.close)
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ReportCache(directory)
+            first = Result(url, downloader=downloader, cache=cache)
+            num_requests = downloader.stats()['requests']
+            self.assertEqual(len(cache), num_requests)
+
+            second = Result(url, downloader=downloader, cache=cache)
+            self.assertEqual(downloader.stats()['requests'], num_requests)
+            self.assertEqual([str(m) for m in first.matches],
+                             [str(m) for m in second.matches])
+
+    def test_stream(self):
+        """Streamed matches are the same as when parsing the whole report at once"""
+        url = MOSS.generate_url(user_id=1, language='python', **get_test_paths())
+        downloader = ReportDownloader()
+        self.addCleanup(downloader.close)
+
+        result = Result(url, downloader=downloader)
+        streamed = Result(url, downloader=downloader, stream=True)
+
+        self.assertEqual(streamed.num_matches, len(result.matches))
+        self.assertEqual([str(m) for m in streamed.matches],
+                         [str(m) for m in result.matches])
+
+    def test_download_report(self):
+        """Reports can be generated from their downloaded pages alone"""
+        url = MOSS.generate_url(user_id=1, language='python', **get_test_paths())
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ReportCache(directory)
+            num_matches = MOSS.download_report(url, cache)
+            self.assertEqual(len(cache), num_matches + 1)  # Including index
+
+            num_requests = REPORT_DOWNLOADER.stats()['requests']
+            result = MOSS.generate_report(url, cache=cache)
+            self.assertEqual(REPORT_DOWNLOADER.stats()['requests'], num_requests)
+            self.assertEqual(len(result.matches), num_matches)
+
+    def test_iter_fetch(self):
+        """Pages are yielded in order, regardless of the window size"""
+        url = MOSS.generate_url(user_id=1, language='python', **get_test_paths())
+        downloader = ReportDownloader()
+        self.addCleanup(downloader.close)
+        urls = [get_match_url(url, i) for i in range(3)] * 3
+
+        expected = downloader.fetch_all(urls)
+        for window in (1, 2, 100):
+            self.assertEqual(list(downloader.iter_fetch(urls, window=window)), expected)
+
+
+class TestReportCache(TestCase):
+    """Class which controls test cases for caching MOSS report pages"""
+
+    def test_get_set(self):
+        with tempfile.TemporaryDirectory() as directory:
+            cache = ReportCache(os.path.join(directory, 'reports'))
+            self.assertIsNone(cache.get('http://localhost/a'))
+
+            cache.set('http://localhost/a', '<HTML>a</HTML>')
+            self.assertIn('http://localhost/a', cache)
+            self.assertEqual(cache.get('http://localhost/a'), '<HTML>a</HTML>')
+            self.assertIsNone(cache.get('http://localhost/b'))
+
+    def test_eviction(self):
+        """Least recently used pages are removed once the cache is too large"""
+        with tempfile.TemporaryDirectory() as directory:
+            page = os.urandom(1000).hex()  # Incompressible
+            cache = ReportCache(directory, max_size=3500)
+
+            for i in range(3):
+                cache.set(f'http://localhost/{i}', page)
+                time.sleep(0.01)  # Distinct modification times
+            cache.get('http://localhost/0')  # Most recently used
+            cache.set('http://localhost/3', page)
+
+            self.assertEqual(len(cache), 3)
+            self.assertNotIn('http://localhost/1', cache)
+            for i in (0, 2, 3):
+                self.assertIn(f'http://localhost/{i}', cache)
+
+
+class TestAsyncMossClient(TestCase):
+    """Class which controls test cases for the asyncio MOSS client"""
+
+    def _generate_url(self, language='python', **kwargs):
+        return MOSS.generate_url_async(
+            user_id=1,
+            language=language,
+            **get_test_paths(),
+            use_basename=True,
+            **kwargs
+        )
+
+    def test_generate_url(self):
+        """Upload a job to MOSS using the asyncio client"""
+        events = []
+
+        async def on_upload_start():  # Coroutine callbacks are awaited
+            events.append('upload')
+
+        url = asyncio.run(self._generate_url(
+            on_upload_start=on_upload_start,
+            on_processing_finish=lambda: events.append('processed')
+        ))
+
+        self.assertTrue(is_valid_moss_url(url))
+        self.assertEqual(events, ['upload', 'processed'])
+
+    def test_errors(self):
+        """Same exceptions are raised as with the blocking client"""
+        with LOCAL_MOSS_SERVER.configure(empty_response_rate=1):
+            with self.assertRaises(EmptyResponse):
+                asyncio.run(self._generate_url())
+
+        with self.assertRaises(UnsupportedLanguage):
+            asyncio.run(self._generate_url(language='invalid'))
+
+    def test_concurrent_sessions(self):
+        """Sessions waiting on MOSS do not block each other"""
+        num_sessions = 10
+        latency = 0.5
+
+        async def generate_all():
+            return await asyncio.gather(*(self._generate_url() for _ in range(num_sessions)))
+
+        with LOCAL_MOSS_SERVER.configure(latency=latency):
+            start = time.time()
+            urls = asyncio.run(generate_all())
+            duration = time.time() - start
+
+        self.assertEqual(len(set(urls)), num_sessions)
+        self.assertLess(duration, num_sessions * latency / 2)
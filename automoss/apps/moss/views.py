@@ -1,10 +1,10 @@
 
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
-from django.http.response import JsonResponse
 from django.views import View
 
 from .pinger import Pinger
+from ..utils.http import conditional_json_response
 
 
 @method_decorator(login_required, name='dispatch')
@@ -12,11 +12,5 @@ class MossStatus(View):
     """ JSON view of Jobs """
 
     def get(self, request):
-        """ Get user's jobs """
-        status, current_ping, average_ping = Pinger.determine_load()
-        data = {
-            'status': status,
-            'current_ping': current_ping,
-            'average_ping': average_ping
-        }
-        return JsonResponse(data, status=200)
+        """ Get the load of MOSS (from the most recent ping) """
+        return conditional_json_response(request, Pinger.get_load())
@@ -4,3 +4,11 @@ from django.apps import AppConfig
 class ResultsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'automoss.apps.results'
+
+    def ready(self):
+        from django.db.models.signals import pre_delete
+        from ..jobs.models import Job
+        from .blocks import forget_match_blocks
+
+        # Cached block structures of matches are removed with their job (see blocks.py)
+        pre_delete.connect(forget_match_blocks, sender=Job)
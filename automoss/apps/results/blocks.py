@@ -0,0 +1,101 @@
+from django.core.cache import cache
+from .models import Match
+
+# Block structure of each match (which lines of each submission are shown in
+# each block), cached as a match does not change once its details are stored
+MATCH_BLOCKS_KEY_TEMPLATE = 'MATCH_BLOCKS:{match_id}'
+MATCH_BLOCKS_CACHE_TIME = 7 * 24 * 60 * 60  # Seconds
+
+SUBMISSION_KEYS = ('first', 'second')
+
+
+def _get_key(match_id):
+    return MATCH_BLOCKS_KEY_TEMPLATE.format(match_id=match_id)
+
+
+def get_block_structure(line_matches):
+    """Split each submission into blocks of lines, alternating between unmatched
+    lines and the lines of each similar section (in order of position)
+
+    :return: The numbers of the sections (ordered by position in the first
+        submission), and the blocks of each submission, as (section number or
+        None, first line, last line or None for the end of the file)
+    :rtype: dict
+    """
+
+    # Add IDs to matches to ensure matching
+    match_info = list(enumerate(line_matches, start=1))
+
+    structure = {'match_numbers': None, 'blocks': {}}
+    for key in SUBMISSION_KEYS:
+        sorted_info = sorted(match_info, key=lambda item: item[-1][key]['from'])
+        if structure['match_numbers'] is None:
+            structure['match_numbers'] = [x[0] for x in sorted_info]
+
+        blocks = []
+        current = 0
+        for match_id, match_lines in sorted_info:
+            blocks.append((None, current + 1, match_lines[key]['from'] - 1))
+            current = match_lines[key]['to']
+            blocks.append((match_id, match_lines[key]['from'], current))
+
+        # Rest of file
+        blocks.append((None, current + 1, None))
+        structure['blocks'][key] = blocks
+
+    return structure
+
+
+def get_match_blocks(match):
+    """Get the block structure of a match (cached once its details are known)"""
+
+    key = _get_key(match.match_id)
+    structure = cache.get(key)
+    if structure is None:
+        structure = get_block_structure(match.line_matches or [])
+        if match.line_matches is not None:
+            cache.set(key, structure, MATCH_BLOCKS_CACHE_TIME)
+    return structure
+
+
+def forget_match_blocks(sender, instance, **kwargs):
+    """Remove the block structures of a job's matches, before it is deleted (pre_delete receiver)"""
+    match_ids = Match.objects.filter(
+        moss_result__job=instance).values_list('match_id', flat=True)
+    keys = [_get_key(match_id) for match_id in match_ids]
+    if keys:
+        cache.delete_many(keys)
+
+
+def window_blocks(blocks, num_lines, context):
+    """Collapse the unmatched lines of a submission's blocks, except for the
+    (context) lines before and after each similar section
+
+    :return: Blocks, as (section number or None, first line, last line, whether collapsed)
+    :rtype: list
+    """
+
+    windowed = []
+    for i, (block_id, first_line, last_line) in enumerate(blocks):
+        if last_line is None:
+            last_line = num_lines
+
+        if block_id is not None:
+            windowed.append((block_id, first_line, last_line, False))
+            continue
+
+        # Lines shown after the previous section, and before the next one
+        head_end = first_line - 1 if i == 0 else min(last_line, first_line + context - 1)
+        tail_start = last_line + 1 if i == len(blocks) - 1 else max(first_line, last_line - context + 1)
+
+        if tail_start - head_end <= 1:
+            windowed.append((None, first_line, last_line, False))
+            continue
+
+        if head_end >= first_line:
+            windowed.append((None, first_line, head_end, False))
+        windowed.append((None, head_end + 1, tail_start - 1, True))
+        if last_line >= tail_start:
+            windowed.append((None, tail_start, last_line, False))
+
+    return windowed
@@ -1,5 +1,7 @@
 from django.utils.timezone import now
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Greatest
 from ...settings import UUID_LENGTH, COMPLETED_STATUS
 import uuid
 from ..jobs.models import Job, Submission
@@ -60,7 +62,19 @@ class Match(models.Model):
 
     # Line match information
     lines_matched = models.IntegerField()
-    line_matches = models.JSONField()
+    # None if not yet fetched from the match's page (see LAZY_MATCH_DETAILS)
+    line_matches = models.JSONField(null=True)
+
+    # Position of the match in the MOSS report
+    index = models.PositiveIntegerField(null=True)
+
+    class Meta:
+        indexes = [
+            # Matches of a result, by lines matched or similarity (see results.views.Index)
+            models.Index(fields=['moss_result', '-lines_matched']),
+            models.Index(F('moss_result'), Greatest('first_percentage', 'second_percentage').desc(),
+                         name='results_match_similarity_idx')
+        ]
 
     def __str__(self):
         """ Match to string method """
@@ -0,0 +1,46 @@
+from ...celery import app
+from celery.utils.log import get_task_logger
+from .models import Match
+from ..moss.moss import (
+    REPORT_DOWNLOADER,
+    MossMatch,
+    ReportError,
+    UnparseableMatch,
+    get_match_url
+)
+logger = get_task_logger(__name__)
+
+
+def fetch_match_details(match):
+    """Fetch and store which lines of a match are similar (if not yet known)
+
+    :return: Whether the match's details are available
+    :rtype: bool
+    """
+    if match.line_matches is not None:
+        return True
+
+    try:
+        html = REPORT_DOWNLOADER.fetch(
+            get_match_url(match.moss_result.url, match.index),
+            match.moss_result.job.get_report_cache())
+        details = MossMatch(html, match.index)
+    except (ReportError, UnparseableMatch) as e:
+        logger.warning(f'Unable to fetch details of match {match.match_id}: {e!r}')
+        return False
+
+    match.line_matches = details.line_matches
+    match.lines_matched = details.lines_matched
+    match.save(update_fields=['line_matches', 'lines_matched'])
+    return True
+
+
+@app.task(name='MatchDetails')
+def fetch_job_match_details(job_id):
+    """Fetch the details of all matches of a job which do not have them yet"""
+
+    matches = Match.objects.filter(
+        moss_result__job__job_id=job_id, line_matches__isnull=True).select_related('moss_result__job__user')
+
+    for match in matches:
+        fetch_match_details(match)
@@ -8,6 +8,9 @@ urlpatterns = [
     # View match of a result
     path('match/<uuid:match_id>/', views.ResultMatch.as_view(), name='match'),
 
+    # Get lines of a match's submission (collapsed in the windowed view)
+    path('match/<uuid:match_id>/lines/', views.MatchLines.as_view(), name='match_lines'),
+
     # Result Index - View MOSS Result
     path('', views.Index.as_view(), name="index")
 ]
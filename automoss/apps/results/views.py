@@ -1,12 +1,25 @@
-from ...settings import SUBMISSION_UPLOAD_TEMPLATE
 from django.shortcuts import render, get_object_or_404
+from django.http.response import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
 from django.views import View
 from .models import Match
+from .tasks import fetch_match_details
+from .blocks import get_match_blocks, window_blocks, SUBMISSION_KEYS
+from ..jobs.lines import SubmissionFile
 from ..jobs.models import Job
-from ...settings import SUPPORTED_LANGUAGES, MATCH_CONTEXT
-import os
+from ...settings import (
+    SUPPORTED_LANGUAGES,
+    MATCH_CONTEXT,
+    MATCHES_PAGE_SIZE,
+    FILES_NAME,
+    MATCH_WINDOW_MIN_LINES,
+    MATCH_WINDOW_CONTEXT_LINES,
+    MAX_MATCH_LINES_REQUEST
+)
+from ..utils.core import first
+from django.core.paginator import Paginator
+from django.db.models.functions import Greatest
 
 
 @method_decorator(login_required, name='dispatch')
@@ -15,15 +28,46 @@ class Index(View):
 
     template = "results/index.html"
 
+    # Orderings of matches (the first is the default)
+    sort_options = {
+        'lines': ('-lines_matched', 'pk'),
+        'similarity': ('-similarity', 'pk')
+    }
+
     def get(self, request, job_id):
-        """ Get result """
+        """ Get a page of the result's matches, sorted by lines matched (or similarity),
+        with at least the given similarity (percentage matched of either submission) """
 
         job = get_object_or_404(
             Job.objects.user_jobs(request.user), job_id=job_id)
 
+        sort = request.GET.get('sort')
+        if sort not in self.sort_options:
+            sort = first(self.sort_options)
+
+        try:
+            min_similarity = int(request.GET.get('min_similarity', 0))
+        except ValueError:
+            min_similarity = 0
+        min_similarity = min(max(min_similarity, 0), 100)
+
+        matches = Match.objects.filter(moss_result__job=job).annotate(
+            similarity=Greatest('first_percentage', 'second_percentage'))
+        if min_similarity > 0:
+            matches = matches.filter(similarity__gte=min_similarity)
+
+        # Submissions are read with their matches, and match details only when viewed
+        matches = matches.select_related('first_submission', 'second_submission').defer(
+            'line_matches').order_by(*self.sort_options[sort])
+
+        page = Paginator(matches, MATCHES_PAGE_SIZE).get_page(request.GET.get('page'))
+
         context = {
             'job': job,
-            'matches': Match.objects.user_matches(request.user).filter(moss_result__job__job_id=job_id).order_by('-lines_matched')
+            'matches': page,
+            'page': page,
+            'sort': sort,
+            'min_similarity': min_similarity
         }
         return render(request, self.template, context)
 
@@ -34,10 +78,13 @@ class ResultMatch(View):
 
     template = "results/match.html"
 
+    # Full files, or only similar sections (with the rest collapsed)
+    views = ('full', 'windowed')
+
     def get(self, request, job_id, match_id):
         """ Get match """
-        match = get_object_or_404(Match.objects.user_matches(
-            request.user), match_id=match_id)
+        match = get_object_or_404(Match.objects.user_matches(request.user).select_related(
+            'first_submission', 'second_submission'), match_id=match_id)
         job = get_object_or_404(
             Job.objects.user_jobs(request.user), job_id=job_id)
 
@@ -46,50 +93,47 @@ class ResultMatch(View):
             'second': match.second_submission
         }
 
-        # Add IDs to matches to ensure matching
-        match_info = {k: v for k, v in enumerate(match.line_matches, start=1)}
+        if match.line_matches is None:
+            # Only the summary of the match is known (see LAZY_MATCH_DETAILS)
+            fetch_match_details(match)
 
-        blocks = {}
+        structure = get_match_blocks(match)
+        match_numbers = structure['match_numbers']
 
-        match_numbers = None
+        sources = {}
         for submission_type, submission in submissions.items():
+            source = SubmissionFile(request.user.user_id, job_id, FILES_NAME, submission.submission_id)
+            if source.exists():
+                sources[submission_type] = source
 
-            file_path = SUBMISSION_UPLOAD_TEMPLATE.format(
-                user_id=request.user.user_id,
-                job_id=job_id,
-                file_type='files',
-                file_id=submission.submission_id
-            )
-
-            if not os.path.exists(file_path):
-                continue
-
-            with open(file_path) as fp:
-                lines = fp.readlines()
-
-            blocks[submission_type] = []
-            current = 0
-
-            sorted_info = sorted(
-                match_info.items(), key=lambda item: item[-1][submission_type]['from'])
-            if match_numbers is None:
-                match_numbers = [x[0] for x in sorted_info]
-
-            for match_id, match_lines in sorted_info:
-                # TODO maybe return list of lines, not joined
-                blocks[submission_type].append({
-                    'text': ''.join(lines[current:match_lines[submission_type]['from'] - 1])
-                })
-                current = match_lines[submission_type]['to']
-                blocks[submission_type].append({
-                    'id': match_id,
-                    'text': ''.join(lines[match_lines[submission_type]['from'] - 1:current])
-                })
-
-            # Get rest of file
-            blocks[submission_type].append({
-                'text': ''.join(lines[current:])
-            })
+        # Matches of large files are windowed by default (see MATCH_WINDOW_MIN_LINES)
+        view = request.GET.get('view')
+        if view not in self.views:
+            num_lines = max((source.get_index().num_lines for source in sources.values()), default=0)
+            view = 'windowed' if num_lines >= MATCH_WINDOW_MIN_LINES else 'full'
+
+        # Cut the text of each block from the submission's file (by its line index)
+        blocks = {}
+        for submission_type, source in sources.items():
+            with source:
+                submission_blocks = structure['blocks'][submission_type]
+                if view == 'windowed':
+                    submission_blocks = window_blocks(
+                        submission_blocks, source.get_index().num_lines, MATCH_WINDOW_CONTEXT_LINES)
+                else:
+                    submission_blocks = [(*block, False) for block in submission_blocks]
+
+                blocks[submission_type] = []
+                for block_id, first_line, last_line, collapsed in submission_blocks:
+                    if collapsed:
+                        # Loaded when expanded (see MatchLines)
+                        block = {'collapsed': True, 'from': first_line, 'to': last_line,
+                                 'num_lines': last_line - first_line + 1}
+                    else:
+                        block = {'text': source.read_lines(first_line, last_line)}
+                        if block_id is not None:
+                            block['id'] = block_id
+                    blocks[submission_type].append(block)
 
         # Get highlighter name
         job_language = SUPPORTED_LANGUAGES[job.language][3]
@@ -99,8 +143,61 @@ class ResultMatch(View):
             'submissions': submissions,
             'match_numbers': match_numbers,
             'blocks': blocks,
+            'view': view,
             'language': job_language,
             'job': job,
             **MATCH_CONTEXT
         }
         return render(request, self.template, context)
+
+
+@method_decorator(login_required, name='dispatch')
+class MatchLines(View):
+    """ Lines of a match's submission (e.g., collapsed in the windowed match view) """
+
+    def get(self, request, job_id, match_id):
+        """ Get lines `from` to `to` (inclusive) of the `first` or `second` submission """
+        try:
+            match = Match.objects.user_matches(request.user).select_related(
+                'first_submission', 'second_submission').get(
+                match_id=match_id, moss_result__job__job_id=job_id)
+        except Match.DoesNotExist:
+            data = {
+                'message': f'Match does not exist ({match_id})'
+            }
+            return JsonResponse(data, status=404)
+
+        submission_type = request.GET.get('submission')
+        if submission_type not in SUBMISSION_KEYS:
+            data = {
+                'message': 'Invalid parameter: Submission'
+            }
+            return JsonResponse(data, status=400)
+
+        try:
+            first_line = int(request.GET.get('from'))
+            last_line = int(request.GET.get('to'))
+        except (TypeError, ValueError):
+            first_line = last_line = 0
+        if not 1 <= first_line <= last_line < first_line + MAX_MATCH_LINES_REQUEST:
+            data = {
+                'message': 'Invalid parameter: Line range'
+            }
+            return JsonResponse(data, status=400)
+
+        submission = getattr(match, f'{submission_type}_submission')
+        with SubmissionFile(request.user.user_id, job_id, FILES_NAME, submission.submission_id) as source:
+            if not source.exists():
+                data = {
+                    'message': f'Submission does not exist ({submission.submission_id})'
+                }
+                return JsonResponse(data, status=404)
+            text = source.read_lines(first_line, last_line)
+
+        data = {
+            'submission': submission_type,
+            'from': first_line,
+            'to': last_line,
+            'text': text
+        }
+        return JsonResponse(data)
@@ -1,6 +1,5 @@
 
 # Helper methods
-import time
 import os
 import sys
 import inspect
@@ -61,9 +60,13 @@ class capture_in(LocalsCapture):
         self.namespace[name] = value
 
 
+# Commands which start the server (runserver is WSGI-only, so does not stream job updates)
+SERVER_COMMANDS = ('runserver', 'serve')
+
+
 def is_main_thread():
     """Check if running in main thread"""
-    return os.environ.get('RUN_MAIN') != 'true' and 'runserver' in sys.argv
+    return os.environ.get('RUN_MAIN') != 'true' and any(command in sys.argv for command in SERVER_COMMANDS)
 
 
 def is_testing():
@@ -71,18 +74,9 @@ def is_testing():
     return bool(os.environ.get('IS_TESTING'))
 
 
-def retry(min_time, max_time, base, max_retry_duration, first_instant):
-    """Helper method for retrying with a capped exponential backoff with max retry time"""
-
-    attempt_number = 0
-    if first_instant:
-        yield attempt_number, 0
-        attempt_number += 1
-
-    start_time = time.time()
-    while time.time() < start_time + max_retry_duration:
-        time2 = min(max(base ** attempt_number, min_time),
-                   max_time)  # Current sleep time
+def get_retry_time(attempt_number, min_time, max_time, base, first_instant):
+    """Get the time to wait after an attempt, using a capped exponential backoff"""
+    if first_instant and attempt_number == 0:
+        return 0
+    return min(max(base ** attempt_number, min_time), max_time)
 
-        yield attempt_number, time2
-        attempt_number += 1
@@ -0,0 +1,25 @@
+# HTTP helpers
+import json
+import hashlib
+from django.http.response import JsonResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+def conditional_json_response(request, data):
+    """Create a JSON response with an ETag (of its data), or 304 (Not Modified) if the client has it.
+
+    Clients are asked to revalidate every time (no-cache), so browsers send
+    If-None-Match automatically, and unchanged responses are not sent again.
+    """
+
+    content = json.dumps(data, cls=DjangoJSONEncoder, sort_keys=True)
+    etag = quote_etag(hashlib.sha1(content.encode()).hexdigest())
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = JsonResponse(data, status=200, safe=False)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
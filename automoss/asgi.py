@@ -3,6 +3,9 @@ ASGI config for automoss project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Streams of job updates (Server-Sent Events) are handled here directly, as
+long-lived responses, and every other request is handled by Django.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 """
@@ -13,4 +16,16 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'automoss.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Must be imported once Django has been set up
+from django.urls import reverse  # noqa: E402
+from automoss.apps.jobs.stream import job_stream  # noqa: E402
+
+STREAM_PATHS = {reverse('jobs:stream'), reverse('api:jobs:stream')}
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] in STREAM_PATHS:
+        return await job_stream(scope, receive, send)
+    return await django_application(scope, receive, send)
@@ -182,6 +182,17 @@ TESTS_ROOT = BASE_DIR / 'tests'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Cache (Redis), used for sessions so that authenticating frequent requests
+# (e.g., polling job statuses) does not read sessions from the database
+# https://docs.djangoproject.com/en/4.0/topics/cache/
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f'{REDIS_URL}/1',
+    }
+}
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
 # +-----------------+
 # | CUSTOM SETTINGS |
 # +-----------------+
@@ -197,6 +208,45 @@ CELERY_RESULT_SERIALIZER = 'json'
 # TODO min(num processors, 4)
 CELERY_CONCURRENCY = 4  # None
 
+# Jobs are processed in stages (see apps/jobs/tasks.py), each with its own queue.
+# Uploading to (and waiting for) MOSS, and downloading reports, mostly waits on
+# sockets, so can use many workers; parsing and storing reports uses the CPU.
+MOSS_QUEUE = 'moss'
+FETCH_QUEUE = 'fetch'
+PARSE_QUEUE = 'parse'
+NOTIFY_QUEUE = 'notify'
+
+# Number of workers started for each queue (by manage.py)
+CELERY_QUEUE_CONCURRENCY = {
+    MOSS_QUEUE: 16,
+    FETCH_QUEUE: 4,
+    PARSE_QUEUE: CELERY_CONCURRENCY,
+    NOTIFY_QUEUE: 1
+}
+
+CELERY_ROUTES = {
+    'Upload': {'queue': MOSS_QUEUE},
+    'UploadAsync': {'queue': MOSS_QUEUE},
+    'FetchReport': {'queue': FETCH_QUEUE},
+    'ParseReport': {'queue': PARSE_QUEUE},
+    'Notify': {'queue': NOTIFY_QUEUE}
+}
+
+# Run each stage immediately (in the same process) when testing
+CELERY_ALWAYS_EAGER = is_testing()
+
+# MOSS server
+# While testing, a local stand-in for MOSS is used (see automoss/apps/moss/server.py).
+# These can also be set to point at any other server which speaks the MOSS protocol.
+if is_testing():
+    MOSS_URL = os.getenv('MOSS_URL', 'localhost')
+    HTTP_MOSS_URL = os.getenv('HTTP_MOSS_URL', f'http://{MOSS_URL}:7691')
+else:
+    MOSS_URL = os.getenv('MOSS_URL', 'moss.stanford.edu')
+    HTTP_MOSS_URL = os.getenv('HTTP_MOSS_URL', f'http://{MOSS_URL}')
+
+MOSS_PORT = int(os.getenv('MOSS_PORT', 7690))
+
 # Contexts
 LANGUAGE_CONTEXT = {}
 with capture_in(LANGUAGE_CONTEXT):
@@ -239,6 +289,12 @@ ARCHIVE_CONTEXT = {}
 with capture_in(ARCHIVE_CONTEXT):
     SUPPORTED_ARCHIVES = ["rar", "tar", "tar.bz2", "tar.gz", "tar.xz", "zip"]
 
+    # Archive of a class's submissions, extracted by the server (see apps/jobs/archives.py)
+    ARCHIVE_NAME = 'archive'
+    MAX_EXTRACTED_SIZE = 1024 * 1024 * 1024  # Bytes, of all files extracted from an archive
+    MAX_EXTRACTED_FILES = 50000  # Files, including those of nested archives
+    MAX_ARCHIVE_DEPTH = 3  # Levels of archives (e.g., of the class, of each student, within those)
+
 MOSS_CONTEXT = {}
 with capture_in(MOSS_CONTEXT):
     # Moss defaults
@@ -293,6 +349,13 @@ with capture_in(JOB_CONTEXT):
     JOB_UPLOAD_TEMPLATE = f'{JOB_URL_TEMPLATE}/uploads'
     SUBMISSION_UPLOAD_TEMPLATE = f'{JOB_UPLOAD_TEMPLATE}/{{file_type}}/{{file_id}}'
 
+    # Line index of each submission (see apps/jobs/lines.py)
+    SUBMISSION_LINES_TEMPLATE = f'{JOB_URL_TEMPLATE}/lines/{{file_type}}/{{file_id}}'
+
+    # Downloaded pages of the job's MOSS report (compressed)
+    JOB_REPORT_CACHE_TEMPLATE = f'{JOB_URL_TEMPLATE}/reports'
+    MAX_REPORT_CACHE_SIZE = 64 * 1024 * 1024  # Bytes, per job
+
     MIN_RETRIES_COUNT = 3
     MIN_RETRY_TIME = 30
     MAX_RETRY_TIME = 600
@@ -300,6 +363,24 @@ with capture_in(JOB_CONTEXT):
     EXPONENTIAL_BACKOFF_BASE = 1.25  # 1<=x<=2
     FIRST_RETRY_INSTANT = True
 
+    # Run jobs on an event loop in each worker (using the asyncio MOSS client),
+    # so that one worker process can wait on many MOSS sessions at once
+    USE_ASYNC_JOBS = False
+    MAX_ASYNC_JOBS = 64  # Per worker process
+
+    # Only read the report's index page when parsing, and fetch which lines of
+    # a match are similar once it is first viewed (or in the background)
+    LAZY_MATCH_DETAILS = False
+    PREFETCH_MATCH_DETAILS = True
+
+    # Number of matches written to the database per query
+    MATCH_BATCH_SIZE = 500
+
+    # Cancellations are published to the workers waiting on MOSS (see
+    # apps/jobs/cancel.py), which also check the flags of their jobs, in
+    # case a cancellation was missed (e.g., while reconnecting to Redis)
+    CANCEL_POLL_INTERVAL = 30  # Seconds
+
 
 MATCH_CONTEXT = {}
 with capture_in(MATCH_CONTEXT):
@@ -318,6 +399,12 @@ with capture_in(MATCH_CONTEXT):
         '128,128,0'
     ]
 
+    # Matches of large files are windowed: only similar sections (and the
+    # lines around them) are sent, and the rest is loaded when expanded
+    MATCH_WINDOW_MIN_LINES = 2000  # Lines, of either file, from which matches are windowed by default
+    MATCH_WINDOW_CONTEXT_LINES = 10  # Lines shown before and after each similar section
+    MAX_MATCH_LINES_REQUEST = 50000  # Lines, returned by one request for collapsed lines
+
 
 JOB_EVENT_CONTEXT = {}
 with capture_in(JOB_EVENT_CONTEXT):
@@ -331,11 +418,26 @@ with capture_in(JOB_EVENT_CONTEXT):
     CANCELLED_EVENT = 'CAN'
     RETRY_EVENT = 'RET'
 
+JOB_STAGE_CONTEXT = {}
+with capture_in(JOB_STAGE_CONTEXT):
+    # Stages of processing a job (see apps/jobs/tasks.py)
+    UPLOAD_STAGE = 'UPL'
+    FETCH_STAGE = 'FET'
+    PARSE_STAGE = 'PAR'
+    NOTIFY_STAGE = 'NOT'
+
 # UI Defaults
 UI_CONTEXT = {}
 with capture_in(UI_CONTEXT):
     POLLING_TIME = 2000  # in milliseconds
     MOSS_POLLING_TIME = 30000  # in milliseconds
+    JOBS_SYNC_TIME = 10000  # in milliseconds
+    JOBS_SYNC_MARGIN = 60000  # in milliseconds, by which each sync overlaps the last (as jobs are saved before committing)
+    # Streams of job updates are pushed by job events (see apps/jobs/stream.py),
+    # and idle streams are sent a comment, to keep their connection open
+    STREAM_KEEP_ALIVE_TIME = 15000  # in milliseconds
+    JOBS_PAGE_SIZE = 50  # Jobs loaded per request
+    MATCHES_PAGE_SIZE = 100  # Matches displayed per page of a result
     MAX_FILE_SIZE = 100000000 # in bytes
 
 # Misc Constants
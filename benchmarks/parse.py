@@ -0,0 +1,93 @@
+"""Benchmark parsing MOSS match pages.
+
+Compares MossMatch (lxml) against the previous BeautifulSoup implementation,
+over the recorded match page in tests/test_files/reports and larger pages
+rendered in the same layout by the local MOSS server.
+
+Usage:
+    python benchmarks/parse.py [--repeat 200]
+"""
+
+import os
+import re
+import sys
+import glob
+import argparse
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bs4 import BeautifulSoup  # noqa: E402
+from automoss.apps.moss.moss import MossMatch  # noqa: E402
+from automoss.apps.moss.server import LocalMatch, render_match  # noqa: E402
+
+
+def parse_with_beautifulsoup(html):
+    """Previous implementation of MossMatch.__init__"""
+    soup = BeautifulSoup(html, 'lxml')
+    table = soup.find('table')
+    rows = iter(table.find_all('tr'))
+
+    header = next(rows)
+
+    def parse_name_percentage(tag):
+        return re.search(r'(\S+)\s+\((\d+)%\)', tag.get_text(strip=True)).groups()
+
+    def parse_from_to(tag):
+        info = list(map(int, tag.get_text(strip=True).split('-')))
+        return {'from': info[0], 'to': info[1]}
+
+    a, _, b, _, _ = header.find_all('th')
+    name_1, percentage_1 = parse_name_percentage(a)
+    name_2, percentage_2 = parse_name_percentage(b)
+
+    line_matches = []
+    lines_matched = 0
+    for tr in rows:
+        a, _, b, _ = tr.find_all('td')
+        first, second = [parse_from_to(x) for x in (a, b)]
+        line_matches.append({'first': first, 'second': second})
+        lines_matched += max(x['to'] - x['from'] for x in (first, second)) + 1
+
+    return name_1, percentage_1, name_2, percentage_2, line_matches, lines_matched
+
+
+def parse_with_lxml(html):
+    match = MossMatch(html)
+    return (match.name_1, match.percentage_1, match.name_2, match.percentage_2,
+            match.line_matches, match.lines_matched)
+
+
+def get_pages():
+    pages = {}
+    for path in glob.glob(os.path.join(ROOT, 'tests', 'test_files', 'reports', '*.html')):
+        with open(path) as f:
+            pages[os.path.basename(path)] = f.read()
+
+    for num_blocks in (10, 100):
+        blocks = [((i * 10 + 1, i * 10 + 8), (i * 12 + 1, i * 12 + 8))
+                  for i in range(num_blocks)]
+        match = LocalMatch('STUDENT001.py', 'STUDENT002.py', blocks,
+                           num_blocks * 10, num_blocks * 12)
+        pages[f'rendered ({num_blocks} blocks)'] = render_match(0, match)
+
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    for name, html in get_pages().items():
+        assert parse_with_beautifulsoup(html) == parse_with_lxml(html), name
+
+        old = timeit.timeit(lambda: parse_with_beautifulsoup(html), number=args.repeat)
+        new = timeit.timeit(lambda: parse_with_lxml(html), number=args.repeat)
+        print(f'{name:>24}: BeautifulSoup {old / args.repeat * 1e6:9.1f} us'
+              f' | lxml {new / args.repeat * 1e6:9.1f} us | {old / new:5.1f}x faster')
+
+
+if __name__ == '__main__':
+    main()
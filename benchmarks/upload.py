@@ -0,0 +1,96 @@
+"""Benchmark uploading files to MOSS.
+
+Compares streaming uploads (MossAPIWrapper.upload_file) against reading each
+file into memory and using MossAPIWrapper.upload_raw_file, in terms of
+throughput (bytes/sec) and peak (Python) memory usage.
+
+Files are sent to a local socket which discards everything it receives.
+
+Usage:
+    python benchmarks/upload.py [--num-files 200] [--file-size 2000000]
+"""
+
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from automoss.apps.moss.moss import MossAPIWrapper  # noqa: E402
+
+
+def start_sink():
+    """Start a server which discards all data sent to it, returning its address"""
+    server = socket.create_server(('localhost', 0))
+
+    def discard():
+        while True:
+            conn, _ = server.accept()
+            buffer = bytearray(1 << 16)
+            with conn:
+                while conn.recv_into(buffer):
+                    pass
+
+    threading.Thread(target=discard, daemon=True).start()
+    return server.getsockname()
+
+
+def upload_streaming(moss, paths):
+    for index, path in enumerate(paths, start=1):
+        moss.upload_file(path, 'python', index)
+
+
+def upload_in_memory(moss, paths):
+    for index, path in enumerate(paths, start=1):
+        with open(path, 'rb') as f:
+            moss.upload_raw_file(path, f.read(), 'python', index)
+
+
+def run(method, address, paths):
+    moss = MossAPIWrapper(1)
+    moss.socket.connect(address)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    method(moss, paths)
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    moss.socket.close()
+    return duration, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--num-files', type=int, default=200)
+    parser.add_argument('--file-size', type=int, default=2_000_000)
+    args = parser.parse_args()
+
+    address = start_sink()
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths = []
+        for i in range(args.num_files):
+            path = os.path.join(directory, f'STUDENT{i:04d}.py')
+            with open(path, 'wb') as f:
+                f.write(os.urandom(args.file_size))
+            paths.append(path)
+
+        total_bytes = args.num_files * args.file_size
+        print(f'Uploading {args.num_files} files of {args.file_size} bytes')
+
+        for name, method in (('upload_raw_file', upload_in_memory),
+                             ('upload_file', upload_streaming)):
+            duration, peak = run(method, address, paths)
+            print(f'{name:>16}: {total_bytes / duration / 1e6:10.1f} MB/s'
+                  f' | peak memory {peak / 1e6:8.2f} MB')
+
+
+if __name__ == '__main__':
+    main()
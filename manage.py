@@ -7,7 +7,8 @@ import threading
 from subprocess import Popen, DEVNULL, STDOUT
 from automoss.settings import (
     DEBUG,
-    CELERY_CONCURRENCY
+    CELERY_CONCURRENCY,
+    CELERY_QUEUE_CONCURRENCY
 )
 from automoss.redis import REDIS_PORT
 from automoss.apps.utils.core import is_main_thread, is_testing
@@ -55,6 +56,10 @@ def main():
         if is_test_mode:
             from celery.contrib.testing.worker import start_worker
             from automoss.celery import app
+            from automoss.apps.moss.server import LOCAL_MOSS_SERVER
+
+            # Start local MOSS server (tests do not depend on moss.stanford.edu)
+            LOCAL_MOSS_SERVER.start()
 
             start_worker(app)
 
@@ -67,13 +72,22 @@ def main():
             else:
                 celery_args.append('--loglevel=INFO')
 
-            if CELERY_CONCURRENCY is not None:
-                celery_args.extend(['--concurrency', str(CELERY_CONCURRENCY)])
-            start_service(celery_args)
+            def start_celery_worker(queue=None, concurrency=CELERY_CONCURRENCY):
+                args = celery_args.copy()
+                if queue is not None:
+                    args.extend(['-Q', queue, '-n', f'{queue}@%h'])
+                if concurrency is not None:
+                    args.extend(['--concurrency', str(concurrency)])
+                start_service(args)
+
+            start_celery_worker()
 
             # Start email worker:
-            celery_args.extend(['-Q', 'email'])
-            start_service(celery_args)
+            start_celery_worker('email')
+
+            # Start a worker for each stage of processing jobs
+            for queue, concurrency in CELERY_QUEUE_CONCURRENCY.items():
+                start_celery_worker(queue, concurrency)
 
     try:
         from django.core.management import execute_from_command_line
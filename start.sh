@@ -1 +1 @@
-service mysql start && python3 manage.py runserver 0.0.0.0:80
\ No newline at end of file
+service mysql start && python3 manage.py serve 0.0.0.0:80
\ No newline at end of file
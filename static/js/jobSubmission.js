@@ -428,6 +428,7 @@ createJobForm.onsubmit = async (e) => {
 					let json = xhr.response;
 					addJob(json, true);
 					unfinishedJobs.push(json["job_id"]);
+					streamJobs();
 
 					// Hide and reset the form and dropzone.
 					createJobModal.hide();
@@ -49,9 +49,13 @@ function getLastCompletedEvent(jobId){
  */
 function updateJobStatus(jobId, status){
 	// Badge
-	document.querySelector(`tr[job_id="${jobId}"]`).setStatus(status);
+	let jobRow = document.querySelector(`tr[job_id="${jobId}"]`);
+	jobRow.setStatus(status);
 	if(isTerminalState(status)){
 		unfinishedJobs = unfinishedJobs.filter(item => item !== jobId);
+		if (!jobRow.completion_date){
+			syncJobs(); // Load the completion date.
+		}
 	}
 	// Timeline
 	let jobTimeline = document.getElementById(`job-timeline-${jobId}`);
@@ -83,19 +87,27 @@ function updateJobOptions(jobId, status){
 }
 
 /**
- * Update the logs for a job in the table.
+ * Update the logs for a job in the table. If append is set, the logs are added to the existing logs.
  */
-function updateJobLogs(jobId, logs){
+function updateJobLogs(jobId, logs, append=false){
 	let jobLogs = document.getElementById(`job-logs-${jobId}`);
 
 	let tmpLogs = "";
-	jobLogs.prevEvents = [];
+	if (append && jobLogs.prevLogs){
+		tmpLogs = jobLogs.prevLogs + "\n";
+	}else{
+		jobLogs.prevEvents = [];
+	}
 
 	for (let log in logs){
+		if (append && logs[log].id <= jobLogs.cursor){
+			continue; // Already received (e.g., by an overlapping request).
+		}
 		tmpLogs += logs[log].str + "\n";
 		if (logs[log].type){
 			jobLogs.prevEvents.push(logs[log].type); // Record previous events.
 		}
+		jobLogs.cursor = logs[log].id; // Id of the last event received.
 	}
 	tmpLogs = trimRight(tmpLogs, 1); // Remove last newline character.
 
@@ -107,8 +119,8 @@ function updateJobLogs(jobId, logs){
 /**
  * Retrieve a list of jobs (based on the list of ids provided) and perform an operation on each of them.
  */
-async function performOperationOnJobs(url, jobIds, operation){
-	let result = await fetch(url + "?" + new URLSearchParams({job_ids: jobIds}));
+async function performOperationOnJobs(url, jobIds, operation, params={}){
+	let result = await fetch(url + "?" + new URLSearchParams({job_ids: jobIds, ...params}));
 	let json = await result.json();
 	for (let key in json){
 		operation(key, json[key]);
@@ -119,10 +131,49 @@ async function performOperationOnJobs(url, jobIds, operation){
  * Update all the jobs in the table.
  */
 async function updateJobs(jobs){
-	await performOperationOnJobs(GET_JOB_LOGS_URL, jobs, updateJobLogs);
+	// Only retrieve the events after the last event received for each job.
+	let since = jobs.map(jobId => document.getElementById(`job-logs-${jobId}`).cursor || 0);
+	await performOperationOnJobs(GET_JOB_LOGS_URL, jobs, (jobId, logs) => updateJobLogs(jobId, logs, true), {since: since});
 	await performOperationOnJobs(GET_JOB_STATUSES_URL, jobs, updateJobStatus);
 }
 
+let jobStream = null;
+let usePolling = typeof EventSource === "undefined";
+
+/**
+ * Stream the status and log updates of all unfinished jobs in the table (replacing the previous stream).
+ * If streaming is unavailable (e.g., not served with ASGI), the jobs are polled instead.
+ */
+function streamJobs(){
+	if (jobStream !== null){
+		jobStream.close();
+		jobStream = null;
+	}
+	if (usePolling || unfinishedJobs.length == 0){
+		return;
+	}
+
+	let stream = jobStream = new EventSource(STREAM_JOBS_URL + "?" + new URLSearchParams({job_ids: unfinishedJobs}));
+	stream.addEventListener("logs", (e) => {
+		let data = JSON.parse(e.data);
+		updateJobLogs(data.job_id, data.logs, data.append);
+	});
+	stream.addEventListener("status", (e) => {
+		let data = JSON.parse(e.data);
+		updateJobStatus(data.job_id, data.status);
+	});
+	stream.addEventListener("done", () => {
+		stream.close();
+	});
+	stream.onerror = () => {
+		// Lost streams reconnect automatically, but are closed if unavailable
+		if (stream.readyState === EventSource.CLOSED && stream === jobStream){
+			usePolling = true;
+			jobStream = null;
+		}
+	};
+}
+
 /**
  * Update the remove job modal.
  */
@@ -148,7 +199,9 @@ function cancelJob(job){
 		}
 	}).then(() => {
 		cancelButton.disabled = false;
-		updateJobs(unfinishedJobs);
+		if (usePolling){
+			updateJobs(unfinishedJobs);
+		}
 	});
 }
 
@@ -170,7 +223,11 @@ function retryJob(job){
 	}).then((d) => {
 		if (d.status == 200){
 			unfinishedJobs.push(job.job_id)
-			updateJobs(unfinishedJobs);
+			if (usePolling){
+				updateJobs(unfinishedJobs);
+			}else{
+				streamJobs();
+			}
 		}else{
 			console.error(d)
 		}
@@ -197,8 +254,9 @@ function retryJob(job){
 /**
  * Add a job to the jobs table. If force open is set, the job's info collapsible will be toggled
  * open by default. (Necessary when creating the job using the job submission modal).
+ * If at end is set, the job is added to the end of the table (i.e., when loading older jobs).
  */
-function addJob(job, forceOpen=false){
+function addJob(job, forceOpen=false, atEnd=false){
 	noJobsMessage.style.display = 'none';
 
 	// Info
@@ -281,31 +339,137 @@ function addJob(job, forceOpen=false){
 	if (forceOpen){
 		jobRow.showInfo(true);
 	}
-	jobsTableBody.prepend(jobInfo);
-	jobsTableBody.prepend(jobRow);
+	if (atEnd){
+		jobsTableBody.append(jobRow);
+		jobsTableBody.append(jobInfo);
+	}else{
+		jobsTableBody.prepend(jobInfo);
+		jobsTableBody.prepend(jobRow);
+	}
 }
 
 let unfinishedJobs = [];
-let result = fetch(GET_JOBS_URL).then(async (response)=>{
+let jobsUpdated = null; // Time (given by the server) after which changes to jobs have not been loaded.
+let jobsNext = null; // Cursor of the next page of (older) jobs, or null if all have been loaded.
+let oldestJob = null; // Creation date of the oldest job loaded.
+
+let loadMoreButton = document.getElementById('load-more-jobs-button');
+
+/**
+ * Load a page of jobs (older than those in the table), adding them to the end of the table.
+ * Jobs which are already in the table (e.g., added by a sync) are skipped.
+ */
+async function loadJobsPage(params={}){
+	let response = await fetch(GET_JOBS_URL + "?" + new URLSearchParams(params));
 	let json = await response.json();
+	if (jobsUpdated === null){
+		jobsUpdated = json.updated;
+	}
+	jobsNext = json.next;
+	loadMoreButton.hidden = jobsNext === null;
+
 	let jobIDs = [];
-	json.forEach(item => {
-		addJob(item);
+	let restream = false;
+	json.jobs.forEach(item => {
+		oldestJob = item.creation_date;
+		if (document.getElementById(`job-${item.job_id}`) !== null){
+			return;
+		}
+		addJob(item, false, true);
 		if (!isTerminalState(item.status)){
 			unfinishedJobs.push(item.job_id);
+			restream = true;
 		}
 		jobIDs.push(item.job_id);
 	});
+	return [jobIDs, restream];
+}
 
-	updateJobs(jobIDs); // Update all jobs on load.
-	if(json.length == 0){
+/**
+ * Load the jobs table: the first page of jobs is loaded, and older jobs are loaded on demand (see loadMoreJobs).
+ */
+async function loadJobs(){
+	let [jobIDs] = await loadJobsPage();
+	if(jobIDs.length == 0){
 		noJobsMessage.style.display = 'block';
 	}
-});
 
-// Update the status and event logs of all unfinished jobs in the table.
+	streamJobs();
+	updateJobs(jobIDs); // Update all jobs on load.
+
+	// Only load the jobs which have changed since (e.g., in another tab)
+	setInterval(syncJobs, JOBS_SYNC_TIME);
+}
+
+/**
+ * Load the next page of (older) jobs.
+ */
+async function loadMoreJobs(){
+	if (jobsNext === null){
+		return;
+	}
+	loadMoreButton.disabled = true;
+	let [jobIDs, restream] = await loadJobsPage({before: jobsNext});
+	loadMoreButton.disabled = false;
+
+	if (restream){
+		streamJobs();
+	}
+	updateJobs(jobIDs);
+}
+
+/**
+ * Load the jobs which have changed since the jobs table was last loaded (or synced), and remove those which were removed.
+ * Syncs overlap, so jobs which are already in the table are only updated.
+ */
+async function syncJobs(){
+	if (jobsUpdated === null){
+		return; // Not loaded yet
+	}
+	let response = await fetch(GET_JOBS_URL + "?" + new URLSearchParams({updated_since: jobsUpdated}));
+	let json = await response.json();
+	jobsUpdated = json.updated;
+
+	for (let jobId of json.removed){
+		let jobRow = document.getElementById(`job-${jobId}`);
+		if (jobRow !== null){
+			document.getElementById(`job-info-${jobId}`).remove();
+			jobRow.remove();
+		}
+		unfinishedJobs = unfinishedJobs.filter(item => item !== jobId);
+	}
+
+	let restream = false;
+	for (let item of json.jobs.reverse()){ // Oldest first, so that new jobs are added in order
+		let jobRow = document.getElementById(`job-${item.job_id}`);
+		if (jobRow === null){
+			if (jobsNext !== null && item.creation_date < oldestJob){
+				continue; // Loaded with its page
+			}
+			noJobsMessage.style.display = 'none';
+			addJob(item);
+			updateJobs([item.job_id]);
+		}else{
+			jobRow.completion_date = item.completion_date;
+			if (jobRow.status != item.status){
+				updateJobStatus(item.job_id, item.status);
+			}
+		}
+		if (!isTerminalState(item.status) && !unfinishedJobs.includes(item.job_id)){
+			unfinishedJobs.push(item.job_id);
+			restream = true;
+		}
+	}
+	if (restream){
+		streamJobs();
+	}
+}
+
+loadJobs();
+
+// Update the status and event logs of all unfinished jobs in the table (if they are not streamed).
 setInterval(async function(){
-	if(unfinishedJobs.length != 0){		
+	if(usePolling && unfinishedJobs.length != 0){
 		updateJobs(unfinishedJobs);
 	}
 }, POLLING_TIME);
@@ -68,6 +68,11 @@ function addStr(str, index, stringToAdd){
  * it can be viewed offline.
  */
 async function downloadReport(){
+	// Lines collapsed in the windowed match view are included
+	if (typeof expandAllLines === "function"){
+		await expandAllLines();
+	}
+
 	let extractions = [extract("link", onExternalLink), extract("style"), extract("script", onExternalScript)];	
 	let [links, styles, scripts] = await Promise.all(extractions);
 